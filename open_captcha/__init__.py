@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import importlib
 import io
 import os
 
@@ -7,10 +8,43 @@ from .common_types import (
     InputTable, TemplateConfig,
     RenderingOptions, ChallengeId, Challenge, ServerContext
 )
-from .captcha_generator import CaptchaGenerator
-from .challenge_templates import (
-    UnknownTemplate, BadTemplateParameters, ChallengeTemplate
+from .verification import ResponseVerifier
+from .metrics import CaptchaMetrics
+from .tokens import TokenSigner, ReplayFilter, InvalidToken
+from .render_cache import RenderCache
+from .bundle import ChallengeBundle
+from .context_store import (
+    ContextStore, InMemoryContextStore, RedisContextStore
 )
 
+# Names that pull in numpy, pandas or matplotlib are only imported when first
+# accessed, so e.g. verification-only services start quickly.
+_LAZY_NAMES = {
+    'CaptchaGenerator': 'captcha_generator',
+    'ChallengePool': 'challenge_pool',
+    'PoolStats': 'challenge_pool',
+    'UnknownTemplate': 'challenge_templates',
+    'BadTemplateParameters': 'challenge_templates',
+    'ChallengeTemplate': 'challenge_templates',
+    'TableStream': 'streaming',
+    'SharedTablesFile': 'shared_tables',
+}
+
+
+def __getattr__(name: str):
+    try:
+        module_name = _LAZY_NAMES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    value = getattr(importlib.import_module(f'.{module_name}', __name__),
+                    name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES))
+
+
 VERSION_FILE = os.path.join(os.path.dirname(__file__), 'VERSION')
 __version__ = io.open(VERSION_FILE, encoding='utf-8').readline().strip()
@@ -0,0 +1,175 @@
+"""Bundles of challenges rendered ahead of time.
+
+A bundle is a single file of pre-rendered challenges, written by
+`write_bundle()` (or `open-captcha pregenerate`, see cli.py) and served by
+`ChallengeBundle`, which memory-maps it. Worker processes that open the same
+bundle share its pages through the OS page cache. `ChallengeBundle.get_chart()`
+returns a chart without copying it.
+
+The correct answers are stored sealed by a `TokenSigner`, so the bundle file
+doesn't give them away, and the same keys are needed to serve it.
+
+File layout (little-endian):
+    magic (8) | number of entries (8) | index offset (8) |
+    entries: chart | JSON [question, possible answers] | sealed answer |
+    index: per entry, offset (8) | chart, JSON and sealed answer sizes (4 each)
+
+Serving a bundle doesn't need the rendering and table handling dependencies.
+"""
+import json
+import mmap
+import os
+import secrets
+import struct
+from typing import Iterable, Tuple
+
+from .common_types import (
+    CaptchaError, Challenge, ChallengeId, ServerContext
+)
+from .metrics import CaptchaMetrics
+from .tokens import ReplayFilter, TokenSigner
+from .verification import ResponseVerifier, _get_timestamp, normalize_answer
+
+BUNDLE_MAGIC = b'OCBUNDL1'
+_HEADER = struct.Struct('<8sQQ')
+_ENTRY = struct.Struct('<QIII')
+
+
+class BadBundle(CaptchaError):
+    pass
+
+
+def write_bundle(path: str,
+                 challenges: Iterable[Tuple[Challenge, str]],
+                 token_signer: TokenSigner) -> int:
+    """Write (challenge, correct answer) pairs to a bundle file.
+
+    The challenges are streamed to the file, only their index is kept in
+    memory. The file is replaced at once when complete, so servers never map
+    a partial bundle. Returns the number of challenges written.
+    """
+    index = []
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(BUNDLE_MAGIC, 0, 0))
+        offset = _HEADER.size
+        for challenge, correct_answer in challenges:
+            text = json.dumps(
+                [challenge.question, list(challenge.possible_answers)],
+                ensure_ascii=False).encode('utf-8')
+            sealed_answer = token_signer.seal(
+                ServerContext(0, 0, normalize_answer(correct_answer))
+            ).encode('ascii')
+            for part in (challenge.chart, text, sealed_answer):
+                f.write(part)
+            index.append(_ENTRY.pack(offset, len(challenge.chart), len(text),
+                                     len(sealed_answer)))
+            offset += len(challenge.chart) + len(text) + len(sealed_answer)
+        f.write(b''.join(index))
+        f.seek(0)
+        f.write(_HEADER.pack(BUNDLE_MAGIC, len(index), offset))
+    os.replace(tmp_path, path)
+    return len(index)
+
+
+class ChallengeBundle(ResponseVerifier):
+    """Serves random challenges from a memory-mapped bundle file.
+
+    Has the `generate_challenge()` and verification interface of
+    `CaptchaGenerator`. `token_signer` must have the key the bundle was
+    written with.
+
+    Serving a challenge doesn't render anything, but isn't free either:
+    `get()` (and so `generate_challenge()`) copies the chart out of the
+    mapped file, decodes the question and possible answers from JSON, and
+    checks and decrypts the sealed answer (an HMAC and a keystream the size
+    of the answer). Use `get_chart()` to avoid the chart copy.
+    """
+    def __init__(self,
+                 path: str,
+                 token_signer: TokenSigner,
+                 response_timeout_sec: int,
+                 num_letters_per_allowed_typo: int = 5,
+                 replay_filter: ReplayFilter = None,
+                 metrics: CaptchaMetrics = None):
+        super().__init__(response_timeout_sec, num_letters_per_allowed_typo,
+                         token_signer, replay_filter, metrics)
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise BadBundle(f'{path} is not a challenge bundle')
+        magic, self._size, self._index_offset = (
+            _HEADER.unpack_from(self._map) if len(self._map) >= _HEADER.size
+            else (None, 0, 0))
+        if (magic != BUNDLE_MAGIC or self._index_offset +
+                self._size * _ENTRY.size != len(self._map)):
+            self._map.close()
+            raise BadBundle(f'{path} is not a challenge bundle')
+        if self._size == 0:
+            self._map.close()
+            raise BadBundle(f'{path} has no challenges')
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _entry(self, index: int) -> Tuple[int, int, int, int]:
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return _ENTRY.unpack_from(
+            self._map, self._index_offset + index * _ENTRY.size)
+
+    def get_chart(self, index: int) -> memoryview:
+        """Return the chart at `index` as a read-only view of the file.
+
+        Unlike `get()`, the chart isn't copied.
+        """
+        offset, chart_size, _, _ = self._entry(index)
+        return memoryview(self._map)[offset:offset + chart_size]
+
+    def get(self, index: int) -> Tuple[Challenge, str]:
+        """Return the challenge at `index` and its correct answer."""
+        offset, chart_size, text_size, answer_size = self._entry(index)
+        text_offset = offset + chart_size
+        answer_offset = text_offset + text_size
+        question, possible_answers = json.loads(
+            self._map[text_offset:answer_offset])
+        _, context = self.token_signer.unseal(
+            self._map[answer_offset:answer_offset + answer_size].decode())
+        chart = self._map[offset:text_offset]
+        return (Challenge(question, chart, possible_answers),
+                context.correct_answer)
+
+    def render_challenge(self) -> Tuple[Challenge, str]:
+        """Return a random challenge of the bundle and its correct answer."""
+        return self.get(secrets.randbelow(self._size))
+
+    def generate_challenge(self, attempt_number: int = 1
+                           ) -> Tuple[ChallengeId, Challenge, ServerContext]:
+        challenge, correct_answer = self.render_challenge()
+        context = ServerContext(_get_timestamp(), attempt_number,
+                                correct_answer)
+        return ChallengeId(secrets.token_hex(16)), challenge, context
+
+    def generate_challenge_token(self, attempt_number: int = 1
+                                 ) -> Tuple[str, Challenge]:
+        """Like `CaptchaGenerator.generate_challenge_token()`."""
+        _, challenge, context = self.generate_challenge(attempt_number)
+        return self.token_signer.seal(context), challenge
+
+    def close(self):
+        """Unmap the bundle.
+
+        If charts from `get_chart()` are still referenced, the file stays
+        mapped until they are garbage collected.
+        """
+        try:
+            self._map.close()
+        except BufferError:  # Exported chart views
+            pass
+
+    def __enter__(self) -> 'ChallengeBundle':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
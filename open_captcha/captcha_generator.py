@@ -1,81 +1,515 @@
-import math
+import asyncio
+import concurrent.futures
+import os
 import secrets
-import time
-from typing import Mapping, Sequence, Tuple
+import threading
+import weakref
+from typing import (
+    Dict, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
+)
 
-import Levenshtein
-import pandas as pd
+import numpy as np
 
 from .common_types import (
     RNG, InputTable, TemplateConfig, ChallengeId, Challenge, ServerContext,
-    RenderingOptions,
+    RenderingOptions, DataTables, ConfigurationError,
 )
-from .challenge_templates import instantiate_templates
+from .challenge_templates import ChallengeTemplate, instantiate_templates
+from .metrics import CaptchaMetrics
+from .render_cache import RenderCache
+from .sampling import TemplateSampler, parse_sampling_options
+from .streaming import TableStream, reduce_streams
+# Aliased, the compact_tables parameter and attribute would shadow it
+from .tables import compact_tables as _compact_tables
+from .tables import load_tables, memory_usage
+from .tokens import ReplayFilter, TokenSigner
+from .verification import ResponseVerifier, _get_timestamp, normalize_answer
 
 
-def _get_timestamp() -> int:
-    return int(time.time())
+# verify_config value for verifying every template by rendering a challenge
+VERIFY_BY_RENDERING = 'render'
 
 
 def _generate_challenge_id() -> ChallengeId:
     return ChallengeId(secrets.token_hex(16))
 
 
-def _verify_timeout(t0: int, timeout: int) -> bool:
-    elapsed_time = _get_timestamp() - t0
-    return elapsed_time <= timeout
+def _templates_using_tables(templates: Sequence[ChallengeTemplate],
+                            table_names: Set[str]
+                            ) -> List[ChallengeTemplate]:
+    result = []
+    for t in templates:
+        referenced = t.referenced_tables()
+        if referenced is None or table_names.intersection(referenced):
+            result.append(t)
+    return result
+
+
+def _columns_used_by(templates: Sequence[ChallengeTemplate]
+                     ) -> Optional[Dict[str, Optional[Set[str]]]]:
+    """Columns read by any of the templates, by table name.
+
+    None (for all tables or for a table) means everything may be read.
+    """
+    columns_by_table: Dict[str, Optional[Set[str]]] = {}
+    for t in templates:
+        tables = t.referenced_tables()
+        if tables is None:
+            return None
+        columns = t.referenced_columns() or {}
+        for table in tables:
+            used = columns.get(table)
+            if used is None or (table in columns_by_table and
+                                columns_by_table[table] is None):
+                columns_by_table[table] = None
+            else:
+                columns_by_table.setdefault(table, set()).update(used)
+    return columns_by_table
+
+
+#################################################################
+# Process pool workers
+#################################################################
+# Per-process state of batch generation workers. It is set up once by
+# `_init_worker()` when the worker process starts, so the tables and templates
+# are not re-sent with every task.
+_worker_state = {}
 
 
-def _verify_text_is_close(correct_answer: str,
-                          user_answer: str,
-                          num_letters_per_allowed_typo: int) -> bool:
-    distance = Levenshtein.distance(user_answer, correct_answer)
-    max_distance = math.ceil(
-        len(correct_answer) / num_letters_per_allowed_typo)
-    return distance <= max_distance
+def _init_worker(data: DataTables,
+                 templates: Sequence[ChallengeTemplate],
+                 sampler: TemplateSampler):
+    _worker_state.update(data=data, templates=templates, sampler=sampler)
 
 
-class CaptchaGenerator:
+def _worker_render_challenges(count: int,
+                              rendering_options: RenderingOptions,
+                              seed_seq: np.random.SeedSequence
+                              ) -> List[Tuple[Challenge, str]]:
+    data = _worker_state['data']
+    templates = _worker_state['templates']
+    sampler = _worker_state['sampler']
+    # Every task brings its own stream, spawned by the generator, so the
+    # challenges don't depend on which worker renders them.
+    rng = RNG(np.random.MT19937(seed_seq))
+    results = []
+    for _ in range(count):
+        template = templates[sampler.sample(rng)]
+        results.append(
+            template.generate_challenge(data, rng, rendering_options))
+    return results
+
+
+class CaptchaGenerator(ResponseVerifier):
     def __init__(self,
                  data: Mapping[str, InputTable],
                  template_configs: Sequence[TemplateConfig],
                  response_timeout_sec: int,
                  num_letters_per_allowed_typo: int = 5,
                  rng_seed: int = None,  # Use for testing only
-                 verify_config: bool = True):
-        self.data = {
-            name: pd.DataFrame.from_records(table)
-            for name, table in data.items()
-        }
-        self.templates = instantiate_templates(template_configs)
-        self.response_timeout_sec = response_timeout_sec
-        self.num_letters_per_allowed_typo = num_letters_per_allowed_typo
+                 verify_config: Union[bool, str] = True,
+                 render_cache: RenderCache = None,
+                 token_signer: TokenSigner = None,
+                 replay_filter: ReplayFilter = None,
+                 metrics: CaptchaMetrics = None,
+                 compact_tables: bool = False,
+                 thread_safe: bool = False):
+        if verify_config not in (True, False, VERIFY_BY_RENDERING):
+            raise ConfigurationError(
+                f'verify_config must be True, False or '
+                f'"{VERIFY_BY_RENDERING}". Got {verify_config}')
+        templates = instantiate_templates(template_configs)
+        # The templates and the sampler picking them are swapped together.
+        self._templates_and_sampler = (
+            templates, TemplateSampler(
+                *parse_sampling_options(template_configs)))
+        self.compact_tables = compact_tables
+        self.data = self._load_tables(data)
+        self.render_cache = render_cache
+        self._attach_render_cache(templates)
+        super().__init__(response_timeout_sec, num_letters_per_allowed_typo,
+                         token_signer, replay_filter, metrics)
+        self.verify_config = verify_config
+        self.thread_safe = thread_safe
         self._non_crypto_rng = RNG(rng_seed)
+        # Thread safe mode gives every thread its own random stream, spawned
+        # from a SeedSequence of rng_seed.
+        self._seed_sequence = np.random.SeedSequence(rng_seed)
+        self._spawn_lock = threading.Lock()
+        # Number of workers of the process pools from create_process_pool()
+        self._pool_workers = weakref.WeakKeyDictionary()
+        self._thread_rngs = threading.local()
+        self._update_lock = threading.Lock()
+        self.configure_async()
 
         # Catch configuration errors early (at config development time by
         # server side programmer)
-        if verify_config:
-            for t in self.templates:
-                t.generate_challenge(self.data, self._non_crypto_rng)
+        self._verify_and_prepare(self.templates, self.data)
+
+    @property
+    def templates(self) -> Sequence[ChallengeTemplate]:
+        return self._templates_and_sampler[0]
+
+    def _attach_render_cache(self, templates: Sequence[ChallengeTemplate]):
+        if self.render_cache is not None:
+            for t in templates:
+                t.render_cache = self.render_cache
+
+    def _load_tables(self, data: Mapping[str, InputTable]) -> DataTables:
+        streams = {name: table for name, table in data.items()
+                   if isinstance(table, TableStream)}
+        tables = load_tables({name: table for name, table in data.items()
+                              if name not in streams})
+        if streams:
+            tables.update(reduce_streams(streams, self.templates))
+        if self.compact_tables:
+            # Drop the tables and columns no template reads and store the rest
+            # in compact dtypes.
+            tables = _compact_tables(tables, _columns_used_by(self.templates))
+        return tables
+
+    def table_memory_usage(self) -> Dict[str, int]:
+        """Bytes of memory used by each of the current data tables."""
+        return memory_usage(self.data)
+
+    def spawn_rng(self) -> RNG:
+        """Return a new random stream, independent of all others spawned.
+
+        For a given `rng_seed`, the n-th stream spawned is always the same.
+        Pass it to `render_challenge()` for challenges reproducible per stream.
+        """
+        (seed_seq,) = self._spawn_seed_sequences(1)
+        return RNG(np.random.MT19937(seed_seq))
+
+    def _spawn_seed_sequences(self, count: int
+                              ) -> List[np.random.SeedSequence]:
+        with self._spawn_lock:
+            return self._seed_sequence.spawn(count)
+
+    def _get_rng(self) -> RNG:
+        if not self.thread_safe:
+            return self._non_crypto_rng
+        rng = getattr(self._thread_rngs, 'rng', None)
+        if rng is None:
+            rng = self._thread_rngs.rng = self.spawn_rng()
+        return rng
+
+    def _render_to_verify(self, template: ChallengeTemplate,
+                          data: DataTables):
+        if not self.thread_safe:
+            template.generate_challenge(data, RNG(0))
+            return
+        # Templates are shared by all threads, so their challenges must only
+        # depend on the data and the RNG they are given.
+        results = [template.generate_challenge(data, RNG(0))
+                   for _ in range(2)]
+        if results[0] != results[1]:
+            raise ConfigurationError(
+                f'{type(template).__name__} generated different challenges '
+                f'from the same random state, so it can\'t be used with '
+                f'thread_safe=True')
+
+    def _verify_templates(self,
+                          templates: Sequence[ChallengeTemplate],
+                          data: DataTables):
+        """Check the templates work with the data, raising if not.
+
+        By default, templates are checked by their cheap `validate()`, and
+        only those without one render a challenge. With
+        `verify_config='render'` all of them do. The renders run in parallel.
+        """
+        if self.verify_config == VERIFY_BY_RENDERING:
+            to_render = list(templates)
+        else:
+            to_render = [t for t in templates if not t.validate(data)]
+        if len(to_render) <= 1:
+            for t in to_render:
+                self._render_to_verify(t, data)
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(len(to_render), os.cpu_count() or 1),
+                thread_name_prefix='open-captcha-verify') as executor:
+            futures = [executor.submit(self._render_to_verify, t, data)
+                       for t in to_render]
+            # Raise the first failure in config order
+            for future in futures:
+                future.result()
+
+    def _verify_and_prepare(self,
+                            templates: Sequence[ChallengeTemplate],
+                            data: DataTables):
+        # Verified first, so that bad configs are reported as such rather than
+        # failing somewhere in prepare().
+        if self.verify_config:
+            self._verify_templates(templates, data)
+        for t in templates:
+            t.prepare(data)
+
+    def update_tables(self, tables: Mapping[str, InputTable]):
+        """Replace (or add) data tables without rebuilding the generator.
+
+        The new snapshot is built and verified on the side, preparing only the
+        templates that read the changed tables, and then swapped in at once.
+        Concurrent `generate_challenge()` calls see either the old or the new
+        tables, never a mix. If verification fails, the old tables are kept.
+
+        Challenges already rendered ahead of time (by a `ChallengePool` or a
+        process pool from `create_process_pool()`) are not affected.
+        """
+        new_tables = self._load_tables(tables)
+        with self._update_lock:
+            data = dict(self.data)
+            data.update(new_tables)
+            affected = _templates_using_tables(self.templates,
+                                               set(new_tables))
+            self._verify_and_prepare(affected, data)
+            self.data = data
+        if self.render_cache is not None:
+            self.render_cache.invalidate_tables(new_tables)
+
+    def update_templates(self, template_configs: Sequence[TemplateConfig]):
+        """Replace the template configs, including their weights and rate
+        caps, without rebuilding the generator.
+
+        The new templates are prepared and verified against the current
+        tables, then swapped in at once. If verification fails, the old
+        templates are kept. With `compact_tables=True` or streamed tables, the
+        new templates can only use the columns and rows that were kept.
+        """
+        templates = instantiate_templates(template_configs)
+        sampler = TemplateSampler(*parse_sampling_options(template_configs))
+        self._attach_render_cache(templates)
+        with self._update_lock:
+            data = self.data
+            self._verify_and_prepare(templates, data)
+            self._templates_and_sampler = (templates, sampler)
 
     def generate_challenge(self,
                            attempt_number: int = 1,
-                           rendering_options: RenderingOptions = None
+                           rendering_options: RenderingOptions = None,
+                           rng: RNG = None
                            ) -> Tuple[ChallengeId, Challenge, ServerContext]:
+        challenge, correct_answer = self.render_challenge(rendering_options,
+                                                          rng)
+        return self.issue_challenge(challenge, correct_answer, attempt_number)
+
+    def generate_challenge_token(self,
+                                 attempt_number: int = 1,
+                                 rendering_options: RenderingOptions = None
+                                 ) -> Tuple[str, Challenge]:
+        """Generate a challenge for the stateless flow.
+
+        Instead of a challenge ID and a server context to store, returns an
+        opaque token carrying the sealed server context, to be sent to the
+        client with the challenge and checked with `verify_token()`.
+        Requires a `token_signer`.
+        """
+        if self.token_signer is None:
+            raise ConfigurationError('Stateless tokens need a token_signer')
+        _, challenge, context = self.generate_challenge(attempt_number,
+                                                        rendering_options)
+        return self.token_signer.seal(context), challenge
+
+    def render_challenge(self, rendering_options: RenderingOptions = None,
+                         rng: RNG = None) -> Tuple[Challenge, str]:
+        """Pick a template and render a challenge with its correct answer.
+
+        This is the expensive part of `generate_challenge()`. The result is
+        not yet tied to a challenge ID or a timestamp, so it can be prepared
+        ahead of time and issued later using `issue_challenge()`.
+
+        `rng` (e.g. from `spawn_rng()`) overrides the generator's random
+        stream, or in thread safe mode, the current thread's.
+        """
+        if rng is None:
+            rng = self._get_rng()
+        # Read once, update_tables() and update_templates() may swap them
+        data = self.data
+        templates, sampler = self._templates_and_sampler
+        index = sampler.sample(rng)
+        template = templates[index]
+        if self.metrics is None:
+            return template.generate_challenge(data, rng, rendering_options)
+        labels = (str(index), template.config_name)
+        return self.metrics.measure_challenge(
+            labels, lambda: template.generate_challenge(
+                data, rng, rendering_options))
+
+    @staticmethod
+    def issue_challenge(challenge: Challenge,
+                        correct_answer: str,
+                        attempt_number: int = 1
+                        ) -> Tuple[ChallengeId, Challenge, ServerContext]:
+        """Stamp a rendered challenge with a fresh ID and server context."""
         challenge_id = _generate_challenge_id()
-        template = self._non_crypto_rng.choice(self.templates)
-        challenge, correct_answer = template.generate_challenge(
-            self.data, self._non_crypto_rng, rendering_options)
-        context = ServerContext(_get_timestamp(),
-                                attempt_number, correct_answer)
+        # Normalized once here, rather than on every verification.
+        context = ServerContext(_get_timestamp(), attempt_number,
+                                normalize_answer(correct_answer))
         return challenge_id, challenge, context
 
-    def verify_response(self,
-                        user_answer: str,
-                        context: ServerContext) -> bool:
-        if not _verify_timeout(context.timestamp, self.response_timeout_sec):
-            return False
-        if not _verify_text_is_close(context.correct_answer, user_answer,
-                                     self.num_letters_per_allowed_typo):
-            return False
-        return True
+    def create_process_pool(self, workers: int = None
+                            ) -> concurrent.futures.ProcessPoolExecutor:
+        """Create a process pool for rendering challenges in parallel.
+
+        Every worker process receives the tables and templates once, when it
+        starts. The pool can be passed to `generate_challenges()` and reused
+        across calls. The caller is responsible for shutting it down.
+        """
+        workers = workers or os.cpu_count() or 1
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.data, *self._templates_and_sampler),
+        )
+        self._pool_workers[executor] = workers
+        return executor
+
+    def generate_challenges(
+            self,
+            count: int,
+            rendering_options: RenderingOptions = None,
+            workers: int = None,
+            executor: concurrent.futures.ProcessPoolExecutor = None,
+    ) -> Iterator[Tuple[ChallengeId, Challenge, ServerContext]]:
+        """Generate `count` challenges, rendering them on multiple cores.
+
+        Rendering is fanned out over a process pool of `workers` processes
+        (default: number of CPUs), or over `executor` if given, which must have
+        been created by `create_process_pool()`. The challenges are yielded in
+        the order they complete, each stamped with a fresh ID and context as it
+        is yielded.
+
+        Every chunk of challenges is rendered from a stream spawned like those
+        of `spawn_rng()`, so with an `rng_seed` the same challenges are
+        rendered whatever the worker they run on, for the same `workers`.
+        """
+        if count < 0:
+            raise ConfigurationError(
+                f'count must not be negative. Got {count}')
+        own_executor = executor is None
+        if own_executor:
+            executor = self.create_process_pool(workers)
+        num_workers = workers or self._pool_workers.get(executor, 1)
+        # Send work in chunks to amortize the inter-process overhead, but keep
+        # them small enough to balance the load and start yielding early.
+        chunk_size = max(1, min(16, count // (4 * num_workers)))
+        starts = range(0, count, chunk_size)
+        futures = []
+        try:
+            for start, seed_seq in zip(
+                    starts, self._spawn_seed_sequences(len(starts))):
+                futures.append(executor.submit(
+                    _worker_render_challenges,
+                    min(chunk_size, count - start), rendering_options,
+                    seed_seq))
+            for future in concurrent.futures.as_completed(futures):
+                for challenge, correct_answer in future.result():
+                    yield self.issue_challenge(challenge, correct_answer)
+        finally:
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=True)
+
+    #################################################################
+    # asyncio API
+    #################################################################
+    def configure_async(self,
+                        executor: concurrent.futures.Executor = None,
+                        max_concurrent_renders: int = None):
+        """Set where `agenerate_challenge()` renders challenges.
+
+        `executor` is a thread pool, or a process pool created by
+        `create_process_pool()`. By default a thread pool with
+        `max_concurrent_renders` threads is created on first use. At most
+        `max_concurrent_renders` renders (default: unlimited for a given
+        executor, 4 otherwise) are submitted at a time.
+        """
+        if executor is None and max_concurrent_renders is None:
+            max_concurrent_renders = 4
+        self._async_executor = executor
+        self._max_concurrent_renders = max_concurrent_renders
+        # One per event loop, since asyncio primitives are bound to a loop
+        self._render_semaphores = weakref.WeakKeyDictionary()
+
+    def _get_async_executor(self) -> concurrent.futures.Executor:
+        if self._async_executor is None:
+            self._async_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._max_concurrent_renders,
+                thread_name_prefix='open-captcha-render')
+        return self._async_executor
+
+    def _submit_render(self, rendering_options: RenderingOptions
+                       ) -> Tuple[concurrent.futures.Future,
+                                  concurrent.futures.Future]:
+        """Submit a render to the async executor.
+
+        Returns the future of the (challenge, correct answer) and the future
+        of the render itself, which is done when the executor is done with it.
+        """
+        executor = self._get_async_executor()
+        if not isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+            future = executor.submit(self.render_challenge, rendering_options)
+            return future, future
+        (seed_seq,) = self._spawn_seed_sequences(1)
+        future = executor.submit(_worker_render_challenges, 1,
+                                 rendering_options, seed_seq)
+        result = concurrent.futures.Future()
+
+        def unwrap(f):
+            if result.done():  # Cancelled by the caller
+                return
+            if f.cancelled():
+                result.cancel()
+            elif f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                result.set_result(f.result()[0])
+
+        def cancel(r):
+            if r.cancelled():
+                # Only succeeds if the render hasn't started
+                future.cancel()
+        future.add_done_callback(unwrap)
+        result.add_done_callback(cancel)
+        return result, future
+
+    async def agenerate_challenge(
+            self,
+            attempt_number: int = 1,
+            rendering_options: RenderingOptions = None
+    ) -> Tuple[ChallengeId, Challenge, ServerContext]:
+        """Like `generate_challenge()`, without blocking the event loop.
+
+        Rendering runs on the executor set by `configure_async()`. If the
+        coroutine is cancelled, a render that hasn't started is dropped and
+        one that has started finishes in the background, still counting
+        towards `max_concurrent_renders` until it does.
+        """
+        loop = asyncio.get_running_loop()
+        if self._max_concurrent_renders is None:
+            future, _ = self._submit_render(rendering_options)
+        else:
+            semaphore = self._render_semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self._max_concurrent_renders)
+                self._render_semaphores[loop] = semaphore
+            await semaphore.acquire()
+            try:
+                future, render = self._submit_render(rendering_options)
+            except BaseException:
+                semaphore.release()
+                raise
+            # Release when the render is actually done, not when the caller
+            # stops waiting for it.
+            render.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(semaphore.release))
+        challenge, correct_answer = await asyncio.wrap_future(future)
+        return self.issue_challenge(challenge, correct_answer, attempt_number)
+
+    async def averify_response(self,
+                               user_answer: str,
+                               context: ServerContext) -> bool:
+        # Verification takes bounded time (see _verify_text_is_close()), so
+        # it runs on the event loop directly.
+        return self.verify_response(user_answer, context)
@@ -0,0 +1,188 @@
+import collections
+import dataclasses
+import logging
+import threading
+from typing import Deque, List, Tuple
+
+from .common_types import (
+    ConfigurationError, RenderingOptions, ChallengeId, Challenge,
+    ServerContext
+)
+from .captcha_generator import CaptchaGenerator
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class PoolStats:
+    hits: int = 0  # Challenges served from the pool
+    misses: int = 0  # Pool was empty, rendered synchronously
+    bypasses: int = 0  # Non-pool rendering options, rendered synchronously
+    rendered: int = 0  # Challenges rendered by the background workers
+    errors: int = 0  # Background renders that raised an exception
+    size: int = 0  # Number of challenges currently in the pool
+
+
+class ChallengePool:
+    """Serve challenges from a queue of pre-rendered ones.
+
+    Background worker threads keep the queue filled: once it drops to
+    `low_watermark` entries they render challenges until it holds
+    `high_watermark` entries again. `generate_challenge()` then only needs to
+    attach a fresh `ChallengeId` and `ServerContext` to a dequeued challenge,
+    so rendering is taken off the request path. If the pool is empty (or
+    different rendering options are requested), the challenge is rendered
+    synchronously, exactly like `CaptchaGenerator.generate_challenge()`.
+
+    Usage:
+        pool = ChallengePool(generator, low_watermark=16, high_watermark=64)
+        with pool:
+            challenge_id, challenge, context = pool.generate_challenge()
+    """
+    def __init__(self,
+                 generator: CaptchaGenerator,
+                 low_watermark: int = 16,
+                 high_watermark: int = 64,
+                 num_workers: int = 1,
+                 rendering_options: RenderingOptions = None):
+        if not 0 <= low_watermark < high_watermark:
+            raise ConfigurationError(
+                'Pool watermarks must satisfy '
+                '0 <= low_watermark < high_watermark. '
+                f'Got {low_watermark}, {high_watermark}')
+        if num_workers < 1:
+            raise ConfigurationError(
+                f'num_workers must be positive. Got {num_workers}')
+        self.generator = generator
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.num_workers = num_workers
+        self.rendering_options = rendering_options
+
+        self._queue: Deque[Tuple[Challenge, str]] = collections.deque()
+        self._cond = threading.Condition()
+        self._refilling = True  # Start by filling the pool up
+        self._in_flight = 0
+        self._stopped = True
+        self._workers: List[threading.Thread] = []
+        self._stats = PoolStats()
+
+    #################################################################
+    # Lifecycle
+    #################################################################
+    def start(self) -> 'ChallengePool':
+        with self._cond:
+            if not self._stopped:
+                return self
+            self._stopped = False
+        self._workers = [
+            threading.Thread(target=self._worker_loop,
+                             name=f'open-captcha-pool-{i}',
+                             daemon=True)
+            for i in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def close(self, timeout: float = None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def __enter__(self) -> 'ChallengePool':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def wait_until_full(self, timeout: float = None) -> bool:
+        """Block until the pool reaches its high watermark.
+
+        Returns False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: len(self._queue) >= self.high_watermark or
+                self._stopped,
+                timeout)
+
+    #################################################################
+    # Generator API
+    #################################################################
+    def generate_challenge(self,
+                           attempt_number: int = 1,
+                           rendering_options: RenderingOptions = None
+                           ) -> Tuple[ChallengeId, Challenge, ServerContext]:
+        if (rendering_options is not None and
+                rendering_options != self.rendering_options):
+            with self._cond:
+                self._stats.bypasses += 1
+            return self.generator.generate_challenge(attempt_number,
+                                                     rendering_options)
+        with self._cond:
+            if self._queue:
+                challenge, correct_answer = self._queue.popleft()
+                self._stats.hits += 1
+            else:
+                challenge = correct_answer = None
+                self._stats.misses += 1
+            if len(self._queue) <= self.low_watermark:
+                self._refilling = True
+                self._cond.notify_all()
+        if challenge is None:
+            challenge, correct_answer = self.generator.render_challenge(
+                self.rendering_options)
+        return self.generator.issue_challenge(challenge, correct_answer,
+                                              attempt_number)
+
+    def verify_response(self,
+                        user_answer: str,
+                        context: ServerContext) -> bool:
+        return self.generator.verify_response(user_answer, context)
+
+    @property
+    def stats(self) -> PoolStats:
+        """A snapshot of the pool counters, to help size the pool."""
+        with self._cond:
+            return dataclasses.replace(self._stats, size=len(self._queue))
+
+    #################################################################
+    # Background refill
+    #################################################################
+    def _needs_render(self) -> bool:
+        if not self._refilling:
+            return False
+        if len(self._queue) + self._in_flight >= self.high_watermark:
+            return False
+        return True
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or self._needs_render())
+                if self._stopped:
+                    return
+                self._in_flight += 1
+            item = None
+            try:
+                item = self.generator.render_challenge(self.rendering_options)
+            except Exception:
+                logger.exception('Failed to pre-render a challenge')
+            with self._cond:
+                self._in_flight -= 1
+                if item is None:
+                    self._stats.errors += 1
+                    # Don't spin on a persistently failing template. The next
+                    # dequeue will re-trigger the refill.
+                    self._refilling = False
+                    continue
+                self._queue.append(item)
+                self._stats.rendered += 1
+                if len(self._queue) >= self.high_watermark:
+                    self._refilling = False
+                self._cond.notify_all()
@@ -1,13 +1,24 @@
 from abc import ABC, abstractmethod
+import collections
+import dataclasses
 import io
-from typing import Sequence, Tuple, Mapping, Type
+import threading
+import time
+from typing import (
+    Any, Callable, Dict, Optional, Sequence, Tuple, Mapping, Type
+)
 
-import matplotlib.figure
+import numpy as np
+import pandas as pd
 
 from .common_types import (
     TemplateConfig, ConfigurationError, Challenge, CaptchaError, DataTables,
     RNG, RenderingOptions
 )
+from . import metrics
+from .distortion import distort_image
+from .image_encoding import encode_image, validate_options
+from .streaming import RowSummary, TopRows
 
 
 #################################################################
@@ -23,15 +34,98 @@ class BadTemplateParameters(ConfigurationError):
 
 class ChallengeTemplate(ABC):
     """Abstract base class for all challenge types."""
+    # Set by CaptchaGenerator when rendered charts should be cached. Templates
+    # that support caching use it through `render_cached()`.
+    render_cache = None
+
     @abstractmethod
     def generate_challenge(self,
                            data: DataTables,
                            rng: RNG,
                            rendering_options: RenderingOptions = None
                            ) -> Tuple[Challenge, str]:
-        """Generate and return a challenge and its correct answer."""
+        """Generate and return a challenge and its correct answer.
+
+        May be called from several threads at once. Besides caches that are
+        safe to share, templates must not keep state between calls: the
+        challenge should only depend on `data` and `rng`.
+        """
         pass  # pragma: no cover
 
+    def validate(self, data: DataTables) -> bool:
+        """Check, without rendering, that challenges can be generated from the
+        data, e.g. that the tables and columns read exist and have the right
+        types. Raise ConfigurationError if not.
+
+        Returns False if the template has no such checks, in which case the
+        generator verifies it by rendering a challenge instead.
+        """
+        return False
+
+    def prepare(self, data: DataTables):
+        """Precompute whatever the template can derive from the data alone.
+
+        Called whenever the data tables are (re)loaded, so that
+        `generate_challenge()` only does the per-challenge work. Templates
+        must still produce correct challenges for tables they were not
+        prepared with.
+        """
+        pass
+
+    def referenced_tables(self) -> Optional[Sequence[str]]:
+        """Names of the data tables this template reads.
+
+        None means the template may read any table.
+        """
+        return None
+
+    def referenced_columns(self) -> Optional[Mapping[str, Sequence[str]]]:
+        """The columns this template reads, by table name.
+
+        Only tables listed by `referenced_tables()` may appear. A table that
+        is missing, or maps to None, may be read in full. None means any
+        column of any referenced table may be read.
+        """
+        return None
+
+    def row_summaries(self) -> Optional[Sequence[RowSummary]]:
+        """New summaries keeping the rows this template may use, for tables
+        given as a `TableStream` (see open_captcha.streaming).
+
+        None means the template needs its tables in full, so they can't be
+        streamed.
+        """
+        return None
+
+    def render_cached(self,
+                      identity: str,
+                      label_value_pairs: Sequence[Tuple[str, float]],
+                      render,
+                      rendering_options: RenderingOptions = None) -> bytes:
+        """Return `render()`, looking it up in the render cache if enabled.
+
+        `identity` must distinguish between differently configured templates
+        and `render` must be a function of `label_value_pairs` and
+        `rendering_options` only. Distorted charts differ for every challenge,
+        so they are not cached.
+        """
+        distorted = (rendering_options is not None and
+                     rendering_options.distortion)
+        if self.render_cache is None or distorted:
+            return render()
+        key = self.render_cache.make_key(identity, label_value_pairs,
+                                         rendering_options)
+        return self.render_cache.get_or_render(key, render,
+                                               self.referenced_tables())
+
+    def __getstate__(self):
+        # The render cache and prepared data are process local, don't send
+        # them to pool workers.
+        state = self.__dict__.copy()
+        state.pop('render_cache', None)
+        state.pop('_prepared', None)
+        return state
+
 
 TemplateClassNameMapping = Mapping[str, Type[ChallengeTemplate]]
 
@@ -50,7 +144,12 @@ def get_class_by_name_mapping() -> TemplateClassNameMapping:
 
 def instantiate_one_template(cls_by_name: TemplateClassNameMapping,
                              config: TemplateConfig) -> ChallengeTemplate:
-    name, params = config
+    if len(config) not in (2, 3):
+        raise ConfigurationError(
+            'A template config is [name, parameters] or '
+            f'[name, parameters, sampling options]. Got {config}')
+    # The sampling options are used by the generator (see sampling.py)
+    name, params = config[0], config[1]
     try:
         cls = cls_by_name[name]
     except KeyError:
@@ -83,24 +182,176 @@ def instantiate_templates(configs: Sequence[TemplateConfig]
 #################################################################
 def save_figure(fig) -> bytes:
     buf = io.BytesIO()
-    fig.savefig(buf, format='png')
+    if not metrics.is_measuring():
+        fig.savefig(buf, format='png')
+        return buf.getvalue()
+    # savefig() draws and then encodes. Split its time between the two phases
+    # at the draw event, which matplotlib fires when drawing is done.
+    start = time.perf_counter()
+    drawn = []
+    callback_id = fig.canvas.mpl_connect(
+        'draw_event', lambda _: drawn.append(time.perf_counter()))
+    try:
+        fig.savefig(buf, format='png')
+    finally:
+        fig.canvas.mpl_disconnect(callback_id)
+    end = time.perf_counter()
+    draw_end = drawn[-1] if drawn else start
+    metrics.record_phase(metrics.RENDER, draw_end - start)
+    metrics.record_phase(metrics.ENCODE, end - draw_end)
     return buf.getvalue()
 
 
+def figure_to_array(fig) -> np.ndarray:
+    """Draw the figure and return its RGBA pixels, shape (h, w, 4).
+
+    The pixels are a view of the canvas' buffer, which the next draw of the
+    figure overwrites.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    canvas = fig.canvas
+    if not isinstance(canvas, FigureCanvasAgg):
+        canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())
+
+
+def encode_figure(fig, options: RenderingOptions) -> bytes:
+    if (options.image_format == 'png' and options.compress_level is None and
+            not options.distortion):
+        # Matplotlib's own PNG output, to keep the reference output stable.
+        return save_figure(fig)
+    with metrics.phase(metrics.RENDER):
+        # Distortion copies the pixels, it never modifies the canvas.
+        image = distort_image(figure_to_array(fig), options)
+    with metrics.phase(metrics.ENCODE):
+        return encode_image(image, options)
+
+
+# Maximum number of idle figures kept per thread, one per figure size and dpi
+MAX_POOLED_FIGURES = 8
+
+
+class _FigurePool(threading.local):
+    """Idle bar chart figures of the current thread, keyed by size and dpi.
+
+    Building a figure, its axes and canvas costs about as much as drawing it,
+    so figures are reused. A figure is taken out of the pool while rendering,
+    and only put back after it was reset to its initial state.
+    """
+    def __init__(self):
+        self.figures = collections.OrderedDict()
+
+    def take(self, options: RenderingOptions):
+        key = (tuple(options.figure_size), options.dpi)
+        entry = self.figures.pop(key, None)
+        if entry is not None:
+            return key, entry
+        # Imported here, so matplotlib is only loaded when rendering with it.
+        import matplotlib.figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = matplotlib.figure.Figure(figsize=options.figure_size,
+                                       dpi=options.dpi)
+        FigureCanvasAgg(fig)
+        return key, (fig, fig.add_subplot(1, 1, 1))
+
+    def put(self, key, fig, ax, bars):
+        # Undo everything drawing the bars changed: the bar artists, the
+        # categories of the x axis (with their ticks), the data limits and the
+        # colour cycle.
+        bars.remove()
+        ax.xaxis.clear()
+        ax.relim()
+        ax.set_prop_cycle(None)
+        self.figures[key] = (fig, ax)
+        while len(self.figures) > MAX_POOLED_FIGURES:
+            self.figures.popitem(last=False)
+
+
+_figure_pool = _FigurePool()
+
+
+def _render_bar_chart_matplotlib(
+        label_value_pairs: Sequence[Tuple[str, float]],
+        options: RenderingOptions) -> bytes:
+    # If anything fails, the figure is dropped rather than put back.
+    with metrics.phase(metrics.RENDER):
+        labels, values = list(zip(*label_value_pairs))
+        key, (fig, ax) = _figure_pool.take(options)
+        bars = ax.bar(labels, values)
+    chart = encode_figure(fig, options)
+    _figure_pool.put(key, fig, ax, bars)
+    return chart
+
+
+def _render_bar_chart_raster(label_value_pairs: Sequence[Tuple[str, float]],
+                             options: RenderingOptions) -> bytes:
+    from . import raster_rendering
+    return raster_rendering.render_bar_chart(label_value_pairs, options)
+
+
+BarChartRenderer = Callable[[Sequence[Tuple[str, float]], RenderingOptions],
+                            bytes]
+_bar_chart_backends: Dict[str, BarChartRenderer] = {
+    'matplotlib': _render_bar_chart_matplotlib,
+    'raster': _render_bar_chart_raster,
+}
+
+
+def register_rendering_backend(name: str,
+                               render_bar_chart_func: BarChartRenderer):
+    """Make a bar chart renderer selectable as `RenderingOptions.backend`.
+
+    Renderers should pass their pixels through `distortion.distort_image()`
+    before encoding them.
+    """
+    _bar_chart_backends[name] = render_bar_chart_func
+
+
+def seed_distortion(options: Optional[RenderingOptions],
+                    rng: RNG) -> Optional[RenderingOptions]:
+    """Return the options with a distortion seed for one challenge, drawn from
+    `rng`. Without distortion, the options are returned as they are."""
+    if options is None or not options.distortion:
+        return options
+    return dataclasses.replace(options,
+                               distortion_seed=int(rng.randint(2 ** 31)))
+
+
 def render_bar_chart(label_value_pairs: Sequence[Tuple[str, float]],
                      options: RenderingOptions = None) -> bytes:
     if options is None:
         options = RenderingOptions.default_options()
-    labels, values = list(zip(*label_value_pairs))
-    fig = matplotlib.figure.Figure(figsize=options.figure_size)
-    ax = fig.add_subplot(1, 1, 1)
-    ax.bar(labels, values)
-    return save_figure(fig)
+    validate_options(options)
+    try:
+        backend = _bar_chart_backends[options.backend]
+    except KeyError:
+        raise ConfigurationError(
+            f'Unknown rendering backend {options.backend}')
+    return backend(label_value_pairs, options)
 
 
 #################################################################
 # Concrete template types
 #################################################################
+def _widen(values: np.ndarray) -> np.ndarray:
+    # Tables may hold values in compact dtypes (see tables.compact_table()),
+    # which could overflow in arithmetic while rendering.
+    if values.dtype.kind in 'iu' and values.dtype.itemsize < 8:
+        return values.astype(np.int64)
+    if values.dtype.kind == 'f':
+        return values.astype(np.float64, copy=False)
+    return values
+
+
+@dataclasses.dataclass(frozen=True)
+class BarSelection:
+    """The rows a bar chart template shows, in compact array form."""
+    labels: np.ndarray
+    values: np.ndarray
+    correct_answer: Any
+
+
 class MinMaxBarTemplate(ChallengeTemplate):
     """Show several values with their associated labels as a bar chart. Ask for
      the label of the highest/lowest value.
@@ -132,19 +383,92 @@ class MinMaxBarTemplate(ChallengeTemplate):
                 f'variant must be either "min" or "max". Got {variant}')
         self.is_max = variant.lower() == 'max'
         self.n = n
+        self.identity = (f'{self.config_name}:{table}:{labels}:{values}:'
+                         f'{variant.lower()}:{n}')
+
+    def referenced_tables(self) -> Sequence[str]:
+        return [self.table_name]
+
+    def referenced_columns(self) -> Mapping[str, Sequence[str]]:
+        return {self.table_name: [self.label_column, self.value_column]}
+
+    def row_summaries(self) -> Sequence[RowSummary]:
+        return [TopRows(self.table_name, self.value_column, self.n,
+                        largest=self.is_max,
+                        columns=[self.label_column, self.value_column])]
+
+    def validate(self, data: DataTables) -> bool:
+        # The question's placeholders were already checked by __init__().
+        table = data.get(self.table_name)
+        if table is None:
+            raise ConfigurationError(f'Table {self.table_name} not found')
+        for column in (self.label_column, self.value_column):
+            if column not in table.columns:
+                raise ConfigurationError(
+                    f'Column {column} not found in table {self.table_name}')
+        labels = table[self.label_column]
+        if isinstance(labels.dtype, pd.CategoricalDtype):
+            labels = labels.cat.categories
+        if not pd.api.types.is_string_dtype(labels):
+            raise ConfigurationError(
+                f'Labels column {self.label_column} of table '
+                f'{self.table_name} must hold strings')
+        values = table[self.value_column]
+        if (not pd.api.types.is_numeric_dtype(values) or
+                pd.api.types.is_bool_dtype(values)):
+            raise ConfigurationError(
+                f'Values column {self.value_column} of table '
+                f'{self.table_name} must be numeric')
+        if len(table) < self.n:
+            raise ConfigurationError(
+                f'Table {self.table_name} has {len(table)} rows, fewer than '
+                f'n={self.n}')
+        return True
+
+    def select(self, table: pd.DataFrame) -> BarSelection:
+        """Select the rows shown in the chart, most extreme value first."""
+        choose_func = table.nlargest if self.is_max else table.nsmallest
+        subset = choose_func(self.n, self.value_column)
+        labels = subset[self.label_column].to_numpy()
+        values = _widen(subset[self.value_column].to_numpy())
+        return BarSelection(labels, values, labels[0])
+
+    def prepare(self, data: DataTables):
+        try:
+            self.validate(data)
+        except ConfigurationError:
+            # Not verified (verify_config=False), generate_challenge() fails.
+            return
+        table = data[self.table_name]
+        self._prepared = (table, self.select(table))
+
+    def _get_selection(self, table: pd.DataFrame) -> BarSelection:
+        # The selection only depends on the table, so it is computed once per
+        # table object. Stored as a single tuple so concurrent readers never
+        # see a table paired with another table's selection.
+        prepared = getattr(self, '_prepared', None)
+        if prepared is not None and prepared[0] is table:
+            return prepared[1]
+        selection = self.select(table)
+        self._prepared = (table, selection)
+        return selection
 
     def generate_challenge(self,
                            data: DataTables,
                            rng: RNG,
                            rendering_options: RenderingOptions = None
                            ) -> Tuple[Challenge, str]:
-        table = data[self.table_name]
-        choose_func = table.nlargest if self.is_max else table.nsmallest
-        subset = choose_func(self.n, self.value_column)
-        subset = subset[[self.label_column, self.value_column]].to_numpy()
-        correct_answer = subset[0][0]
-        rng.shuffle(subset)
-        possible_answers = [x[0] for x in subset]
-        chart = render_bar_chart(subset, rendering_options)
+        with metrics.phase(metrics.SELECTION):
+            selection = self._get_selection(data[self.table_name])
+            order = np.arange(len(selection.labels))
+            rng.shuffle(order)
+            subset = list(zip(selection.labels[order],
+                              selection.values[order]))
+            possible_answers = list(selection.labels[order])
+            rendering_options = seed_distortion(rendering_options, rng)
+        chart = self.render_cached(
+            self.identity, subset,
+            lambda: render_bar_chart(subset, rendering_options),
+            rendering_options)
         challenge = Challenge(self.question, chart, possible_answers)
-        return challenge, correct_answer
+        return challenge, selection.correct_answer
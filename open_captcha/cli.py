@@ -0,0 +1,87 @@
+"""The `open-captcha` command.
+
+    open-captcha pregenerate --data data.json --templates templates.json \\
+        --count 10000 --key-file bundle.key --output challenges.bundle
+
+renders challenges in parallel into a bundle file, to be served with
+`ChallengeBundle` (see bundle.py).
+"""
+import argparse
+import json
+import sys
+from typing import Sequence
+
+from .common_types import CaptchaError, RenderingOptions
+from .tokens import TokenSigner
+
+
+def _read_json(path: str):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _pregenerate(args: argparse.Namespace):
+    # Imported here, so that the command starts quickly
+    from .bundle import write_bundle
+    from .captcha_generator import CaptchaGenerator
+
+    with open(args.key_file, 'rb') as f:
+        token_signer = TokenSigner({args.key_id: f.read()}, args.key_id)
+    rendering_options = None
+    if args.rendering_options is not None:
+        rendering_options = RenderingOptions(
+            **json.loads(args.rendering_options))
+    generator = CaptchaGenerator(
+        _read_json(args.data), _read_json(args.templates),
+        response_timeout_sec=0)
+    challenges = (
+        (challenge, context.correct_answer)
+        for _, challenge, context in generator.generate_challenges(
+            args.count, rendering_options, workers=args.workers))
+    count = write_bundle(args.output, challenges, token_signer)
+    print(f'Wrote {count} challenges to {args.output}')
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='open-captcha')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pregenerate = commands.add_parser(
+        'pregenerate', help='Render challenges into a bundle file.')
+    pregenerate.add_argument(
+        '--data', required=True,
+        help='JSON file mapping table names to tables: lists of rows, '
+             'mappings of columns, or paths of Arrow IPC files.')
+    pregenerate.add_argument(
+        '--templates', required=True,
+        help='JSON file with the list of template configs.')
+    pregenerate.add_argument('--count', type=int, required=True,
+                             help='Number of challenges to render.')
+    pregenerate.add_argument('--output', required=True,
+                             help='The bundle file to write.')
+    pregenerate.add_argument(
+        '--key-file', required=True,
+        help='File holding the secret key the answers are sealed with.')
+    pregenerate.add_argument('--key-id', default='bundle',
+                             help='ID of the key (default: %(default)s).')
+    pregenerate.add_argument(
+        '--rendering-options',
+        help='JSON object of RenderingOptions fields, '
+             'e.g. \'{"figure_size": [6, 4], "backend": "raster"}\'.')
+    pregenerate.add_argument(
+        '--workers', type=int,
+        help='Number of rendering processes (default: number of CPUs).')
+    pregenerate.set_defaults(run=_pregenerate)
+    return parser
+
+
+def main(argv: Sequence[str] = None):
+    args = _parser().parse_args(argv)
+    try:
+        args.run(args)
+    except (CaptchaError, OSError, ValueError, TypeError) as ex:
+        sys.exit(f'open-captcha {args.command}: {ex}')
+
+
+if __name__ == '__main__':
+    main()
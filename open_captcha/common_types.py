@@ -1,9 +1,11 @@
 import dataclasses
 import json
-from typing import Sequence, Mapping, Tuple, Any, NewType
+from typing import Sequence, Mapping, Tuple, Any, NewType, Union, TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
+if TYPE_CHECKING:  # numpy and pandas are imported lazily, see __getattr__()
+    import numpy as np
+    import pandas as pd
+    from .streaming import TableStream
 
 
 #################################################################
@@ -23,26 +25,64 @@ class ConfigurationError(CaptchaError):
 # The input types for data tables. These is used only for the API.
 # Internally we convert the tables to pandas.DataFrames for convenience.
 InputTableRow = Mapping[str, Any]  # column name -> value
-InputTable = Sequence[InputTableRow]
+# A sequence of rows, a mapping of column name -> column (a NumPy array or a
+# sequence), a pandas DataFrame or a TableStream (see open_captcha.streaming).
+# open_captcha.tables also accepts a pyarrow Table or the path of an Arrow IPC
+# file, which aren't listed so that the annotation doesn't depend on pyarrow.
+InputTable = Union[Sequence[InputTableRow],
+                   Mapping[str, Union[Sequence, 'np.ndarray']],
+                   'pd.DataFrame',
+                   'TableStream']
 
 # Input type for template configurations, which can be easily saved/loaded from
 # a JSON file. Each template config is a pair of (template name, template
 # parameters).
 # The template parameters are specific to the type of the template being
-# configured.
+# configured. An optional third item holds sampling options, such as the
+# template's weight (see open_captcha.sampling).
 TemplateParams = Mapping[str, Any]
-TemplateConfig = Tuple[str, TemplateParams]
+TemplateConfig = Union[Tuple[str, TemplateParams],
+                       Tuple[str, TemplateParams, Mapping[str, Any]]]
 
 #################################################################
 # Internal structures
 #################################################################
-DataTables = Mapping[str, pd.DataFrame]
-RNG = np.random.RandomState
+# DataTables = Mapping[str, pd.DataFrame]
+# RNG = np.random.RandomState
+# These are resolved on first access by __getattr__() below, so that importing
+# this module doesn't import numpy and pandas.
+
+
+def __getattr__(name: str):
+    if name == 'DataTables':
+        import pandas as pd
+        value = Mapping[str, pd.DataFrame]
+    elif name == 'RNG':
+        import numpy as np
+        value = np.random.RandomState
+    else:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    globals()[name] = value
+    return value
 
 
 @dataclasses.dataclass
 class RenderingOptions:
     figure_size: Tuple[float, float]  # Figure size in inches
+    # Name of the rendering backend: 'matplotlib' (the reference renderer) or
+    # 'raster' (faster, draws directly into a NumPy array).
+    backend: str = 'matplotlib'
+    # Output format: 'png', 'png-palette' (indexed colour PNG, much smaller
+    # for charts) or 'webp' (falls back to 'png' if not supported).
+    image_format: str = 'png'
+    dpi: float = None  # Pixels per inch. None for the default (100)
+    palette_colors: int = 32  # Maximum number of colours for 'png-palette'
+    compress_level: int = None  # zlib level 0-9. None for backend's default
+    # Anti-OCR distortion strength, from 0 (none) to 1. See distortion.py
+    distortion: float = 0
+    # Seed of the distortion, set per challenge by the templates from the
+    # generator's RNG. None for a random one.
+    distortion_seed: int = None
 
     @staticmethod
     def default_options() -> 'RenderingOptions':
@@ -63,6 +103,12 @@ class Challenge:
     chart: bytes
     possible_answers: Sequence[str]
 
+    @property
+    def image_format(self) -> str:
+        """The chart's image format, e.g. 'png' or 'webp'."""
+        from .image_encoding import image_format_of
+        return image_format_of(self.chart)
+
 
 @dataclasses.dataclass
 class ServerContext:
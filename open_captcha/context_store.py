@@ -0,0 +1,176 @@
+"""Storage of server contexts between generating a challenge and verifying it.
+
+`ContextStore` implements the "store with TTL, retrieve-and-delete" part of
+the suggested flow. `InMemoryContextStore` keeps the contexts in the process,
+for single-node deployments, and `RedisContextStore` adapts a redis client
+(anything with redis-py's `pipeline()`, `set()`, `get()` and `delete()`).
+Bulk operations take a single lock per shard or a single round trip.
+"""
+from abc import ABC, abstractmethod
+import heapq
+import threading
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .common_types import ChallengeId, ConfigurationError, ServerContext
+
+
+class ContextStore(ABC):
+    """Abstract base class for server context stores."""
+    @abstractmethod
+    def put_many(self,
+                 contexts: Mapping[ChallengeId, ServerContext],
+                 ttl_sec: float):
+        """Store the contexts, each expiring after `ttl_sec` seconds."""
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def take_many(self, challenge_ids: Sequence[ChallengeId]
+                  ) -> List[Optional[ServerContext]]:
+        """Retrieve and delete the contexts of the given challenges.
+
+        Returns None for challenges whose context wasn't found (never stored,
+        expired or already taken). Each context can only be taken once, even
+        by concurrent callers.
+        """
+        pass  # pragma: no cover
+
+    def put(self,
+            challenge_id: ChallengeId,
+            context: ServerContext,
+            ttl_sec: float):
+        self.put_many({challenge_id: context}, ttl_sec)
+
+    def take(self, challenge_id: ChallengeId) -> Optional[ServerContext]:
+        return self.take_many([challenge_id])[0]
+
+
+#################################################################
+# In-process store
+#################################################################
+class _Shard:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: Dict[ChallengeId, Tuple[float, ServerContext]] = {}
+        # (expiry, challenge ID), possibly with stale entries for contexts
+        # that were already taken or overwritten.
+        self.expiry_heap: List[Tuple[float, ChallengeId]] = []
+
+    def evict(self, now: float):
+        heap = self.expiry_heap
+        while heap and (heap[0][0] <= now or
+                        len(self.entries) > self.max_entries):
+            expiry, challenge_id = heapq.heappop(heap)
+            entry = self.entries.get(challenge_id)
+            if entry is not None and entry[0] == expiry:
+                del self.entries[challenge_id]
+        if len(heap) > 2 * len(self.entries) + 64:
+            # Too many stale entries, rebuild the heap.
+            self.expiry_heap = [(expiry, challenge_id) for challenge_id, (
+                expiry, _) in self.entries.items()]
+            heapq.heapify(self.expiry_heap)
+
+
+class InMemoryContextStore(ContextStore):
+    """A thread-safe in-process context store.
+
+    Contexts are spread over `num_shards` shards, each with its own lock, so
+    concurrent requests rarely contend. Expired contexts are evicted in
+    expiry order using a heap per shard. Memory is bounded by `max_entries`:
+    when full, the contexts closest to expiry are dropped first.
+    """
+    def __init__(self,
+                 num_shards: int = 16,
+                 max_entries: int = 1_000_000,
+                 clock: Callable[[], float] = time.monotonic):
+        if num_shards < 1 or max_entries < num_shards:
+            raise ConfigurationError(
+                'Need at least one shard and one entry per shard. '
+                f'Got {num_shards} shards, {max_entries} entries')
+        self._shards = [_Shard(max_entries // num_shards)
+                        for _ in range(num_shards)]
+        self._clock = clock
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def _group_by_shard(self, challenge_ids):
+        groups: Dict[int, list] = {}
+        for i, challenge_id in enumerate(challenge_ids):
+            index = hash(challenge_id) % len(self._shards)
+            groups.setdefault(index, []).append((i, challenge_id))
+        return groups
+
+    def put_many(self,
+                 contexts: Mapping[ChallengeId, ServerContext],
+                 ttl_sec: float):
+        now = self._clock()
+        expiry = now + ttl_sec
+        for index, items in self._group_by_shard(contexts).items():
+            shard = self._shards[index]
+            with shard.lock:
+                for _, challenge_id in items:
+                    shard.entries[challenge_id] = (expiry,
+                                                   contexts[challenge_id])
+                    heapq.heappush(shard.expiry_heap, (expiry, challenge_id))
+                shard.evict(now)
+
+    def take_many(self, challenge_ids: Sequence[ChallengeId]
+                  ) -> List[Optional[ServerContext]]:
+        now = self._clock()
+        results: List[Optional[ServerContext]] = [None] * len(challenge_ids)
+        for index, items in self._group_by_shard(challenge_ids).items():
+            shard = self._shards[index]
+            with shard.lock:
+                for i, challenge_id in items:
+                    entry = shard.entries.pop(challenge_id, None)
+                    if entry is not None and entry[0] > now:
+                        results[i] = entry[1]
+        return results
+
+    def evict_expired(self):
+        """Drop expired contexts now, rather than on the next `put_many()`."""
+        now = self._clock()
+        for shard in self._shards:
+            with shard.lock:
+                shard.evict(now)
+
+
+#################################################################
+# Redis adapter
+#################################################################
+class RedisContextStore(ContextStore):
+    """Stores contexts as JSON in redis, keyed by `key_prefix` + challenge ID.
+
+    Bulk operations are pipelined into a single round trip. Taking contexts
+    runs GET and DELETE in one MULTI/EXEC transaction, so each context is
+    returned at most once.
+    """
+    def __init__(self, client, key_prefix: str = 'open-captcha:'):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def put_many(self,
+                 contexts: Mapping[ChallengeId, ServerContext],
+                 ttl_sec: float):
+        pipe = self.client.pipeline(transaction=False)
+        for challenge_id, context in contexts.items():
+            pipe.set(self.key_prefix + challenge_id, context.to_json(),
+                     ex=max(1, int(ttl_sec)))
+        pipe.execute()
+
+    def take_many(self, challenge_ids: Sequence[ChallengeId]
+                  ) -> List[Optional[ServerContext]]:
+        if not challenge_ids:
+            return []
+        pipe = self.client.pipeline(transaction=True)
+        for challenge_id in challenge_ids:
+            key = self.key_prefix + challenge_id
+            pipe.get(key)
+            pipe.delete(key)
+        values = pipe.execute()[0::2]
+        return [
+            None if value is None else ServerContext.from_json(value)
+            for value in values
+        ]
@@ -0,0 +1,101 @@
+"""Distortion of rendered charts, to make reading them automatically harder.
+
+Applied to the raw pixels between rendering and encoding, when
+`RenderingOptions.distortion` is above 0. Every challenge is distorted
+differently: the templates set `RenderingOptions.distortion_seed` from the
+generator's RNG (see `challenge_templates.seed_distortion()`). All steps are
+vectorized NumPy operations, taking a few milliseconds per chart:
+- Jitter: the whole chart is shifted by a few pixels.
+- Warping: rows and columns are displaced along random sine waves.
+- Colour perturbation: each colour channel gets a random gain and offset.
+- Noise: random brighter or darker speckles on a few percent of the pixels.
+  They make the images somewhat larger.
+"""
+import numpy as np
+
+from .common_types import RNG, RenderingOptions
+
+# At full strength (distortion=1)
+MAX_JITTER_PX = 4
+MAX_WARP_PX = 3
+MAX_COLOR_GAIN = 0.15  # Relative change of a channel
+MAX_COLOR_OFFSET = 24
+MAX_NOISE = 48  # Brightness change of a speckle, out of 255
+MAX_SPECKLE_FRACTION = 0.04  # Fraction of the pixels that are speckles
+
+
+def _displacement(size: int, strength: float, rng: RNG) -> np.ndarray:
+    # Whole pixel displacement of each line across the image (e.g. of every
+    # row along x): a sine wave of one to three periods, plus jitter.
+    periods = rng.uniform(1, 3)
+    phase = rng.uniform(0, 2 * np.pi)
+    jitter = rng.uniform(-1, 1) * strength * MAX_JITTER_PX
+    wave = np.sin(np.arange(size) * (2 * np.pi * periods / size) + phase)
+    return np.rint(wave * (strength * MAX_WARP_PX) + jitter).astype(np.int32)
+
+
+def _source_pixels(h: int, w: int, strength: float,
+                   rng: RNG) -> np.ndarray:
+    """The flat index of the pixel each pixel is copied from, shape (h, w)."""
+    src_x = (np.arange(w, dtype=np.int32)[np.newaxis, :] +
+             _displacement(h, strength, rng)[:, np.newaxis])
+    np.clip(src_x, 0, w - 1, out=src_x)
+    src = (np.arange(h, dtype=np.int32)[:, np.newaxis] +
+           _displacement(w, strength, rng)[np.newaxis, :])
+    np.clip(src, 0, h - 1, out=src)
+    src *= w
+    src += src_x
+    return src
+
+
+def _remap(image: np.ndarray, src: np.ndarray) -> np.ndarray:
+    h, w, channels = image.shape
+    if channels == 4:
+        # One 32 bit lookup per pixel is much faster than one per channel.
+        pixels = np.ascontiguousarray(image).view(np.uint32).reshape(-1)
+        return np.take(pixels, src).view(np.uint8).reshape(h, w, 4)
+    return np.take(image.reshape(-1, channels), src.reshape(-1),
+                   axis=0).reshape(h, w, channels)
+
+
+def distort(image: np.ndarray, strength: float, rng: RNG) -> np.ndarray:
+    """Return a distorted copy of an RGB or RGBA uint8 image of shape
+    (h, w, channels). `strength` is between 0 and 1."""
+    h, w = image.shape[:2]
+    # Warping and jitter
+    result = _remap(image, _source_pixels(h, w, strength, rng))
+
+    # Colour perturbation, as a lookup table per channel, and noise. Alpha, if
+    # any, is only warped.
+    gains = 1 + rng.uniform(-1, 1, 3) * (strength * MAX_COLOR_GAIN)
+    offsets = rng.uniform(-1, 1, 3) * (strength * MAX_COLOR_OFFSET)
+    luts = np.arange(256)[:, np.newaxis] * gains + offsets
+    luts = np.clip(np.rint(luts), 0, 255).astype(np.int16)
+    # Speckles: a random fraction of the pixels is made brighter or darker.
+    # Noise on every pixel would make the image many times larger, and slower
+    # to encode.
+    noise_level = int(round(strength * MAX_NOISE))
+    noise = None
+    if noise_level:
+        threshold = int(round(256 * strength * MAX_SPECKLE_FRACTION))
+        levels = np.zeros(256, dtype=np.int16)
+        levels[:threshold:2] = noise_level
+        levels[1:threshold:2] = -noise_level
+        noise = np.take(levels, np.frombuffer(rng.bytes(h * w),
+                                              dtype=np.uint8))
+        noise = noise.reshape(h, w)
+    for channel in range(3):
+        values = np.take(luts[:, channel], result[:, :, channel])
+        if noise is not None:
+            values += noise
+            np.clip(values, 0, 255, out=values)
+        result[:, :, channel] = values
+    return result
+
+
+def distort_image(image: np.ndarray, options: RenderingOptions) -> np.ndarray:
+    """Distort the image as set by the rendering options (if at all)."""
+    if not options.distortion:
+        return image
+    return distort(image, options.distortion,
+                   RNG(options.distortion_seed))
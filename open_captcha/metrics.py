@@ -0,0 +1,261 @@
+"""Performance metrics of challenge generation and verification.
+
+Pass a `CaptchaMetrics` as the `metrics` of a `CaptchaGenerator` (or a
+`ResponseVerifier`) to record, per configured template, how many challenges
+were generated, how long the selection, render and encode phases took and how
+large the images were, as well as the verification outcomes. `to_prometheus()`
+exports them in the Prometheus text format.
+
+Templates and renderers mark their phases with `phase()`, which does nothing
+unless a challenge is being measured, so metrics cost next to nothing when
+disabled. Challenges rendered in process pool workers are not measured.
+"""
+import bisect
+import contextlib
+import contextvars
+import dataclasses
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+# Generation phases, in order
+SELECTION = 'selection'
+RENDER = 'render'
+ENCODE = 'encode'
+PHASES = (SELECTION, RENDER, ENCODE)
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                           0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_SIZE_BUCKETS = tuple(1024 * 2 ** i for i in range(10))  # 1KiB-512KiB
+
+# (template index, template config name)
+TemplateLabels = Tuple[str, str]
+
+T = TypeVar('T')
+
+# Seconds per phase of the challenge being measured in this thread or task,
+# None if no challenge is being measured.
+_phase_durations: contextvars.ContextVar[Optional[Dict[str, float]]] = \
+    contextvars.ContextVar('open_captcha_phase_durations', default=None)
+_NOT_MEASURED = contextlib.nullcontext()
+
+
+class _Phase:
+    __slots__ = ('durations', 'name', 'start')
+
+    def __init__(self, durations: Dict[str, float], name: str):
+        self.durations = durations
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        record_phase(self.name, time.perf_counter() - self.start,
+                     self.durations)
+
+
+def phase(name: str):
+    """Context manager adding the time spent in it to the given phase."""
+    durations = _phase_durations.get()
+    if durations is None:
+        return _NOT_MEASURED
+    return _Phase(durations, name)
+
+
+def is_measuring() -> bool:
+    return _phase_durations.get() is not None
+
+
+def record_phase(name: str, seconds: float,
+                 durations: Dict[str, float] = None):
+    """Add time to a phase, for code that can't use `phase()`."""
+    if durations is None:
+        durations = _phase_durations.get()
+        if durations is None:
+            return
+    durations[name] = durations.get(name, 0.0) + seconds
+
+
+class Histogram:
+    """Counts of observations per bucket, with Prometheus semantics.
+
+    `counts[i]` is the number of observations <= `buckets[i]` (and greater
+    than the previous bucket); the last count is for the implicit +Inf bucket.
+    """
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self) -> 'Histogram':
+        result = Histogram(self.buckets)
+        result.counts = list(self.counts)
+        result.count = self.count
+        result.sum = self.sum
+        return result
+
+
+@dataclasses.dataclass
+class TemplateMetrics:
+    challenges: Histogram  # Total generation time
+    phases: Dict[str, Histogram]
+    image_bytes: Histogram
+    errors: int = 0
+
+    def copy(self) -> 'TemplateMetrics':
+        return TemplateMetrics(
+            self.challenges.copy(),
+            {name: h.copy() for name, h in self.phases.items()},
+            self.image_bytes.copy(), self.errors)
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    def escape(value):
+        return (str(value).replace('\\', r'\\').replace('"', r'\"')
+                .replace('\n', r'\n'))
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _template_labels(labels: TemplateLabels) -> List[Tuple[str, str]]:
+    return [('template', labels[0]), ('type', labels[1])]
+
+
+class CaptchaMetrics:
+    """Thread-safe collection of generation and verification metrics."""
+    def __init__(self,
+                 latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+                 size_buckets: Sequence[float] = DEFAULT_SIZE_BUCKETS,
+                 namespace: str = 'open_captcha'):
+        self.latency_buckets = tuple(latency_buckets)
+        self.size_buckets = tuple(size_buckets)
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._templates: Dict[TemplateLabels, TemplateMetrics] = {}
+        self._verifications: Dict[str, int] = {}
+
+    def _new_template_metrics(self) -> TemplateMetrics:
+        return TemplateMetrics(
+            Histogram(self.latency_buckets),
+            {name: Histogram(self.latency_buckets) for name in PHASES},
+            Histogram(self.size_buckets))
+
+    def measure_challenge(self, labels: TemplateLabels,
+                          generate: Callable[[], T]) -> T:
+        """Call `generate()`, which returns (challenge, correct answer), and
+        record its phases, total time and image size."""
+        durations: Dict[str, float] = {}
+        token = _phase_durations.set(durations)
+        start = time.perf_counter()
+        try:
+            result = generate()
+        except BaseException:
+            with self._lock:
+                self._get_template(labels).errors += 1
+            raise
+        finally:
+            _phase_durations.reset(token)
+        elapsed = time.perf_counter() - start
+        image_size = len(result[0].chart)
+        with self._lock:
+            template_metrics = self._get_template(labels)
+            template_metrics.challenges.observe(elapsed)
+            for name, seconds in durations.items():
+                histogram = template_metrics.phases.get(name)
+                if histogram is None:
+                    histogram = template_metrics.phases[name] = Histogram(
+                        self.latency_buckets)
+                histogram.observe(seconds)
+            template_metrics.image_bytes.observe(image_size)
+        return result
+
+    def _get_template(self, labels: TemplateLabels) -> TemplateMetrics:
+        template_metrics = self._templates.get(labels)
+        if template_metrics is None:
+            template_metrics = self._new_template_metrics()
+            self._templates[labels] = template_metrics
+        return template_metrics
+
+    def record_verification(self, outcome: str, count: int = 1):
+        with self._lock:
+            self._verifications[outcome] = (
+                self._verifications.get(outcome, 0) + count)
+
+    def templates(self) -> Dict[TemplateLabels, TemplateMetrics]:
+        """A snapshot of the metrics per (template index, config name)."""
+        with self._lock:
+            return {labels: m.copy() for labels, m in self._templates.items()}
+
+    def verifications(self) -> Dict[str, int]:
+        """A snapshot of the verification counts per outcome."""
+        with self._lock:
+            return dict(self._verifications)
+
+    def _header(self, lines: List[str], name: str, metric_type: str,
+                help_text: str):
+        lines.append(f'# HELP {self.namespace}_{name} {help_text}')
+        lines.append(f'# TYPE {self.namespace}_{name} {metric_type}')
+
+    def _sample(self, lines: List[str], name: str, labels, value):
+        lines.append(f'{self.namespace}_{name}{{{_format_labels(labels)}}}'
+                     f' {value}')
+
+    def _histogram(self, lines: List[str], name: str, labels, h: Histogram):
+        cumulative = 0
+        bounds = [_format_value(float(b)) for b in h.buckets] + ['+Inf']
+        for bound, count in zip(bounds, h.counts):
+            cumulative += count
+            self._sample(lines, f'{name}_bucket', labels + [('le', bound)],
+                         cumulative)
+        self._sample(lines, f'{name}_sum', labels, _format_value(h.sum))
+        self._sample(lines, f'{name}_count', labels, h.count)
+
+    def _template_lines(self, lines: List[str],
+                        templates: Dict[TemplateLabels, TemplateMetrics]):
+        self._header(lines, 'challenge_seconds', 'histogram',
+                     'Time to generate a challenge.')
+        for labels, m in templates.items():
+            self._histogram(lines, 'challenge_seconds',
+                            _template_labels(labels), m.challenges)
+        self._header(lines, 'challenge_phase_seconds', 'histogram',
+                     'Time spent per challenge in each generation phase.')
+        for labels, m in templates.items():
+            for phase_name, h in m.phases.items():
+                self._histogram(
+                    lines, 'challenge_phase_seconds',
+                    _template_labels(labels) + [('phase', phase_name)], h)
+        self._header(lines, 'challenge_image_bytes', 'histogram',
+                     'Size of the challenge images.')
+        for labels, m in templates.items():
+            self._histogram(lines, 'challenge_image_bytes',
+                            _template_labels(labels), m.image_bytes)
+        self._header(lines, 'challenge_errors_total', 'counter',
+                     'Challenges that failed to generate.')
+        for labels, m in templates.items():
+            self._sample(lines, 'challenge_errors_total',
+                         _template_labels(labels), m.errors)
+
+    def _verification_lines(self, lines: List[str],
+                            verifications: Dict[str, int]):
+        self._header(lines, 'verifications_total', 'counter',
+                     'Verified responses by outcome.')
+        for outcome, count in sorted(verifications.items()):
+            self._sample(lines, 'verifications_total',
+                         [('outcome', outcome)], count)
+
+    def to_prometheus(self) -> str:
+        """Export the metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        self._template_lines(lines, self.templates())
+        self._verification_lines(lines, self.verifications())
+        return '\n'.join(lines) + '\n'
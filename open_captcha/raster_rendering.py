@@ -0,0 +1,196 @@
+"""A lightweight bar chart renderer drawing directly into a NumPy buffer.
+
+This renders the same kind of chart as the matplotlib backend (bars, axes
+frame, ticks and tick labels, using matplotlib's default style), but without
+building a Figure and going through the Agg pipeline. Text is rasterized with
+FreeType once per distinct string and cached, so after warm-up rendering is
+mostly array slicing.
+"""
+import functools
+import math
+import threading
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from . import metrics
+from .common_types import RenderingOptions
+from .distortion import distort_image
+from .image_encoding import encode_image
+
+DEFAULT_DPI = 100
+FONT_SIZE_PT = 10
+BAR_COLOR = (0x1f, 0x77, 0xb4)  # matplotlib's default 'C0'
+BAR_WIDTH = 0.8
+MARGIN = 0.05  # Data margins, as a fraction of the data span
+# Axes position as fractions of the figure size (matplotlib defaults)
+AXES_LEFT, AXES_RIGHT, AXES_BOTTOM, AXES_TOP = 0.125, 0.9, 0.11, 0.88
+MAX_Y_TICKS = 9
+# Fast compression. Thanks to the PNG filtering the output is still about the
+# size of matplotlib's.
+COMPRESS_LEVEL = 1
+
+LINE_WIDTH_PT = 0.8
+TICK_LENGTH_PT = 3.5
+TICK_PAD_PT = 3.5
+
+_font_lock = threading.Lock()
+
+
+def _points_to_pixels(points: float, dpi: float) -> int:
+    return max(1, int(round(points * dpi / 72)))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_font():
+    # Deferred, so the font is only located and loaded when this backend is
+    # actually used.
+    from matplotlib import font_manager, ft2font
+    return ft2font.FT2Font(font_manager.findfont('DejaVu Sans'))
+
+
+def _load_flags():
+    from matplotlib import ft2font
+    load_flags = getattr(ft2font, 'LoadFlags', None)
+    if load_flags is not None:
+        return load_flags.FORCE_AUTOHINT
+    return ft2font.LOAD_FORCE_AUTOHINT  # pragma: no cover (matplotlib < 3.10)
+
+
+@functools.lru_cache(maxsize=4096)
+def rasterize_text(text: str,
+                   size_pt: float = FONT_SIZE_PT,
+                   dpi: float = DEFAULT_DPI) -> np.ndarray:
+    """Return the text's coverage mask, a uint8 array of shape (h, w)."""
+    with _font_lock:
+        font = _get_font()
+        font.set_size(size_pt, dpi)
+        font.set_text(text, 0.0, flags=_load_flags())
+        font.draw_glyphs_to_bitmap(antialiased=True)
+        mask = np.array(font.get_image(), dtype=np.uint8)
+    mask.setflags(write=False)
+    return mask
+
+
+def nice_ticks(vmin: float, vmax: float,
+               max_ticks: int = MAX_Y_TICKS) -> List[float]:
+    """Round tick values covering [vmin, vmax], at most `max_ticks` of them."""
+    span = vmax - vmin
+    if span <= 0:
+        return [vmin]
+    raw_step = span / (max_ticks - 1)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for multiple in (1, 2, 2.5, 5, 10):
+        step = multiple * magnitude
+        if step >= raw_step:
+            break
+    first = math.ceil(vmin / step - 1e-9)
+    last = math.floor(vmax / step + 1e-9)
+    return [round(i * step, 12) for i in range(first, last + 1)]
+
+
+def format_tick(value: float, step: float) -> str:
+    if float(step).is_integer():
+        return str(int(round(value)))
+    decimals = max(0, -math.floor(math.log10(step)) + 1)
+    return f'{value:.{decimals}f}'
+
+
+def _blit_text(canvas: np.ndarray, mask: np.ndarray, left: int, top: int):
+    """Alpha blend black text with the given coverage mask, clipped."""
+    height, width = canvas.shape[:2]
+    x0, y0 = max(left, 0), max(top, 0)
+    x1 = min(left + mask.shape[1], width)
+    y1 = min(top + mask.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    alpha = mask[y0 - top:y1 - top, x0 - left:x1 - left, np.newaxis]
+    region = canvas[y0:y1, x0:x1].astype(np.uint16)
+    canvas[y0:y1, x0:x1] = (region * (255 - alpha) // 255).astype(np.uint8)
+
+
+class _Scale:
+    """Linear mapping from data coordinates to pixel coordinates."""
+    def __init__(self, vmin: float, vmax: float, pmin: float, pmax: float):
+        self.vmin = vmin
+        self.factor = (pmax - pmin) / (vmax - vmin)
+        self.pmin = pmin
+
+    def __call__(self, value: float) -> int:
+        return int(round(self.pmin + (value - self.vmin) * self.factor))
+
+
+def render_bar_chart_rgb(label_value_pairs: Sequence[Tuple[str, float]],
+                         options: RenderingOptions) -> np.ndarray:
+    """Render a bar chart into an RGB uint8 array of shape (h, w, 3)."""
+    labels = [str(label) for label, _ in label_value_pairs]
+    values = [float(value) for _, value in label_value_pairs]
+    dpi = options.dpi or DEFAULT_DPI
+    lw = _points_to_pixels(LINE_WIDTH_PT, dpi)
+    tick_length = _points_to_pixels(TICK_LENGTH_PT, dpi)
+    tick_pad = _points_to_pixels(TICK_PAD_PT, dpi)
+    width = int(round(options.figure_size[0] * dpi))
+    height = int(round(options.figure_size[1] * dpi))
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    # Axes box in pixels (y grows downwards)
+    ax_left = int(round(AXES_LEFT * width))
+    ax_right = int(round(AXES_RIGHT * width))
+    ax_top = int(round((1 - AXES_TOP) * height))
+    ax_bottom = int(round((1 - AXES_BOTTOM) * height))
+
+    # Data limits, with margins except at the bars' zero baseline
+    n = len(values)
+    x_lo, x_hi = -BAR_WIDTH / 2, n - 1 + BAR_WIDTH / 2
+    x_margin = (x_hi - x_lo) * MARGIN
+    x_scale = _Scale(x_lo - x_margin, x_hi + x_margin, ax_left, ax_right)
+    y_lo, y_hi = min(0.0, *values), max(0.0, *values)
+    if y_lo == y_hi:
+        y_hi = y_lo + 1
+    y_margin = (y_hi - y_lo) * MARGIN
+    y_lo = y_lo - y_margin if y_lo < 0 else y_lo
+    y_hi = y_hi + y_margin if y_hi > 0 else y_hi
+    y_scale = _Scale(y_lo, y_hi, ax_bottom, ax_top)
+
+    # Bars
+    zero = y_scale(0)
+    for i, value in enumerate(values):
+        left = x_scale(i - BAR_WIDTH / 2)
+        right = x_scale(i + BAR_WIDTH / 2)
+        top, bottom = sorted((y_scale(value), zero))
+        canvas[top:bottom, left:right] = BAR_COLOR
+
+    # Axes frame
+    canvas[ax_top:ax_bottom + lw, ax_left:ax_left + lw] = 0
+    canvas[ax_top:ax_bottom + lw, ax_right:ax_right + lw] = 0
+    canvas[ax_top:ax_top + lw, ax_left:ax_right + lw] = 0
+    canvas[ax_bottom:ax_bottom + lw, ax_left:ax_right + lw] = 0
+
+    # X ticks and category labels
+    for i, label in enumerate(labels):
+        x = x_scale(i)
+        canvas[ax_bottom + lw:ax_bottom + lw + tick_length, x:x + lw] = 0
+        mask = rasterize_text(label, FONT_SIZE_PT, dpi)
+        _blit_text(canvas, mask, x - mask.shape[1] // 2,
+                   ax_bottom + lw + tick_length + tick_pad)
+
+    # Y ticks and value labels
+    ticks = nice_ticks(y_lo, y_hi)
+    step = ticks[1] - ticks[0] if len(ticks) > 1 else 1
+    for tick in ticks:
+        y = y_scale(tick)
+        canvas[y:y + lw, ax_left - tick_length:ax_left] = 0
+        mask = rasterize_text(format_tick(tick, step), FONT_SIZE_PT, dpi)
+        _blit_text(canvas, mask,
+                   ax_left - tick_length - tick_pad - mask.shape[1],
+                   y - mask.shape[0] // 2)
+    return canvas
+
+
+def render_bar_chart(label_value_pairs: Sequence[Tuple[str, float]],
+                     options: RenderingOptions) -> bytes:
+    with metrics.phase(metrics.RENDER):
+        image = distort_image(
+            render_bar_chart_rgb(label_value_pairs, options), options)
+    with metrics.phase(metrics.ENCODE):
+        return encode_image(image, options, COMPRESS_LEVEL)
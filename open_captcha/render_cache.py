@@ -0,0 +1,132 @@
+import collections
+import dataclasses
+import hashlib
+import json
+import threading
+from typing import Callable, FrozenSet, Iterable, Optional, Sequence, Tuple
+
+from .common_types import ConfigurationError, RenderingOptions
+
+# Rough per-entry bookkeeping overhead, so that many tiny entries still count
+# against the budget.
+_ENTRY_OVERHEAD_BYTES = 256
+
+CacheKey = str
+
+
+@dataclasses.dataclass
+class RenderCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+
+@dataclasses.dataclass
+class _Entry:
+    chart: bytes
+    tables: Optional[FrozenSet[str]]  # None means "depends on any table"
+
+
+class RenderCache:
+    """A bounded LRU cache of rendered charts, shared by all templates.
+
+    Entries are content addressed: the key is a hash of the template identity,
+    the ordered (label, value) pairs shown and the rendering options. Since a
+    template shows a small number of rows from a fixed data snapshot, the
+    number of distinct charts is small and most renders become lookups.
+
+    Each entry remembers which tables it was derived from, so that it can be
+    dropped when those tables are replaced (see `invalidate_tables()`).
+    """
+    def __init__(self, max_bytes: int = 32 * 2**20):
+        if max_bytes <= 0:
+            raise ConfigurationError(
+                f'max_bytes must be positive. Got {max_bytes}')
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = RenderCacheStats()
+
+    @staticmethod
+    def make_key(template_identity: str,
+                 label_value_pairs: Sequence[Tuple[str, float]],
+                 options: RenderingOptions = None) -> CacheKey:
+        if options is None:
+            options = RenderingOptions.default_options()
+        content = json.dumps([
+            template_identity,
+            [[str(label), float(value)] for label, value in label_value_pairs],
+            repr(dataclasses.astuple(options)),
+        ])
+        return hashlib.blake2b(content.encode('utf-8'),
+                               digest_size=16).hexdigest()
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return entry.chart
+
+    def put(self,
+            key: CacheKey,
+            chart: bytes,
+            tables: Iterable[str] = None):
+        entry_size = len(chart) + _ENTRY_OVERHEAD_BYTES
+        if entry_size > self.max_bytes:
+            return
+        entry = _Entry(chart, None if tables is None else frozenset(tables))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._stats.size_bytes -= self._entry_size(old)
+            self._entries[key] = entry
+            self._stats.size_bytes += entry_size
+            while self._stats.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._stats.size_bytes -= self._entry_size(evicted)
+                self._stats.evictions += 1
+
+    def get_or_render(self,
+                      key: CacheKey,
+                      render: Callable[[], bytes],
+                      tables: Iterable[str] = None) -> bytes:
+        chart = self.get(key)
+        if chart is None:
+            # Render outside the lock. Concurrent misses on the same key may
+            # render twice, which is harmless.
+            chart = render()
+            self.put(key, chart, tables)
+        return chart
+
+    def invalidate_tables(self, table_names: Iterable[str]):
+        """Drop all entries derived from any of the given tables."""
+        table_names = frozenset(table_names)
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if entry.tables is None or entry.tables & table_names
+            ]
+            for key in stale:
+                entry = self._entries.pop(key)
+                self._stats.size_bytes -= self._entry_size(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.size_bytes = 0
+
+    @property
+    def stats(self) -> RenderCacheStats:
+        with self._lock:
+            return dataclasses.replace(self._stats,
+                                       entries=len(self._entries))
+
+    @staticmethod
+    def _entry_size(entry: _Entry) -> int:
+        return len(entry.chart) + _ENTRY_OVERHEAD_BYTES
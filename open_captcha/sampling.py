@@ -0,0 +1,166 @@
+"""Weighted random selection of challenge templates.
+
+A template config may have a third element with sampling options:
+
+    ["min-max-bar", {...template parameters...}, {"weight": 3, "max_rate": 20}]
+
+`weight` (default 1) sets how often the template is picked relative to the
+others. `max_rate` caps the number of challenges per second generated from
+the template (with bursts of up to `max(1, max_rate)` challenges), so an
+expensive template can't take up all the rendering capacity.
+"""
+import threading
+import time
+from typing import Callable, List, Mapping, Optional, Sequence, Tuple
+
+from .common_types import ConfigurationError, TemplateConfig
+
+SAMPLING_OPTIONS = ('weight', 'max_rate')
+
+
+def parse_sampling_options(configs: Sequence[TemplateConfig]
+                           ) -> Tuple[List[float], List[Optional[float]]]:
+    """Return the weight and maximum rate (None if unlimited) of each
+    template config."""
+    weights = []
+    max_rates = []
+    for config in configs:
+        options: Mapping = config[2] if len(config) > 2 else {}
+        unknown = set(options) - set(SAMPLING_OPTIONS)
+        if unknown:
+            raise ConfigurationError(
+                f'Unknown sampling options for template {config[0]}: '
+                f'{", ".join(sorted(unknown))}')
+        weights.append(options.get('weight', 1))
+        max_rates.append(options.get('max_rate'))
+    return weights, max_rates
+
+
+class _RateLimit:
+    """A token bucket allowing `rate` events per second on average."""
+    def __init__(self, rate: float, clock: Callable[[], float]):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.last_refill = clock()
+
+    def has_capacity(self) -> bool:
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        return self.tokens >= 1
+
+    def try_acquire(self) -> bool:
+        if not self.has_capacity():
+            return False
+        self.tokens -= 1
+        return True
+
+
+class TemplateSampler:
+    """Picks template indices at random with the given weights.
+
+    Uses Vose's alias method: after an O(n) setup, each pick takes one random
+    number and O(1) time. If the picked template is over its `max_rate`, one
+    of the templates that are not is picked instead (by weight). If all are,
+    the rate caps are ignored, since a challenge must still be generated.
+    """
+    def __init__(self,
+                 weights: Sequence[float],
+                 max_rates: Sequence[Optional[float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        n = len(weights)
+        if n == 0:
+            raise ConfigurationError('No templates configured')
+        for w in weights:
+            if not isinstance(w, (int, float)) or not w >= 0:
+                raise ConfigurationError(
+                    f'Template weights must be non-negative numbers. Got {w}')
+        total = float(sum(weights))
+        if total <= 0:
+            raise ConfigurationError('At least one template weight must be '
+                                     'positive')
+        self.weights = [float(w) for w in weights]
+        self._probability, self._alias = self._build_alias_table(
+            [w * n / total for w in self.weights])
+
+        if max_rates is None:
+            max_rates = [None] * n
+        if len(max_rates) != n:
+            raise ConfigurationError('Need a max_rate for every template')
+        self._rate_limits: List[Optional[_RateLimit]] = []
+        for rate in max_rates:
+            if rate is not None and not rate > 0:
+                raise ConfigurationError(
+                    f'max_rate must be positive. Got {rate}')
+            self._rate_limits.append(
+                None if rate is None else _RateLimit(rate, clock))
+        self._is_rate_limited = any(self._rate_limits)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    @staticmethod
+    def _build_alias_table(scaled: List[float]
+                           ) -> Tuple[List[float], List[int]]:
+        n = len(scaled)
+        probability = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            probability[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1 - scaled[s]
+            (small if scaled[g] < 1 else large).append(g)
+        # Whatever is left has probability 1, up to rounding errors.
+        return probability, alias
+
+    def _pick(self, rng) -> int:
+        n = len(self._alias)
+        if n == 1:
+            return 0  # Don't consume random numbers
+        u = rng.random() * n
+        i = min(int(u), n - 1)
+        return i if u - i < self._probability[i] else self._alias[i]
+
+    def sample(self, rng) -> int:
+        """Return the index of a template picked using `rng`."""
+        index = self._pick(rng)
+        if not self._is_rate_limited:
+            return index
+        with self._lock:
+            limit = self._rate_limits[index]
+            if limit is None or limit.try_acquire():
+                return index
+            # Over its cap: pick by weight among the templates that aren't.
+            # This is linear, but only happens while a cap is being hit.
+            candidates = [
+                i for i, w in enumerate(self.weights)
+                if w > 0 and i != index and (
+                    self._rate_limits[i] is None or
+                    self._rate_limits[i].has_capacity())
+            ]
+            if not candidates:
+                return index
+            threshold = rng.random() * sum(
+                self.weights[i] for i in candidates)
+            for i in candidates:
+                threshold -= self.weights[i]
+                if threshold < 0:
+                    break
+            if self._rate_limits[i] is not None:
+                self._rate_limits[i].try_acquire()
+            return i
+
+    def __getstate__(self):
+        # Rate limits are per process, workers get the weights only.
+        return {'weights': self.weights}
+
+    def __setstate__(self, state):
+        self.__init__(state['weights'])
@@ -0,0 +1,164 @@
+"""Data tables shared by the worker processes of a pre-fork server.
+
+Instead of every worker loading (and holding) its own copy of the tables, the
+tables are published once, by the master or a loader process, to a file that
+workers memory-map. Put it on a RAM file system such as /dev/shm, so it's
+really POSIX shared memory. The workers' tables are read-only NumPy views of
+the mapping, so the memory used doesn't grow with the number of workers, and
+attaching takes no time.
+
+    # In the master, once the tables were verified with a CaptchaGenerator
+    publish_tables('/dev/shm/open-captcha-tables', data)
+
+    # In each worker
+    shared = SharedTablesFile('/dev/shm/open-captcha-tables')
+    generator = CaptchaGenerator(shared.poll(), template_configs, ...,
+                                 verify_config=False)
+    ...
+    tables = shared.poll()  # E.g. every few seconds
+    if tables is not None:
+        generator.update_tables(tables)
+
+To refresh the tables, publish them again: the new file replaces the old one
+at once, workers switch over on their next `poll()`, and the old file is
+freed once no worker maps it anymore.
+
+Numeric, boolean and datetime columns are shared as they are. Other columns
+(e.g. strings) are shared as categorical codes, with the categories loaded by
+every worker. Row indexes are not kept.
+
+File layout:
+    magic (8) | header size (8) | JSON header | column buffers
+The header lists each table's number of rows and columns, with their dtype,
+offset in the file, and categories.
+"""
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .common_types import ConfigurationError, DataTables, InputTable
+from .tables import _from_columns, load_tables
+
+SHARED_TABLES_MAGIC = b'OCTABLE1'
+_PREFIX = struct.Struct('<8sQ')
+_ALIGNMENT = 64
+# Column kinds shared as they are: bool, ints, floats, complex, datetimes
+_RAW_KINDS = 'biufcmM'
+
+
+def _column_buffers(name: str, table: pd.DataFrame
+                    ) -> Tuple[list, list]:
+    specs = []
+    buffers = []
+    for column_name, column in table.items():
+        if not isinstance(column_name, str):
+            raise ConfigurationError(
+                f'Column names must be strings to be shared, table {name} has '
+                f'{column_name!r}')
+        categories = None
+        if (isinstance(column.dtype, np.dtype) and
+                column.dtype.kind in _RAW_KINDS):
+            values = column.to_numpy()
+        else:
+            categorical = pd.Categorical(column)
+            values = categorical.codes
+            categories = categorical.categories.tolist()
+        values = np.ascontiguousarray(values)
+        specs.append(dict(name=column_name, dtype=values.dtype.str,
+                          categories=categories))
+        buffers.append(values)
+    return specs, buffers
+
+
+def publish_tables(path: str, data: Mapping[str, InputTable]):
+    """Write the tables to a file for workers to attach to.
+
+    The file is written next to `path` and then moved over it, so workers
+    never see a partial snapshot.
+    """
+    tables = load_tables(data)
+    header: Dict[str, dict] = {}
+    buffers = []
+    for name, table in tables.items():
+        specs, table_buffers = _column_buffers(name, table)
+        header[name] = dict(num_rows=len(table), columns=specs)
+        buffers.extend(table_buffers)
+    # Offsets are relative to the end of the header, whose size depends on
+    # them, and aligned, so the views are too.
+    offset = 0
+    specs = [s for table in header.values() for s in table['columns']]
+    for spec, values in zip(specs, buffers):
+        spec['offset'] = offset
+        offset += -(-values.nbytes // _ALIGNMENT) * _ALIGNMENT
+    try:
+        encoded_header = json.dumps(header).encode('utf-8')
+    except (TypeError, ValueError) as ex:
+        raise ConfigurationError(f'Could not share the tables: {ex}')
+    data_start = -(-(_PREFIX.size + len(encoded_header)) //
+                   _ALIGNMENT) * _ALIGNMENT
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREFIX.pack(SHARED_TABLES_MAGIC, len(encoded_header)))
+        f.write(encoded_header)
+        for spec, values in zip(specs, buffers):
+            f.seek(data_start + spec['offset'])
+            f.write(values.view(np.uint8).data)
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _attach(f, path: str) -> DataTables:
+    if os.fstat(f.fileno()).st_size < _PREFIX.size:
+        raise ConfigurationError(f'{path} is not a shared tables file')
+    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, header_size = _PREFIX.unpack_from(mapping)
+    if (magic != SHARED_TABLES_MAGIC or
+            _PREFIX.size + header_size > len(mapping)):
+        raise ConfigurationError(f'{path} is not a shared tables file')
+    header = json.loads(mapping[_PREFIX.size:_PREFIX.size + header_size])
+    data_start = -(-(_PREFIX.size + header_size) // _ALIGNMENT) * _ALIGNMENT
+    tables = {}
+    for name, table in header.items():
+        columns = {}
+        for spec in table['columns']:
+            # The views keep the mapping alive, as long as they are used.
+            values = np.frombuffer(mapping, dtype=np.dtype(spec['dtype']),
+                                   count=table['num_rows'],
+                                   offset=data_start + spec['offset'])
+            if spec['categories'] is not None:
+                values = pd.Categorical.from_codes(
+                    values, dtype=pd.CategoricalDtype(spec['categories']))
+            columns[spec['name']] = values
+        tables[name] = _from_columns(columns)
+    return tables
+
+
+def attach_tables(path: str) -> DataTables:
+    """Map the tables published to `path`, as read-only DataFrames."""
+    with open(path, 'rb') as f:
+        return _attach(f, path)
+
+
+class SharedTablesFile:
+    """Follows the tables published to a path, for a worker to switch over to
+    new snapshots."""
+    def __init__(self, path: str):
+        self.path = path
+        self._version: Optional[Tuple[int, int]] = None
+
+    def poll(self) -> Optional[DataTables]:
+        """Return the tables if they were published since the last call (or
+        this is the first call), None otherwise."""
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            version = (stat.st_ino, stat.st_mtime_ns)
+            if version == self._version:
+                return None
+            tables = _attach(f, self.path)
+        self._version = version
+        return tables
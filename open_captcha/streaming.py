@@ -0,0 +1,191 @@
+"""Building tables from row streams in bounded memory.
+
+Many templates only show a few rows of a table, e.g. `MinMaxBarTemplate` only
+the n rows with the largest or smallest values. Such templates declare
+`RowSummary`s (see `ChallengeTemplate.row_summaries()`), which are fed the
+table in chunks and keep only the rows the template can ever use. A table
+given to `CaptchaGenerator` as a `TableStream` is read chunk by chunk through
+the summaries of the templates that reference it, and only the rows they
+keep are loaded, so the memory used doesn't depend on the table's size.
+
+    data = {'report_counts': TableStream.from_csv('report_counts.csv')}
+    generator = CaptchaGenerator(data, template_configs, ...)
+"""
+from abc import ABC, abstractmethod
+import itertools
+from typing import (
+    Any, Callable, Collection, Dict, Iterable, Iterator, List, Mapping,
+    Optional, Sequence
+)
+
+import pandas as pd
+
+from .common_types import ConfigurationError, DataTables
+
+DEFAULT_CHUNK_SIZE = 65536
+
+# Called with the columns to read (None for all) to get the table's chunks.
+ChunkReader = Callable[[Optional[Collection[str]]], Iterator[pd.DataFrame]]
+
+
+class TableStream:
+    """A table read in chunks of rows, e.g. from a DB cursor or a CSV file.
+
+    A stream can only be read once. Use the `from_*()` constructors, or pass
+    a function that takes the columns needed (None for all of them) and
+    returns an iterator of DataFrame chunks. Other columns are dropped from
+    the chunks anyway, but readers can skip them to save work.
+    """
+    def __init__(self, read_chunks: ChunkReader):
+        self._read_chunks = read_chunks
+
+    def chunks(self, columns: Collection[str] = None
+               ) -> Iterator[pd.DataFrame]:
+        return self._read_chunks(columns)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Mapping[str, Any]],
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> 'TableStream':
+        """Stream row mappings, such as the rows of an InputTable."""
+        def read_chunks(columns):
+            iterator = iter(rows)
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    return
+                yield pd.DataFrame.from_records(chunk)
+        return cls(read_chunks)
+
+    @classmethod
+    def from_cursor(cls, cursor,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> 'TableStream':
+        """Stream the result of a query executed on a DB-API cursor."""
+        def read_chunks(columns):
+            names = [d[0] for d in cursor.description]
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                yield pd.DataFrame.from_records(chunk, columns=names)
+        return cls(read_chunks)
+
+    @classmethod
+    def from_csv(cls, path_or_buffer,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 **read_csv_kwargs) -> 'TableStream':
+        """Stream a CSV file. Only the needed columns are parsed."""
+        def read_chunks(columns):
+            usecols = None if columns is None else (lambda c: c in columns)
+            with pd.read_csv(path_or_buffer, chunksize=chunk_size,
+                             usecols=usecols, **read_csv_kwargs) as reader:
+                yield from reader
+        return cls(read_chunks)
+
+
+def _select(chunk: pd.DataFrame,
+            columns: Optional[Collection[str]]) -> pd.DataFrame:
+    if columns is None:
+        return chunk
+    return chunk[[c for c in chunk.columns if c in columns]]
+
+
+class RowSummary(ABC):
+    """Keeps the rows of a streamed table that a template may use."""
+    def __init__(self, table: str, columns: Sequence[str] = None):
+        self.table = table
+        # The columns the template reads, None for all of them
+        self.columns = columns
+
+    @abstractmethod
+    def update(self, chunk: pd.DataFrame):
+        """Consider the rows of the next chunk, indexed by row number."""
+        pass  # pragma: no cover
+
+    @abstractmethod
+    def rows(self) -> pd.DataFrame:
+        """The rows kept, with their row numbers as the index."""
+        pass  # pragma: no cover
+
+
+class TopRows(RowSummary):
+    """Keeps the k rows with the largest (or smallest) values in a column.
+
+    Ties are broken as by `DataFrame.nlargest()` on the whole table, in favour
+    of the earlier rows, so the template selects the same rows it would from
+    the full table.
+    """
+    def __init__(self, table: str, by: str, k: int, largest: bool = True,
+                 columns: Sequence[str] = None):
+        super().__init__(table, columns)
+        self.by = by
+        self.k = k
+        self.largest = largest
+        self._rows: Optional[pd.DataFrame] = None
+
+    def _top(self, frame: pd.DataFrame) -> pd.DataFrame:
+        if self.largest:
+            return frame.nlargest(self.k, self.by)
+        return frame.nsmallest(self.k, self.by)
+
+    def update(self, chunk: pd.DataFrame):
+        # Merges the chunk's top k with the current top k (which come from
+        # earlier rows, so they win ties), so at most 2k rows are held.
+        candidates = self._top(chunk)
+        if self._rows is not None:
+            candidates = self._top(pd.concat([self._rows, candidates]))
+        self._rows = candidates
+
+    def rows(self) -> pd.DataFrame:
+        return self._rows if self._rows is not None else pd.DataFrame()
+
+
+def reduce_stream(name: str, stream: TableStream,
+                  summaries: Sequence[RowSummary]) -> pd.DataFrame:
+    """Read the stream through the summaries and return the rows they keep,
+    in their original order."""
+    if any(s.columns is None for s in summaries):
+        columns = None
+    else:
+        columns = set(itertools.chain.from_iterable(
+            s.columns for s in summaries))
+    num_rows = 0
+    try:
+        for chunk in stream.chunks(columns):
+            chunk = _select(chunk, columns)
+            chunk.index = pd.RangeIndex(num_rows, num_rows + len(chunk))
+            num_rows += len(chunk)
+            for summary in summaries:
+                summary.update(chunk)
+    except KeyError as ex:
+        raise ConfigurationError(f'Column {ex} not found in table {name}')
+    kept = [rows for rows in (s.rows() for s in summaries) if len(rows)]
+    if not kept:
+        return pd.DataFrame(columns=sorted(columns or []))
+    table = pd.concat(kept)
+    table = table[~table.index.duplicated()].sort_index()
+    return table.reset_index(drop=True)
+
+
+def reduce_streams(streams: Mapping[str, TableStream],
+                   templates: Sequence) -> DataTables:
+    """Load the streamed tables, keeping only the rows the templates use."""
+    summaries: Dict[str, List[RowSummary]] = {name: [] for name in streams}
+    for t in templates:
+        referenced = t.referenced_tables()
+        streamed = list(streams) if referenced is None else [
+            name for name in referenced if name in streams]
+        if not streamed:
+            continue
+        template_summaries = t.row_summaries()
+        if template_summaries is None:
+            raise ConfigurationError(
+                f'{type(t).__name__} needs the full table '
+                f'{streamed[0]}, which can\'t be given as a TableStream')
+        for summary in template_summaries:
+            if summary.table in summaries:
+                summaries[summary.table].append(summary)
+    return {
+        name: reduce_stream(name, stream, summaries[name])
+        for name, stream in streams.items()
+        if summaries[name]
+    }
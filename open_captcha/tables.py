@@ -0,0 +1,139 @@
+"""Conversion of the input data tables to pandas DataFrames.
+
+A table can be given in any of these forms:
+- A sequence of rows, each a mapping of column name -> value.
+- A mapping of column name -> column (a NumPy array or any sequence).
+- A pandas DataFrame.
+- A pyarrow Table or RecordBatch.
+- The path of an Arrow IPC (Feather v2) file, which is memory-mapped.
+
+Columnar inputs are used without copying where possible: DataFrames as is,
+NumPy columns as the DataFrame's columns, and Arrow numeric columns without
+nulls as views of the Arrow buffers (for IPC files, of the mapped file).
+Arrow support requires pyarrow, which is imported only when needed.
+
+`compact_table()` reduces the memory held by a loaded table, by dropping
+the columns no template reads and storing the rest in compact dtypes.
+"""
+import os
+from typing import Collection, Dict, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+from .common_types import ConfigurationError, DataTables, InputTable
+
+
+def _is_arrow(table) -> bool:
+    return type(table).__module__.split('.')[0] == 'pyarrow'
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+    except ImportError:
+        raise ConfigurationError(
+            'Reading Arrow tables requires pyarrow. '
+            'Install it with: pip install open-captcha[arrow]')
+    return pyarrow
+
+
+def _from_arrow(table) -> pd.DataFrame:
+    # split_blocks keeps every column in its own block, so numeric columns
+    # without nulls can be zero-copy views instead of being consolidated.
+    return table.to_pandas(split_blocks=True)
+
+
+def _from_arrow_file(path) -> pd.DataFrame:
+    pyarrow = _import_pyarrow()
+    return _from_arrow(pyarrow.feather.read_table(path, memory_map=True))
+
+
+def _from_columns(columns: Mapping[str, object]) -> pd.DataFrame:
+    # copy=False keeps NumPy columns as they are, without consolidating them
+    # into a single 2D block.
+    return pd.DataFrame(dict(columns), copy=False)
+
+
+def load_table(name: str, table: InputTable) -> pd.DataFrame:
+    """Convert one input table (see the module docstring for the forms it can
+    take) to a DataFrame."""
+    try:
+        if isinstance(table, pd.DataFrame):
+            return table
+        if isinstance(table, (str, os.PathLike)):
+            return _from_arrow_file(table)
+        if _is_arrow(table):
+            return _from_arrow(table)
+        if isinstance(table, Mapping):
+            return _from_columns(table)
+        return pd.DataFrame.from_records(table)
+    except (ValueError, TypeError, OSError) as ex:
+        raise ConfigurationError(f'Could not load table {name}: {ex}')
+
+
+def load_tables(data: Mapping[str, InputTable]) -> DataTables:
+    return {name: load_table(name, table) for name, table in data.items()}
+
+
+def _compact_column(column: pd.Series) -> pd.Series:
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == bool:
+        return column
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(
+            column,
+            downcast='unsigned' if dtype.kind == 'u' else 'integer')
+    if pd.api.types.is_float_dtype(dtype):
+        # Only if no value changes, so charts and answers stay the same.
+        compact = column.astype(np.float32)
+        if np.array_equal(compact.to_numpy(np.float64), column.to_numpy(),
+                          equal_nan=True):
+            return compact
+        return column
+    if (pd.api.types.is_object_dtype(dtype) or
+            pd.api.types.is_string_dtype(dtype)):
+        # Each distinct label is stored once, the column holds small codes.
+        return column.astype('category')
+    return column
+
+
+def compact_table(table: pd.DataFrame,
+                  columns: Optional[Collection[str]] = None
+                  ) -> pd.DataFrame:
+    """Keep only the given columns (all if None) in compact dtypes.
+
+    Text columns become categoricals and numeric columns are downcast to the
+    smallest dtype that holds all their values exactly.
+    """
+    if columns is not None:
+        table = table[[c for c in table.columns if c in columns]]
+    return pd.DataFrame(
+        {name: _compact_column(column) for name, column in table.items()},
+        index=table.index, copy=False)
+
+
+def compact_tables(tables: DataTables,
+                   columns_by_table: Optional[Mapping[str, Optional[
+                       Collection[str]]]]) -> DataTables:
+    """Compact the tables, keeping only the tables and columns listed.
+
+    `columns_by_table` maps table names to the columns to keep (None for all
+    of them). If it is None, all tables and columns are kept.
+    """
+    if columns_by_table is None:
+        return {name: compact_table(table) for name, table in tables.items()}
+    return {
+        name: compact_table(table, columns_by_table[name])
+        for name, table in tables.items()
+        if name in columns_by_table
+    }
+
+
+def memory_usage(tables: DataTables) -> Dict[str, int]:
+    """Bytes used by each table, including the contents of Python objects."""
+    return {
+        name: int(table.memory_usage(index=True, deep=True).sum())
+        for name, table in tables.items()
+    }
@@ -0,0 +1,171 @@
+"""Stateless challenge tokens.
+
+Instead of storing the `ServerContext` on the server, it can be sealed into an
+opaque token that is sent to the client together with the challenge and sent
+back with the answer. The token is encrypted (so the correct answer can't be
+read from it) and authenticated (so it can't be forged or modified) under a
+server key.
+
+Token layout (before base64url encoding):
+    version (1) | key id length (1) | key id | nonce (16) |
+    timestamp (8) | attempt number (4) | encrypted answer | tag (16)
+
+The answer is encrypted with an HMAC-SHA256 keystream keyed by the nonce
+(counter mode), and everything is authenticated with a truncated HMAC-SHA256
+tag (encrypt-then-MAC), using separate keys derived from the server key. Only
+the standard library is used.
+"""
+import base64
+import binascii
+import hashlib
+import heapq
+import hmac
+import secrets
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Mapping, Tuple
+
+from .common_types import CaptchaError, ConfigurationError, ServerContext
+
+TOKEN_VERSION = 1
+NONCE_SIZE = 16
+TAG_SIZE = 16
+MIN_KEY_SIZE = 16
+_DIGEST_SIZE = hashlib.sha256().digest_size
+_FIELDS = struct.Struct('>qI')  # timestamp, attempt number
+
+
+class InvalidToken(CaptchaError):
+    pass
+
+
+def _hmac(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.sha256).digest()
+
+
+def _keystream_xor(key: bytes, nonce: bytes, data: bytes) -> bytes:
+    stream = b''.join(
+        _hmac(key, nonce + struct.pack('>I', counter))
+        for counter in range(-(-len(data) // _DIGEST_SIZE))
+    )
+    return bytes(a ^ b for a, b in zip(data, stream))
+
+
+class _DerivedKeys:
+    def __init__(self, secret: bytes):
+        self.encryption = _hmac(secret, b'open-captcha token encryption')
+        self.authentication = _hmac(secret, b'open-captcha token mac')
+
+
+class TokenSigner:
+    """Seals server contexts into tokens and opens them again.
+
+    `keys` maps key IDs to secret keys (random bytes, at least 16 of them).
+    New tokens are sealed with `current_key_id`, while tokens sealed with any
+    of the keys can be opened. To rotate keys, add the new key, make it the
+    current one, and drop the old key once its tokens have expired.
+    """
+    def __init__(self, keys: Mapping[str, bytes], current_key_id: str):
+        if current_key_id not in keys:
+            raise ConfigurationError(
+                f'Current key ID {current_key_id} not found in keys')
+        self._keys: Dict[bytes, _DerivedKeys] = {}
+        for key_id, secret in keys.items():
+            encoded_id = key_id.encode('utf-8')
+            if len(encoded_id) > 255:
+                raise ConfigurationError(f'Key ID too long: {key_id}')
+            if len(secret) < MIN_KEY_SIZE:
+                raise ConfigurationError(
+                    f'Key {key_id} must be at least {MIN_KEY_SIZE} bytes')
+            self._keys[encoded_id] = _DerivedKeys(secret)
+        self._current_key_id = current_key_id.encode('utf-8')
+
+    @staticmethod
+    def generate_key() -> bytes:
+        return secrets.token_bytes(32)
+
+    def seal(self, context: ServerContext) -> str:
+        key_id = self._current_key_id
+        keys = self._keys[key_id]
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        encrypted_answer = _keystream_xor(
+            keys.encryption, nonce, context.correct_answer.encode('utf-8'))
+        body = b''.join([
+            bytes([TOKEN_VERSION, len(key_id)]), key_id, nonce,
+            _FIELDS.pack(context.timestamp,
+                         context.verification_attempt_number),
+            encrypted_answer,
+        ])
+        tag = _hmac(keys.authentication, body)[:TAG_SIZE]
+        return base64.urlsafe_b64encode(body + tag).rstrip(b'=').decode()
+
+    def unseal(self, token: str) -> Tuple[bytes, ServerContext]:
+        """Return the token's nonce (unique per token) and server context.
+
+        Raises InvalidToken if the token is malformed, was not sealed with
+        one of the keys, or was modified.
+        """
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (binascii.Error, ValueError, TypeError):
+            raise InvalidToken('Malformed token')
+        if len(raw) < 2 or raw[0] != TOKEN_VERSION:
+            raise InvalidToken('Unknown token version')
+        id_end = 2 + raw[1]
+        fields_end = id_end + NONCE_SIZE + _FIELDS.size
+        if len(raw) < fields_end + TAG_SIZE:
+            raise InvalidToken('Malformed token')
+        keys = self._keys.get(raw[2:id_end])
+        if keys is None:
+            raise InvalidToken('Unknown key ID')
+        body, tag = raw[:-TAG_SIZE], raw[-TAG_SIZE:]
+        if not hmac.compare_digest(_hmac(keys.authentication, body)[:TAG_SIZE],
+                                   tag):
+            raise InvalidToken('Bad token signature')
+        nonce = body[id_end:id_end + NONCE_SIZE]
+        timestamp, attempt_number = _FIELDS.unpack(
+            body[id_end + NONCE_SIZE:fields_end])
+        answer = _keystream_xor(keys.encryption, nonce, body[fields_end:])
+        try:
+            answer = answer.decode('utf-8')
+        except UnicodeDecodeError:  # pragma: no cover (authenticated data)
+            raise InvalidToken('Malformed token')
+        return nonce, ServerContext(timestamp, attempt_number, answer)
+
+
+class ReplayFilter:
+    """Remembers used token nonces until the tokens expire.
+
+    Used to accept every token only once. Memory is bounded by
+    `max_entries`: when full, the entries closest to expiry are forgotten
+    first, which is the only case in which a replay can go undetected.
+    """
+    def __init__(self, max_entries: int = 1_000_000):
+        self.max_entries = max_entries
+        self._expiry_by_nonce: Dict[bytes, float] = {}
+        self._heap: List[Tuple[float, bytes]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expiry_by_nonce)
+
+    def check_and_add(self, nonce: bytes, expiry: float,
+                      now: float = None) -> bool:
+        """Return True if the nonce was not seen before, and remember it."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._evict(lambda first_expiry: first_expiry < now)
+            if nonce in self._expiry_by_nonce:
+                return False
+            self._evict(lambda _: len(self) >= self.max_entries)
+            self._expiry_by_nonce[nonce] = expiry
+            heapq.heappush(self._heap, (expiry, nonce))
+            return True
+
+    def _evict(self, should_evict: Callable[[float], bool]):
+        heap = self._heap
+        while heap and should_evict(heap[0][0]):
+            _, nonce = heapq.heappop(heap)
+            del self._expiry_by_nonce[nonce]
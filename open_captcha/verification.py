@@ -0,0 +1,220 @@
+"""Verification of user responses.
+
+This module only depends on the standard library and Levenshtein, so that
+services which only verify responses don't need to import the (heavy)
+rendering and table handling dependencies. Use it as:
+
+    verifier = ResponseVerifier(response_timeout_sec=180)
+    is_ok = verifier.verify_response(user_answer, context)
+"""
+import concurrent.futures
+import dataclasses
+import math
+import re
+import time
+import unicodedata
+from typing import Any, Iterable, List, Mapping, Sequence, Tuple
+
+import Levenshtein
+
+from .common_types import ConfigurationError, ServerContext
+from .metrics import CaptchaMetrics
+from .tokens import InvalidToken, ReplayFilter, TokenSigner
+
+
+# Verification outcomes, also the reasons for failed verification
+OK = 'ok'
+TIMEOUT = 'timeout'
+WRONG_ANSWER = 'wrong_answer'
+INVALID_TOKEN = 'invalid_token'
+REPLAYED_TOKEN = 'replayed_token'
+
+# Minimum number of answers per thread for batch verification
+_MIN_ANSWERS_PER_WORKER = 256
+
+# Hebrew cantillation marks and vowel points (niqqud), but not punctuation
+# such as maqaf.
+_NIQQUD = re.compile('[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]')
+_WHITESPACE = re.compile(r'\s+')
+# User answers longer than this factor times the longest acceptable answer
+# (plus some slack) are rejected before being normalized, so that garbage
+# input can't make verification expensive. Normalization (whitespace, niqqud)
+# can shorten an answer, hence the generous factor.
+_MAX_RAW_LENGTH_FACTOR = 3
+_MAX_RAW_LENGTH_SLACK = 16
+
+
+@dataclasses.dataclass
+class BatchVerificationResult:
+    is_ok: Any  # numpy bool array, one entry per response
+    failure_counts: Mapping[str, int]  # failure reason -> count
+
+
+def _get_timestamp() -> int:
+    return int(time.time())
+
+
+def _verify_timeout(t0: int, timeout: int) -> bool:
+    elapsed_time = _get_timestamp() - t0
+    return elapsed_time <= timeout
+
+
+def normalize_answer(text: str) -> str:
+    """Normalize an answer for comparison.
+
+    Applies Unicode NFKC normalization, strips Hebrew niqqud, collapses
+    whitespace and folds case.
+    """
+    text = unicodedata.normalize('NFKC', text)
+    text = _NIQQUD.sub('', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    return text.casefold()
+
+
+def _max_distance(correct_answer: str,
+                  num_letters_per_allowed_typo: int) -> int:
+    return math.ceil(len(correct_answer) / num_letters_per_allowed_typo)
+
+
+def _verify_text_is_close(correct_answer: str,
+                          user_answer: str,
+                          num_letters_per_allowed_typo: int) -> bool:
+    """Check the user's answer is within the allowed number of typos.
+
+    Both answers are normalized before being compared. Contexts created by
+    `CaptchaGenerator` already hold a normalized correct answer, so an exact
+    match is accepted before normalizing it again. The cost is bounded by the
+    length of the correct answer, whatever the user sends.
+    """
+    max_length = len(correct_answer) + _max_distance(
+        correct_answer, num_letters_per_allowed_typo)
+    if (len(user_answer) >
+            _MAX_RAW_LENGTH_FACTOR * max_length + _MAX_RAW_LENGTH_SLACK):
+        return False
+    user_answer = normalize_answer(user_answer)
+    if user_answer == correct_answer:
+        return True
+    correct_answer = normalize_answer(correct_answer)
+    if user_answer == correct_answer:
+        return True
+    max_distance = _max_distance(correct_answer, num_letters_per_allowed_typo)
+    if abs(len(user_answer) - len(correct_answer)) > max_distance:
+        return False
+    distance = Levenshtein.distance(user_answer, correct_answer,
+                                    score_cutoff=max_distance)
+    return distance <= max_distance
+
+
+def _verify_texts_are_close(pairs: Sequence[Tuple[str, str]],
+                            num_letters_per_allowed_typo: int) -> List[bool]:
+    return [
+        _verify_text_is_close(correct_answer, user_answer,
+                              num_letters_per_allowed_typo)
+        for correct_answer, user_answer in pairs
+    ]
+
+
+class ResponseVerifier:
+    """Verifies user responses against the stored `ServerContext`.
+
+    `CaptchaGenerator` is a `ResponseVerifier` as well. This class can be used
+    directly by services that don't generate challenges.
+    """
+    def __init__(self,
+                 response_timeout_sec: int,
+                 num_letters_per_allowed_typo: int = 5,
+                 token_signer: TokenSigner = None,
+                 replay_filter: ReplayFilter = None,
+                 metrics: CaptchaMetrics = None):
+        self.response_timeout_sec = response_timeout_sec
+        self.num_letters_per_allowed_typo = num_letters_per_allowed_typo
+        # For stateless tokens (see open_captcha.tokens)
+        self.token_signer = token_signer
+        if token_signer is not None and replay_filter is None:
+            replay_filter = ReplayFilter()
+        self.replay_filter = replay_filter
+        self.metrics = metrics
+
+    def _record(self, outcome: str, count: int = 1):
+        if self.metrics is not None and count:
+            self.metrics.record_verification(outcome, count)
+
+    def verify_response(self,
+                        user_answer: str,
+                        context: ServerContext) -> bool:
+        if not _verify_timeout(context.timestamp, self.response_timeout_sec):
+            self._record(TIMEOUT)
+            return False
+        if not _verify_text_is_close(context.correct_answer, user_answer,
+                                     self.num_letters_per_allowed_typo):
+            self._record(WRONG_ANSWER)
+            return False
+        self._record(OK)
+        return True
+
+    def verify_responses(self,
+                         responses: Iterable[Tuple[str, ServerContext]],
+                         workers: int = None) -> BatchVerificationResult:
+        """Verify many (user answer, context) pairs at once.
+
+        Equivalent to calling `verify_response()` for each pair, but reads the
+        clock once and checks all timeouts in one vectorized operation. The
+        answers can be compared on up to `workers` threads.
+        """
+        import numpy as np  # Not needed for verifying single responses
+        responses = list(responses)
+        timestamps = np.fromiter(
+            (context.timestamp for _, context in responses),
+            dtype=np.int64, count=len(responses))
+        is_ok = (_get_timestamp() - timestamps) <= self.response_timeout_sec
+        in_time = np.flatnonzero(is_ok)
+        pairs = [(responses[i][1].correct_answer, responses[i][0])
+                 for i in in_time]
+        num_chunks = min(workers or 1,
+                         max(1, len(pairs) // _MIN_ANSWERS_PER_WORKER))
+        if num_chunks > 1:
+            chunk_size = -(-len(pairs) // num_chunks)
+            chunks = [pairs[i:i + chunk_size]
+                      for i in range(0, len(pairs), chunk_size)]
+            with concurrent.futures.ThreadPoolExecutor(num_chunks) as pool:
+                results = pool.map(_verify_texts_are_close, chunks,
+                                   [self.num_letters_per_allowed_typo] *
+                                   len(chunks))
+                is_close = [x for chunk in results for x in chunk]
+        else:
+            is_close = _verify_texts_are_close(
+                pairs, self.num_letters_per_allowed_typo)
+        is_ok[in_time] = is_close
+        num_wrong = len(is_close) - sum(is_close)
+        failure_counts = {
+            TIMEOUT: len(responses) - len(in_time),
+            WRONG_ANSWER: num_wrong,
+        }
+        for outcome, count in failure_counts.items():
+            self._record(outcome, count)
+        self._record(OK, len(is_close) - num_wrong)
+        return BatchVerificationResult(is_ok, failure_counts)
+
+    def verify_token(self, user_answer: str, token: str) -> bool:
+        """Verify a response to a challenge issued as a stateless token.
+
+        Each token is accepted only once, whether the answer is correct or
+        not, just like a context that is deleted from the cache on retrieval.
+        """
+        if self.token_signer is None:
+            raise ConfigurationError('Stateless tokens need a token_signer')
+        try:
+            nonce, context = self.token_signer.unseal(token)
+        except InvalidToken:
+            self._record(INVALID_TOKEN)
+            return False
+        if not _verify_timeout(context.timestamp, self.response_timeout_sec):
+            self._record(TIMEOUT)
+            return False
+        if self.replay_filter is not None:
+            expiry = context.timestamp + self.response_timeout_sec + 1
+            if not self.replay_filter.check_and_add(nonce, expiry,
+                                                    _get_timestamp()):
+                self._record(REPLAYED_TOKEN)
+                return False
+        return self.verify_response(user_answer, context)
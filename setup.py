@@ -20,7 +20,7 @@ INSTALL_REQUIRES = [
     'numpy',
     'matplotlib',
     'pandas',
-    'python-Levenshtein'
+    'python-Levenshtein>=0.20'
 ]
 TESTS_REQUIRE = [
     'tox',
@@ -39,7 +39,10 @@ setup(
     include_package_data=True,
     install_requires=INSTALL_REQUIRES,
     tests_require=TESTS_REQUIRE,
-    extras_require={'develop': TESTS_REQUIRE},
+    extras_require={'develop': TESTS_REQUIRE, 'arrow': ['pyarrow']},
+    entry_points={
+        'console_scripts': ['open-captcha = open_captcha.cli:main'],
+    },
     long_description=README,
     long_description_content_type="text/markdown",
     description='CAPTCHA challenges generated from your service\'s data',
@@ -0,0 +1,34 @@
+import argparse
+import sys
+
+from tests.benchmarks import suite
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=suite.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Number of timed calls per case (scaled for very slow/fast cases)')
+    parser.add_argument('--quick', action='store_true', help='Only use small tables')
+    parser.add_argument('--filter', help='Only run benchmarks whose name contains this string')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Compare with the results in this JSON file')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed p50 slowdown relative to --compare (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    results = suite.run(args.repeat, args.quick, args.filter,
+                        progress=lambda result: print(suite.format_result(result), flush=True))
+    if args.output:
+        suite.save(results, args.output)
+    if args.compare:
+        regressions = suite.compare(results, suite.load(args.compare), args.max_regression)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Compare the speed and output size of the bar chart rendering backends.
+
+Run with: python -m tests.benchmarks.rendering_backends
+"""
+import argparse
+import statistics
+import time
+
+from open_captcha.common_types import RenderingOptions
+from open_captcha.challenge_templates import render_bar_chart
+
+# The data used by the rendering and integration tests
+LABEL_VALUE_PAIRS = {
+    'bar-chart': [('USA', 325), ('China', 1435), ('Italy', 60)],
+    'report-counts': [('Boston', 800), ('New York', 9666), ('Los Angeles', 5000),
+                      ('West Yellowstone', 5)],
+}
+FIGURE_SIZES = [(6, 4), (4, 3)]
+BACKENDS = ['matplotlib', 'raster']
+
+
+def time_render(pairs, options, repeat):
+    render_bar_chart(pairs, options)  # Warm up (imports, font caches)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chart = render_bar_chart(pairs, options)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(chart)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+    print(f'{"data":<15}{"size":<10}{"backend":<12}{"median ms":>10}{"bytes":>8}{"speedup":>9}')
+    for data_name, pairs in LABEL_VALUE_PAIRS.items():
+        for figure_size in FIGURE_SIZES:
+            reference = None
+            for backend in BACKENDS:
+                options = RenderingOptions(figure_size=figure_size, backend=backend)
+                median, size = time_render(pairs, options, args.repeat)
+                reference = reference or median
+                print(f'{data_name:<15}{str(figure_size):<10}{backend:<12}'
+                      f'{median * 1000:>10.2f}{size:>8}{reference / median:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""Benchmark suite for challenge generation, rendering, verification and
+serialization.
+
+Run with: python -m tests.benchmarks --output results.json
+Compare with a previous run (exits with status 1 on regressions):
+    python -m tests.benchmarks --compare baseline.json --max-regression 0.2
+
+Each benchmark case is timed `repeat` times after a warm-up call. The results
+report latency percentiles in milliseconds and the peak memory allocated by a
+single call (measured separately with tracemalloc, which slows code down).
+"""
+import dataclasses
+import functools
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from open_captcha import __version__
+from open_captcha.common_types import RNG, RenderingOptions, ServerContext
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.challenge_templates import MinMaxBarTemplate, render_bar_chart
+from open_captcha.verification import ResponseVerifier, _get_timestamp
+
+TABLE_SIZES = [100, 10_000, 100_000]
+QUICK_TABLE_SIZES = [100]
+NS = [3, 4]
+FIGURE_SIZES = [(4, 3), (6.4, 4.8), (8, 6)]
+BACKENDS = ['matplotlib', 'raster']
+ANSWER_LENGTHS = [5, 20, 100, 10_000]
+
+
+@dataclasses.dataclass
+class Case:
+    name: str
+    params: Dict[str, object]
+    func: Callable[[], object]
+    repeat_factor: float = 1.0  # For very slow or very fast cases
+
+
+@dataclasses.dataclass
+class Result:
+    name: str
+    params: Dict[str, object]
+    repeat: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    peak_memory_bytes: int
+
+    @property
+    def key(self) -> str:
+        params = ','.join(f'{k}={v}' for k, v in sorted(self.params.items()))
+        return f'{self.name}[{params}]'
+
+
+#################################################################
+# Data
+#################################################################
+def make_rows(num_rows: int, seed: int = 0) -> List[dict]:
+    rng = np.random.RandomState(seed)
+    return [
+        dict(city_name=f'City {i}', num_symptoms=int(symptoms), num_deaths=int(deaths))
+        for i, (symptoms, deaths) in enumerate(zip(
+            rng.randint(0, 100_000, num_rows), rng.randint(0, 1000, num_rows)))
+    ]
+
+
+def template_configs(n: int) -> List:
+    return [
+        ['min-max-bar', dict(question='Which of these {n} cities had the most symptoms?',
+                             table='report_counts', labels='city_name', values='num_symptoms',
+                             variant='max', n=n)],
+        ['min-max-bar', dict(question='Which of these {n} cities had the least deaths?',
+                             table='report_counts', labels='city_name', values='num_deaths',
+                             variant='min', n=n)],
+    ]
+
+
+#################################################################
+# Cases
+#################################################################
+def generator_cases(table_sizes: Sequence[int]) -> Iterator[Case]:
+    for num_rows in table_sizes:
+        data = {'report_counts': make_rows(num_rows)}
+        for n in NS:
+            configs = template_configs(n)
+            for verify_config in (False, True):
+                yield Case('generator_construction',
+                           dict(rows=num_rows, n=n, verify_config=verify_config),
+                           functools.partial(CaptchaGenerator, data, configs,
+                                             response_timeout_sec=180,
+                                             verify_config=verify_config),
+                           repeat_factor=0.2)
+            generator = CaptchaGenerator(data, configs, response_timeout_sec=180, rng_seed=0,
+                                         verify_config=False)
+            yield Case('generate_challenge', dict(rows=num_rows, n=n),
+                       generator.generate_challenge)
+
+
+def template_cases(table_sizes: Sequence[int]) -> Iterator[Case]:
+    for num_rows in table_sizes:
+        data = {'report_counts': pd.DataFrame.from_records(make_rows(num_rows))}
+        for n in NS:
+            template = MinMaxBarTemplate(
+                question='Which?', table='report_counts', labels='city_name',
+                values='num_symptoms', variant='max', n=n)
+            rng = RNG(0)
+            yield Case('template_generate_challenge', dict(rows=num_rows, n=n),
+                       functools.partial(template.generate_challenge, data, rng))
+
+
+def rendering_cases() -> Iterator[Case]:
+    for n in NS:
+        pairs = [(row['city_name'], row['num_symptoms']) for row in make_rows(n)]
+        for backend in BACKENDS:
+            for figure_size in FIGURE_SIZES:
+                options = RenderingOptions(figure_size=figure_size, backend=backend)
+                yield Case('render_bar_chart',
+                           dict(n=n, backend=backend, figure_size='x'.join(map(str, figure_size))),
+                           functools.partial(render_bar_chart, pairs, options))
+            options = RenderingOptions(figure_size=(6.4, 4.8), backend=backend, distortion=1)
+            yield Case('render_bar_chart_distorted', dict(n=n, backend=backend),
+                       functools.partial(render_bar_chart, pairs, options))
+
+
+def verification_cases() -> Iterator[Case]:
+    verifier = ResponseVerifier(response_timeout_sec=180)
+    for length in ANSWER_LENGTHS:
+        correct_answer = ('abcdefghij' * (length // 10 + 1))[:length]
+        context = ServerContext(_get_timestamp(), 1, correct_answer)
+        answers = {
+            'exact': correct_answer,
+            'typo': 'X' + correct_answer[1:],
+            'wrong': 'Z' * length,
+        }
+        for kind, answer in answers.items():
+            yield Case('verify_response', dict(answer_length=length, answer=kind),
+                       functools.partial(verifier.verify_response, answer, context),
+                       repeat_factor=10)
+
+
+def serialization_cases() -> Iterator[Case]:
+    context = ServerContext(_get_timestamp(), 1, 'west yellowstone')
+    context_json = context.to_json()
+    yield Case('server_context_to_json', {}, context.to_json, repeat_factor=10)
+    yield Case('server_context_from_json', {}, lambda: ServerContext.from_json(context_json),
+               repeat_factor=10)
+
+
+def all_cases(quick: bool = False) -> Iterator[Case]:
+    table_sizes = QUICK_TABLE_SIZES if quick else TABLE_SIZES
+    yield from generator_cases(table_sizes)
+    yield from template_cases(table_sizes)
+    yield from rendering_cases()
+    yield from verification_cases()
+    yield from serialization_cases()
+
+
+#################################################################
+# Runner
+#################################################################
+def _percentile(sorted_values: Sequence[float], q: float) -> float:
+    return float(np.percentile(sorted_values, q))
+
+
+def run_case(case: Case, repeat: int) -> Result:
+    case.func()  # Warm up
+    repeat = max(1, int(repeat * case.repeat_factor))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case.func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    tracemalloc.start()
+    try:
+        case.func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(
+        name=case.name,
+        params=case.params,
+        repeat=repeat,
+        p50_ms=_percentile(timings, 50),
+        p95_ms=_percentile(timings, 95),
+        p99_ms=_percentile(timings, 99),
+        mean_ms=statistics.mean(timings),
+        peak_memory_bytes=peak_memory,
+    )
+
+
+def run(repeat: int = 20, quick: bool = False, name_filter: str = None,
+        progress: Callable[[Result], None] = None) -> dict:
+    results = []
+    for case in all_cases(quick):
+        if name_filter and name_filter not in case.name:
+            continue
+        result = run_case(case, repeat)
+        results.append(result)
+        if progress is not None:
+            progress(result)
+    return {
+        'open_captcha_version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': [dict(dataclasses.asdict(r), key=r.key) for r in results],
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Return descriptions of cases whose p50 regressed by more than the
+    given fraction compared to the baseline."""
+    baseline_by_key = {r['key']: r for r in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        base = baseline_by_key.get(result['key'])
+        if base is None or base['p50_ms'] <= 0:
+            continue
+        ratio = result['p50_ms'] / base['p50_ms']
+        if ratio > 1 + max_regression:
+            regressions.append(f'{result["key"]}: p50 {base["p50_ms"]:.3f} ms -> '
+                               f'{result["p50_ms"]:.3f} ms ({ratio:.2f}x)')
+    return regressions
+
+
+def format_result(result: Result) -> str:
+    return (f'{result.key:<75} p50 {result.p50_ms:9.3f} ms  p95 {result.p95_ms:9.3f} ms  '
+            f'p99 {result.p99_ms:9.3f} ms  peak {result.peak_memory_bytes / 1024:9.1f} KiB')
+
+
+def save(results: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,27 @@
+_REPORT_COUNTS = [
+    ('New York', 9666, 123),
+    ('Los Angeles', 5000, 23),
+    ('Boston', 800, 250),
+    ('Detroit', 0, 1),
+    ('West Yellowstone', 5, 2),
+]
+
+
+def report_counts(num_rows: int = 4, deaths: bool = True):
+    """Rows of the report_counts table, a new list on each call."""
+    rows = []
+    for city_name, num_symptoms, num_deaths in _REPORT_COUNTS[:num_rows]:
+        row = dict(city_name=city_name, num_symptoms=num_symptoms)
+        if deaths:
+            row['num_deaths'] = num_deaths
+        rows.append(row)
+    return rows
+
+
+def min_max_bar_config(question: str = 'Most symptoms?',
+                       values: str = 'num_symptoms',
+                       variant: str = 'max',
+                       n: int = 3):
+    """A min-max-bar template config over the report_counts table."""
+    return ['min-max-bar', dict(question=question, table='report_counts', labels='city_name',
+                                values=values, variant=variant, n=n)]
@@ -1,3 +1,5 @@
+import time
+
 from open_captcha.common_types import Challenge
 from open_captcha.challenge_templates import ChallengeTemplate
 
@@ -5,14 +7,16 @@ from open_captcha.challenge_templates import ChallengeTemplate
 class QuestTemplate(ChallengeTemplate):
     config_name = 'quest'
 
-    def __init__(self, quest: str = 'the holy grail', error_msg: str = None):
+    def __init__(self, quest: str = 'the holy grail', error_msg: str = None, delay_sec: float = 0):
         self.question = 'What is your quest?'
         self.answer = f'to find {quest}'
         self.chart = b'blerg'
         self.possible_answers = [self.answer, 'Not this', 'Not that either']
         self.error_msg = error_msg
+        self.delay_sec = delay_sec
 
     def generate_challenge(self, data, rng, rendering_options=None):
+        time.sleep(self.delay_sec)
         if self.error_msg:
             raise Exception(self.error_msg)
 
@@ -22,3 +26,14 @@ class QuestTemplate(ChallengeTemplate):
             possible_answers=self.possible_answers
         )
         return challenge, self.answer
+
+
+class CounterTemplate(ChallengeTemplate):
+    config_name = 'counter'
+
+    def __init__(self):
+        self.count = 0
+
+    def generate_challenge(self, data, rng, rendering_options=None):
+        self.count += 1
+        return Challenge('Count?', b'blerg', [str(self.count)]), str(self.count)
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+import unittest
+import unittest.mock
+from open_captcha.captcha_generator import CaptchaGenerator
+from tests.fake_template import QuestTemplate
+
+
+class AsyncApiTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.captcha = CaptchaGenerator(
+            data={},
+            template_configs=[('quest', dict()), ('quest', dict(quest='peace'))],
+            response_timeout_sec=180,
+        )
+
+    def test_agenerate_and_averify(self):
+        render_threads = []
+        original = QuestTemplate.generate_challenge
+
+        def generate(template, *args):
+            render_threads.append(threading.get_ident())
+            return original(template, *args)
+
+        async def run():
+            challenge_id, challenge, context = await self.captcha.agenerate_challenge(attempt_number=2)
+            self.assertEqual(context.verification_attempt_number, 2)
+            self.assertTrue(await self.captcha.averify_response(context.correct_answer, context))
+            self.assertFalse(await self.captcha.averify_response('to find a shrubbery', context))
+            return threading.get_ident()
+
+        with unittest.mock.patch.object(QuestTemplate, 'generate_challenge', generate):
+            loop_thread = asyncio.run(run())
+        self.assertEqual(len(render_threads), 1)
+        self.assertNotEqual(render_threads[0], loop_thread)
+
+    def test_concurrency_limit_and_cancellation(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+        original = QuestTemplate.generate_challenge
+
+        def slow_generate(template, *args):
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return original(template, *args)
+
+        async def run():
+            tasks = [asyncio.ensure_future(self.captcha.agenerate_challenge()) for _ in range(10)]
+            await asyncio.sleep(0.01)
+            tasks[-1].cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            self.assertIsInstance(results[-1], asyncio.CancelledError)
+            self.assertEqual(len({r[0] for r in results[:-1]}), 9)
+            # All semaphore slots are eventually released
+            for _ in range(100):
+                if self.captcha._render_semaphores[asyncio.get_running_loop()]._value == 3:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(self.captcha._render_semaphores[asyncio.get_running_loop()]._value, 3)
+
+        self.captcha.configure_async(max_concurrent_renders=3)
+        with unittest.mock.patch.object(QuestTemplate, 'generate_challenge', slow_generate):
+            asyncio.run(run())
+            asyncio.run(run())  # Works on a new event loop as well
+        self.assertLessEqual(max(max_running), 3)
+
+    def test_process_executor(self):
+        async def run():
+            results = await asyncio.gather(*[self.captcha.agenerate_challenge() for _ in range(4)])
+            for _, challenge, context in results:
+                self.assertIn(context.correct_answer, challenge.possible_answers)
+
+        with self.captcha.create_process_pool(workers=2) as executor:
+            self.captcha.configure_async(executor)
+            asyncio.run(run())
+
+    def test_process_executor_cancellation(self):
+        captcha = CaptchaGenerator(data={}, template_configs=[('quest', dict(delay_sec=0.5))],
+                                   response_timeout_sec=180)
+
+        async def run():
+            await captcha.agenerate_challenge()  # Wait for the worker to start
+            semaphore = captcha._render_semaphores[asyncio.get_running_loop()]
+            task = asyncio.ensure_future(captcha.agenerate_challenge())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # The render is still running, and still holds its slot
+            self.assertTrue(semaphore.locked())
+            _, challenge, context = await captcha.agenerate_challenge()
+            self.assertIn(context.correct_answer, challenge.possible_answers)
+
+        with captcha.create_process_pool(workers=1) as executor:
+            captcha.configure_async(executor, max_concurrent_renders=1)
+            with unittest.mock.patch('concurrent.futures._base.LOGGER') as mock_logger:
+                asyncio.run(run())
+        mock_logger.exception.assert_not_called()
+
+    def test_render_errors(self):
+        async def run():
+            with self.assertRaisesRegex(Exception, 'boom!'):
+                await self.captcha.agenerate_challenge()
+
+        with unittest.mock.patch.object(QuestTemplate, 'generate_challenge', side_effect=Exception('boom!')):
+            asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
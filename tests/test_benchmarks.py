@@ -0,0 +1,31 @@
+import unittest
+
+from tests.benchmarks import suite
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+    def test_run(self):
+        results = suite.run(repeat=3, name_filter='server_context')
+        self.assertEqual(['server_context_to_json[]', 'server_context_from_json[]'],
+                         [r['key'] for r in results['results']])
+        for result in results['results']:
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertLessEqual(result['p95_ms'], result['p99_ms'])
+            self.assertGreater(result['peak_memory_bytes'], 0)
+
+    def test_cases_bind_their_parameters(self):
+        cases = list(suite.verification_cases())
+        self.assertEqual([case.params['answer'] != 'wrong' for case in cases],
+                         [case.func() for case in cases])
+
+    def test_compare(self):
+        baseline = {'results': [{'key': 'a[]', 'p50_ms': 1.0}, {'key': 'b[]', 'p50_ms': 1.0}]}
+        results = {'results': [{'key': 'a[]', 'p50_ms': 1.1}, {'key': 'b[]', 'p50_ms': 1.5},
+                               {'key': 'c[]', 'p50_ms': 9.0}]}
+        regressions = suite.compare(results, baseline, max_regression=0.2)
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith('b[]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
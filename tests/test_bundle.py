@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from open_captcha.bundle import BadBundle, ChallengeBundle, write_bundle
+from open_captcha.cli import main
+from open_captcha.common_types import Challenge
+from open_captcha.tokens import TokenSigner
+from tests.fake_data import min_max_bar_config, report_counts
+
+
+class ChallengeBundleTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, 'challenges.bundle')
+        self.signer = TokenSigner({'k1': TokenSigner.generate_key()}, 'k1')
+        self.challenges = [
+            (Challenge('Most symptoms?', b'\x89PNG\r\n\x1a\nchart 1', ['New York', 'Boston']), 'New York'),
+            (Challenge('Least deaths in ירושלים?', b'chart 2', ['Tel Aviv', 'Haifa', 'ירושלים']), 'ירושלים'),
+            (Challenge('Empty chart?', b'', ['a']), 'a'),
+        ]
+
+    def _open(self, signer=None):
+        bundle = ChallengeBundle(self.path, signer or self.signer, response_timeout_sec=180)
+        self.addCleanup(bundle.close)
+        return bundle
+
+    def test_round_trip(self):
+        self.assertEqual(3, write_bundle(self.path, iter(self.challenges), self.signer))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        bundle = self._open()
+        self.assertEqual(3, len(bundle))
+        for i, (challenge, answer) in enumerate(self.challenges):
+            actual_challenge, actual_answer = bundle.get(i)
+            self.assertEqual(challenge, actual_challenge)
+            self.assertIsInstance(actual_challenge.chart, bytes)
+            chart_view = bundle.get_chart(i)
+            self.assertIsInstance(chart_view, memoryview)
+            self.assertEqual(challenge.chart, chart_view)
+            self.assertTrue(chart_view.readonly)
+            self.assertEqual(answer.casefold(), actual_answer)
+        self.assertEqual('png', bundle.get(0)[0].image_format)
+        with self.assertRaises(IndexError):
+            bundle.get(3)
+        with self.assertRaises(IndexError):
+            bundle.get_chart(-1)
+
+    def test_answers_are_sealed(self):
+        write_bundle(self.path, self.challenges, self.signer)
+        with open(self.path, 'rb') as f:
+            contents = f.read()
+        self.assertNotIn(b'new york', contents)
+        other_signer = TokenSigner({'k1': TokenSigner.generate_key()}, 'k1')
+        with self.assertRaises(Exception):
+            self._open(other_signer).get(0)
+
+    def test_generate_and_verify(self):
+        write_bundle(self.path, self.challenges[:1], self.signer)
+        bundle = self._open()
+        challenge_id, challenge, context = bundle.generate_challenge(attempt_number=2)
+        self.assertEqual(32, len(challenge_id))
+        self.assertEqual(2, context.verification_attempt_number)
+        self.assertTrue(bundle.verify_response('New York', context))
+        self.assertFalse(bundle.verify_response('Boston', context))
+
+        token, challenge = bundle.generate_challenge_token()
+        self.assertEqual(self.challenges[0][0], challenge)
+        self.assertTrue(bundle.verify_token('new york', token))
+        self.assertFalse(bundle.verify_token('new york', token))  # Replayed
+
+    def test_random_entries(self):
+        write_bundle(self.path, self.challenges, self.signer)
+        bundle = self._open()
+        answers = {bundle.render_challenge()[1] for _ in range(100)}
+        self.assertEqual({'new york', 'ירושלים', 'a'}, answers)
+
+    def test_close(self):
+        write_bundle(self.path, self.challenges, self.signer)
+        with ChallengeBundle(self.path, self.signer, response_timeout_sec=180) as bundle:
+            bundle.get(0)
+        self.assertTrue(bundle._map.closed)
+
+    def test_close_with_live_charts(self):
+        write_bundle(self.path, self.challenges, self.signer)
+        with ChallengeBundle(self.path, self.signer, response_timeout_sec=180) as bundle:
+            _, challenge, _ = bundle.generate_challenge()
+            chart_view = bundle.get_chart(0)
+        self.assertIn(challenge.chart, [c.chart for c, _ in self.challenges])  # Still readable
+        self.assertEqual(self.challenges[0][0].chart, chart_view)  # Still mapped
+
+    def test_bad_bundles(self):
+        for contents in [b'', b'not a bundle at all, not at all', b'OCBUNDL1' + bytes(16)]:
+            with open(self.path, 'wb') as f:
+                f.write(contents)
+            with self.assertRaises(BadBundle):
+                self._open()
+        write_bundle(self.path, self.challenges, self.signer)
+        with open(self.path, 'ab') as f:
+            f.write(b'x')
+        with self.assertRaises(BadBundle):
+            self._open()
+
+
+class PregenerateCommandTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.key = TokenSigner.generate_key()
+        self.files = {}
+        data = {'report_counts': report_counts(num_rows=3)}
+        for name, contents in [('data.json', json.dumps(data)),
+                               ('templates.json', json.dumps([min_max_bar_config()])),
+                               ('bundle.key', self.key)]:
+            self.files[name] = os.path.join(self.tmp_dir.name, name)
+            with open(self.files[name], 'wb') as f:
+                f.write(contents if isinstance(contents, bytes) else contents.encode())
+        self.output = os.path.join(self.tmp_dir.name, 'challenges.bundle')
+
+    def _args(self, *extra_args):
+        return ['pregenerate', '--data', self.files['data.json'],
+                '--templates', self.files['templates.json'], '--key-file', self.files['bundle.key'],
+                '--output', self.output, *extra_args]
+
+    def test_pregenerate(self):
+        with mock.patch('builtins.print') as mock_print:
+            main(self._args('--count', '5', '--workers', '1', '--key-id', 'k1',
+                            '--rendering-options', '{"figure_size": [3, 2], "backend": "raster"}'))
+        mock_print.assert_called_once_with(f'Wrote 5 challenges to {self.output}')
+        signer = TokenSigner({'k1': self.key}, 'k1')
+        bundle = ChallengeBundle(self.output, signer, response_timeout_sec=180)
+        self.addCleanup(bundle.close)
+        self.assertEqual(5, len(bundle))
+        for i in range(5):
+            challenge, answer = bundle.get(i)
+            self.assertEqual(('Most symptoms?', 'png', 'new york'),
+                             (challenge.question, challenge.image_format, answer))
+
+    def test_errors(self):
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit) as cm:
+                main(self._args('--count', '1', '--rendering-options', '{"no_such_option": 1}'))
+            self.assertIn('no_such_option', str(cm.exception.code))
+            with open(self.files['templates.json'], 'w') as f:
+                f.write('[["no-such-template", {}]]')
+            with self.assertRaises(SystemExit) as cm:
+                main(self._args('--count', '1'))
+            self.assertIn('no-such-template', str(cm.exception.code))
+            with self.assertRaises(SystemExit):
+                main(['pregenerate'])  # Missing arguments
+
+
+if __name__ == '__main__':
+    unittest.main()
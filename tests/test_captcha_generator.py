@@ -1,23 +1,17 @@
+import concurrent.futures
+import threading
 import unittest
 import unittest.mock
-import time
 import pandas as pd
-from open_captcha.common_types import Challenge, ServerContext
-from open_captcha.captcha_generator import (
-    _get_timestamp, _generate_challenge_id, _verify_timeout, _verify_text_is_close, CaptchaGenerator
-)
+from open_captcha.common_types import Challenge, ConfigurationError, RenderingOptions, ServerContext
+from open_captcha.captcha_generator import _generate_challenge_id, CaptchaGenerator
+from open_captcha.challenge_templates import MinMaxBarTemplate
+from open_captcha.sampling import TemplateSampler
+from tests.fake_data import min_max_bar_config, report_counts
 from tests.fake_template import QuestTemplate
 
 
 class HelperFunctionsTest(unittest.TestCase):
-    def test_get_timestamp(self):
-        t = _get_timestamp()
-        self.assertIsInstance(t, int)
-        time.sleep(1.1)
-        t2 = _get_timestamp()
-        self.assertGreaterEqual(t2 - t, 1)
-        self.assertLessEqual(t2 - t, 3)
-
     def test_generate_challenge_id(self):
         challenge_ids = {_generate_challenge_id() for _ in range(10)}
         self.assertEqual(len(challenge_ids), 10)  # no duplicates
@@ -25,23 +19,6 @@ class HelperFunctionsTest(unittest.TestCase):
             assert isinstance(cid, str)
             self.assertEqual(len(cid), 32)
 
-    @unittest.mock.patch('open_captcha.captcha_generator._get_timestamp')
-    def test_verify_timeout(self, mock_get_timestamp):
-        t0 = 100
-        delta = 10
-        mock_get_timestamp.return_value = t0 + delta
-        self.assertEqual(_verify_timeout(t0, timeout=delta), True)
-        mock_get_timestamp.assert_called_once_with()
-        self.assertEqual(_verify_timeout(t0, timeout=delta - 1), False)
-
-    def test_verify_text_is_close(self):
-        self.assertEqual(_verify_text_is_close('abcde', 'abcde', 5), True)
-        self.assertEqual(_verify_text_is_close('abcde', 'abc', 5), False)
-        self.assertEqual(_verify_text_is_close('abcde', 'XbcdX', 5), False)
-        self.assertEqual(_verify_text_is_close('abcdef', 'XbcdXf', 5), True)
-        self.assertEqual(_verify_text_is_close('abcde', 'XbcdX', 4), True)
-        self.assertEqual(_verify_text_is_close('abcd', 'XbcdX', 4), False)
-
 
 class CaptchaGeneratorTest(unittest.TestCase):
     def setUp(self):
@@ -86,7 +63,8 @@ class CaptchaGeneratorTest(unittest.TestCase):
         self.assertEqual(len(captcha.templates), len(self.template_configs))
         for template in captcha.templates:
             self.assertIsInstance(template, QuestTemplate)
-        mock_RNG.assert_called_once_with(None)
+        # The generator's RNG is created first, verification renders use their own.
+        self.assertEqual(unittest.mock.call(None), mock_RNG.call_args_list[0])
         self.assertEqual(captcha._non_crypto_rng, mock_RNG.return_value)
 
     def test_bad_configs(self):
@@ -98,6 +76,66 @@ class CaptchaGeneratorTest(unittest.TestCase):
         with self.assertRaisesRegex(Exception, 'boom!'):
             self._get_captcha_generator(self.data, template_configs)
 
+    def test_bad_min_max_bar_configs(self):
+        for params, error in [(dict(table='nosuch'), 'Table nosuch not found'),
+                              (dict(labels='nosuch'), 'Column nosuch not found'),
+                              (dict(values='nosuch'), 'Column nosuch not found'),
+                              (dict(values='city_name'), 'must be numeric')]:
+            template_configs = [
+                ('min-max-bar', dict(dict(question='?', table='report_counts', labels='city_name',
+                                          values='num_symptoms', variant='max'), **params)),
+            ]
+            with self.assertRaisesRegex(ConfigurationError, error):
+                self._get_captcha_generator(self.data, template_configs)
+            # Reported when a challenge is generated instead
+            self._get_captcha_generator(self.data, template_configs, verify_config=False)
+
+    def test_verify_config_modes(self):
+        template_configs = self.template_configs + [
+            ('min-max-bar', dict(question='?', table='report_counts', labels='city_name',
+                                 values='num_symptoms', variant='max')),
+        ]
+        threads = set()
+
+        def generate_challenge(template, data, rng, rendering_options=None):
+            threads.add(threading.current_thread().name)
+            return Challenge('?', b'', ['a']), 'a'
+
+        for verify_config, num_renders in [(True, 3), ('render', 4), (False, 0)]:
+            with unittest.mock.patch.object(QuestTemplate, 'generate_challenge', autospec=True,
+                                            side_effect=generate_challenge) as mock_quest, \
+                    unittest.mock.patch.object(MinMaxBarTemplate, 'generate_challenge', autospec=True,
+                                               side_effect=generate_challenge) as mock_bar:
+                self._get_captcha_generator(self.data, template_configs, verify_config=verify_config)
+            # The min-max-bar template is validated without rendering, unless asked to
+            self.assertEqual(num_renders, mock_quest.call_count + mock_bar.call_count)
+            self.assertEqual(num_renders == 4, mock_bar.called)
+        self.assertTrue(all(name.startswith('open-captcha-verify') for name in threads))
+        with self.assertRaisesRegex(ConfigurationError, 'verify_config'):
+            self._get_captcha_generator(self.data, template_configs, verify_config='yes')
+
+    def test_update_tables(self):
+        captcha = self._get_captcha_generator(self.data, self.template_configs)
+        old_data = captcha.data
+        new_rows = self.data['report_counts'][:2]
+        with unittest.mock.patch.object(QuestTemplate, 'prepare') as mock_prepare:
+            captcha.update_tables({'report_counts': new_rows, 'other': [dict(a=1)]})
+        self.assertIsNot(captcha.data, old_data)
+        self.assertEqual(captcha.data.keys(), {'report_counts', 'other'})
+        pd.testing.assert_frame_equal(captcha.data['report_counts'], pd.DataFrame.from_records(new_rows))
+        self.assertEqual(len(old_data['report_counts']), 5)  # Old snapshot left untouched
+        # Quest templates don't declare their tables, so they are all prepared again.
+        self.assertEqual(mock_prepare.call_count, len(self.template_configs))
+        mock_prepare.assert_called_with(captcha.data)
+
+    def test_update_tables_verification_failure(self):
+        captcha = self._get_captcha_generator(self.data, self.template_configs)
+        old_data = captcha.data
+        with unittest.mock.patch.object(QuestTemplate, 'generate_challenge', side_effect=Exception('boom!')):
+            with self.assertRaisesRegex(Exception, 'boom!'):
+                captcha.update_tables({'report_counts': []})
+        self.assertIs(captcha.data, old_data)
+
     @unittest.mock.patch('open_captcha.captcha_generator._get_timestamp')
     @unittest.mock.patch('open_captcha.captcha_generator._generate_challenge_id')
     def test_generate_challenge(self, mock_generate_challenge_id, mock_get_timestamp):
@@ -107,8 +145,9 @@ class CaptchaGeneratorTest(unittest.TestCase):
         mock_template = unittest.mock.Mock()
         mock_template.generate_challenge.return_value = silly_challenge, correct_answer
         mock_rng = unittest.mock.Mock()
-        mock_rng.choice.return_value = mock_template
+        mock_rng.random.return_value = 0.75  # Picks the 2nd of 2 equally weighted templates
         captcha = self._get_captcha_generator(self.data, self.template_configs)
+        captcha._templates_and_sampler = ([unittest.mock.Mock(), mock_template], TemplateSampler([1, 1]))
         captcha._non_crypto_rng = mock_rng
         attempt_number = 666
 
@@ -126,8 +165,8 @@ class CaptchaGeneratorTest(unittest.TestCase):
         )
         self.assertEqual(context, expected_context)
 
-    @unittest.mock.patch('open_captcha.captcha_generator._verify_text_is_close')
-    @unittest.mock.patch('open_captcha.captcha_generator._verify_timeout')
+    @unittest.mock.patch('open_captcha.verification._verify_text_is_close')
+    @unittest.mock.patch('open_captcha.verification._verify_timeout')
     def test_verify_response(self, mock_verify_timeout, mock_verify_text):
         captcha = self._get_captcha_generator(self.data, self.template_configs)
         context = ServerContext(
@@ -156,5 +195,61 @@ class CaptchaGeneratorTest(unittest.TestCase):
         check(True, True)
 
 
+class ThreadSafeGenerationTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = {'report_counts': report_counts(deaths=False)}
+        self.template_configs = [
+            min_max_bar_config(n=4),
+            min_max_bar_config(question='Least symptoms?', variant='min'),
+        ]
+        self.rendering_options = RenderingOptions(figure_size=(3, 2), backend='raster')
+
+    def _get_captcha_generator(self, rng_seed=0):
+        return CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180,
+                                rng_seed=rng_seed, thread_safe=True)
+
+    def _render(self, captcha, count, rng=None):
+        return [captcha.render_challenge(self.rendering_options, rng) for _ in range(count)]
+
+    def test_spawned_streams_are_reproducible(self):
+        first, second = self._get_captcha_generator(), self._get_captcha_generator()
+        streams = [self._render(first, 10, first.spawn_rng()) for _ in range(3)]
+        self.assertEqual(streams, [self._render(second, 10, second.spawn_rng()) for _ in range(3)])
+        self.assertNotEqual(streams[0], streams[1])
+        other_seed = self._get_captcha_generator(rng_seed=1)
+        self.assertNotEqual(streams[0], self._render(other_seed, 10, other_seed.spawn_rng()))
+
+    def test_rng_per_thread(self):
+        captcha = self._get_captcha_generator()
+        self.assertIs(captcha._get_rng(), captcha._get_rng())
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            self.assertIsNot(captcha._get_rng(), executor.submit(captcha._get_rng).result())
+        not_thread_safe = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180)
+        self.assertIs(not_thread_safe._non_crypto_rng, not_thread_safe._get_rng())
+
+    def test_concurrent_generation(self):
+        captcha = self._get_captcha_generator()
+        num_threads = 8
+        barrier = threading.Barrier(num_threads)
+
+        def render():
+            barrier.wait()
+            return self._render(captcha, 10)
+
+        with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+            futures = [executor.submit(render) for _ in range(num_threads)]
+            results = [f.result() for f in futures]
+        # Each thread rendered one of the first spawned streams
+        reference = self._get_captcha_generator()
+        expected = [self._render(reference, 10, reference.spawn_rng()) for _ in range(num_threads)]
+        self.assertCountEqual(expected, results)
+
+    def test_stateful_template(self):
+        with self.assertRaisesRegex(ConfigurationError, 'CounterTemplate.*thread_safe'):
+            CaptchaGenerator({}, [('counter', {})], response_timeout_sec=180, thread_safe=True)
+        CaptchaGenerator({}, [('counter', {})], response_timeout_sec=180)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import unittest.mock
+from open_captcha.common_types import ConfigurationError, RenderingOptions
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.challenge_pool import ChallengePool
+from tests.fake_template import QuestTemplate
+
+
+class ChallengePoolTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.generator = CaptchaGenerator(
+            data={},
+            template_configs=[('quest', dict()), ('quest', dict(quest='peace'))],
+            response_timeout_sec=180,
+        )
+
+    def test_bad_watermarks(self):
+        with self.assertRaisesRegex(ConfigurationError, 'watermarks'):
+            ChallengePool(self.generator, low_watermark=5, high_watermark=5)
+        with self.assertRaisesRegex(ConfigurationError, 'num_workers'):
+            ChallengePool(self.generator, num_workers=0)
+
+    def test_empty_pool_falls_back_to_sync_rendering(self):
+        pool = ChallengePool(self.generator, low_watermark=1, high_watermark=2)
+        challenge_id, challenge, context = pool.generate_challenge(attempt_number=3)
+        self.assertEqual(challenge.question, 'What is your quest?')
+        self.assertEqual(context.verification_attempt_number, 3)
+        self.assertTrue(pool.verify_response(context.correct_answer, context))
+        stats = pool.stats
+        self.assertEqual((stats.hits, stats.misses, stats.rendered), (0, 1, 0))
+
+    def test_pool_is_filled_and_served(self):
+        with ChallengePool(self.generator, low_watermark=2, high_watermark=5, num_workers=2) as pool:
+            self.assertTrue(pool.wait_until_full(timeout=10))
+            self.assertEqual(pool.stats.size, 5)
+            challenge_ids = set()
+            for _ in range(3):
+                challenge_id, challenge, context = pool.generate_challenge()
+                challenge_ids.add(challenge_id)
+                self.assertIn(context.correct_answer, challenge.possible_answers)
+            self.assertEqual(len(challenge_ids), 3)
+            # Dropping to the low watermark triggers a refill up to the high one.
+            self.assertTrue(pool.wait_until_full(timeout=10))
+            stats = pool.stats
+        self.assertEqual(stats.hits, 3)
+        self.assertEqual(stats.misses, 0)
+        self.assertEqual(stats.size, 5)
+        self.assertEqual(stats.rendered, 8)
+
+    def test_other_rendering_options_bypass_the_pool(self):
+        pool = ChallengePool(self.generator, low_watermark=1, high_watermark=2)
+        pool.generate_challenge(rendering_options=RenderingOptions(figure_size=(1, 1)))
+        self.assertEqual(pool.stats.bypasses, 1)
+        self.assertEqual(pool.stats.misses, 0)
+
+    @unittest.mock.patch.object(QuestTemplate, 'generate_challenge', side_effect=Exception('boom!'))
+    def test_render_errors_are_counted(self, mock_generate):
+        with ChallengePool(self.generator, low_watermark=1, high_watermark=3) as pool:
+            for _ in range(100):
+                if pool.stats.errors:
+                    break
+                pool.wait_until_full(timeout=0.05)
+        self.assertGreaterEqual(pool.stats.errors, 1)
+        self.assertEqual(pool.stats.size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
+import pickle
 import sys
+import threading
 import pytest
 import unittest
 import unittest.mock
@@ -7,8 +9,9 @@ from open_captcha.common_types import CaptchaError, RenderingOptions, RNG
 from open_captcha.challenge_templates import (
     UnknownTemplate, BadTemplateParameters, ConfigurationError, MinMaxBarTemplate,
     get_class_by_name_mapping, instantiate_one_template, instantiate_templates,
-    render_bar_chart,
+    render_bar_chart, _figure_pool, _render_bar_chart_matplotlib, encode_figure,
 )
+from open_captcha.render_cache import RenderCache
 from tests.paths import data_file
 from tests.fake_template import QuestTemplate
 
@@ -89,6 +92,70 @@ class RenderingMethodsTest(unittest.TestCase):
         self._verify_chart(chart, 'bar-chart')
 
 
+def render_with_fresh_figure(label_value_pairs, options):
+    import matplotlib.figure
+    labels, values = list(zip(*label_value_pairs))
+    fig = matplotlib.figure.Figure(figsize=options.figure_size, dpi=options.dpi)
+    fig.add_subplot(1, 1, 1).bar(labels, values)
+    return encode_figure(fig, options)
+
+
+class FigurePoolTest(unittest.TestCase):
+    PAIR_SETS = [
+        [('USA', 325), ('China', 1435), ('Italy', 60)],
+        [('a', 1)],
+        [('Haifa', 0.5), ('Eilat', 0.25), ('Acre', 2.75), ('Jaffa', 1e6), ('Lod', 0), ('Ramla', 3)],
+        [('USA', -10), ('Spain', 20)],
+        [('x', 0), ('y', 0)],
+        [('China', 7), ('USA', 8)],  # Same labels in a different order
+    ]
+
+    def setUp(self):
+        _figure_pool.figures.clear()
+
+    def test_same_output_as_fresh_figure(self):
+        for options in [RenderingOptions(figure_size=(6, 4)),
+                        RenderingOptions(figure_size=(3, 2), dpi=50),
+                        RenderingOptions(figure_size=(6, 4), image_format='png-palette')]:
+            for _ in range(2):
+                for pairs in self.PAIR_SETS:
+                    self.assertEqual(render_with_fresh_figure(pairs, options),
+                                     _render_bar_chart_matplotlib(pairs, options))
+        self.assertEqual(2, len(_figure_pool.figures))
+
+    def test_reset(self):
+        options = RenderingOptions(figure_size=(6, 4))
+        _render_bar_chart_matplotlib(self.PAIR_SETS[2], options)
+        ((fig, ax),) = _figure_pool.figures.values()
+        self.assertEqual(0, len(ax.patches))
+        self.assertIsNone(ax.xaxis.get_units())  # No categories left from the last chart
+        _render_bar_chart_matplotlib(self.PAIR_SETS[0], options)
+        self.assertIs(fig, next(iter(_figure_pool.figures.values()))[0])
+        # The colour cycle starts over
+        import matplotlib.figure
+        fresh_ax = matplotlib.figure.Figure().add_subplot(1, 1, 1)
+        self.assertEqual(fresh_ax.bar(['a'], [1]).patches[0].get_facecolor(),
+                         ax.bar(['a'], [1]).patches[0].get_facecolor())
+
+    def test_figure_is_dropped_after_error(self):
+        options = RenderingOptions(figure_size=(6, 4), image_format='no-such-format')
+        with self.assertRaises(Exception):
+            _render_bar_chart_matplotlib(self.PAIR_SETS[0], options)
+        self.assertEqual({}, dict(_figure_pool.figures))
+
+    def test_figures_are_per_thread(self):
+        options = RenderingOptions(figure_size=(6, 4))
+        _render_bar_chart_matplotlib(self.PAIR_SETS[0], options)
+        other_thread_figures = []
+        thread = threading.Thread(target=lambda: other_thread_figures.append(
+            (_render_bar_chart_matplotlib(self.PAIR_SETS[0], options), dict(_figure_pool.figures))))
+        thread.start()
+        thread.join()
+        ((_, figures),) = other_thread_figures
+        self.assertEqual(1, len(figures))
+        self.assertIsNot(next(iter(figures.values()))[0], next(iter(_figure_pool.figures.values()))[0])
+
+
 class MinMaxBarTemplateTest(unittest.TestCase):
     def setUp(self):
         super().setUp()
@@ -123,9 +190,30 @@ class MinMaxBarTemplateTest(unittest.TestCase):
                 n=3
             )
 
+    def test_validate(self):
+        def template(**kwargs):
+            params = dict(question='?', table='report_counts', labels='city_name',
+                          values='num_symptoms', variant='max', n=3)
+            params.update(kwargs)
+            return MinMaxBarTemplate(**params)
+
+        self.assertTrue(template().validate(self.data))
+        self.assertTrue(template(n=5).validate(self.data))
+        categorical = {'report_counts': self.data['report_counts'].astype({'city_name': 'category'})}
+        self.assertTrue(template().validate(categorical))
+        for kwargs, error in [(dict(table='nosuch'), 'Table nosuch not found'),
+                              (dict(labels='nosuch'), 'Column nosuch not found'),
+                              (dict(values='nosuch'), 'Column nosuch not found'),
+                              (dict(labels='num_deaths'), 'Labels column num_deaths .* strings'),
+                              (dict(values='city_name'), 'Values column city_name .* numeric'),
+                              (dict(n=6), '5 rows, fewer than n=6')]:
+            with self.assertRaisesRegex(ConfigurationError, error):
+                template(**kwargs).validate(self.data)
+        self.assertFalse(QuestTemplate().validate(self.data))
+
     @unittest.mock.patch('open_captcha.challenge_templates.render_bar_chart')
     def test_max(self, mock_render):
-        mock_options = unittest.mock.Mock()
+        mock_options = unittest.mock.Mock(distortion=0)
         question = 'These {n} cities had the most reported symptoms yesterday. Which city reported the most symptoms?'
         template = MinMaxBarTemplate(
             question=question,
@@ -148,7 +236,7 @@ class MinMaxBarTemplateTest(unittest.TestCase):
 
     @unittest.mock.patch('open_captcha.challenge_templates.render_bar_chart')
     def test_min(self, mock_render):
-        mock_options = unittest.mock.Mock()
+        mock_options = unittest.mock.Mock(distortion=0)
         question = 'These {n} cities had the least reported symptoms yesterday. Which city reported the least symptoms?'
         template = MinMaxBarTemplate(
             question=question,
@@ -169,6 +257,56 @@ class MinMaxBarTemplateTest(unittest.TestCase):
         actual_pairs = {(name, value) for name, value in mock_render.call_args_list[0][0][0]}
         self.assertEqual(actual_pairs, expected_pairs)
 
+    @unittest.mock.patch('open_captcha.challenge_templates.render_bar_chart')
+    def test_selection_is_precomputed(self, mock_render):
+        template = MinMaxBarTemplate(
+            question='Which?',
+            table='report_counts',
+            labels='city_name',
+            values='num_symptoms',
+            variant='max',
+            n=3
+        )
+        with unittest.mock.patch.object(MinMaxBarTemplate, 'select', wraps=template.select) as mock_select:
+            template.prepare(self.data)
+            for _ in range(5):
+                _, correct_answer = template.generate_challenge(self.data, self.rng)
+                self.assertEqual(correct_answer, 'New York')
+            mock_select.assert_called_once_with(self.data['report_counts'])
+
+            # A new table object is selected from again.
+            new_data = {'report_counts': self.data['report_counts'].iloc[1:]}
+            for _ in range(5):
+                challenge, correct_answer = template.generate_challenge(new_data, self.rng)
+                self.assertEqual(correct_answer, 'Los Angeles')
+                self.assertEqual(set(challenge.possible_answers), {'Los Angeles', 'Boston', 'West Yellowstone'})
+            self.assertEqual(mock_select.call_count, 2)
+
+    @unittest.mock.patch('open_captcha.challenge_templates.render_bar_chart')
+    def test_render_cache(self, mock_render):
+        mock_render.side_effect = lambda pairs, options: repr([(name, int(value)) for name, value in pairs]).encode()
+        template = MinMaxBarTemplate(
+            question='Which?',
+            table='report_counts',
+            labels='city_name',
+            values='num_symptoms',
+            variant='max',
+            n=2
+        )
+        template.render_cache = RenderCache()
+        options = RenderingOptions(figure_size=(6, 4))
+        for _ in range(20):
+            challenge, _ = template.generate_challenge(self.data, self.rng, options)
+            self.assertEqual(challenge.chart, repr([
+                (name, {'New York': 9666, 'Los Angeles': 5000}[name]) for name in challenge.possible_answers
+            ]).encode())
+        # Only 2 possible orders of the 2 rows
+        self.assertEqual(mock_render.call_count, 2)
+        self.assertEqual(template.render_cache.stats.hits, 18)
+        self.assertEqual(template.referenced_tables(), ['report_counts'])
+        # The cache is not sent along when pickling templates.
+        self.assertIsNone(pickle.loads(pickle.dumps(template)).render_cache)
+
 
 if __name__ == '__main__':
     unittest.main()
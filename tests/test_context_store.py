@@ -0,0 +1,137 @@
+import threading
+import unittest
+from open_captcha.common_types import ConfigurationError, ServerContext
+from open_captcha.context_store import InMemoryContextStore, RedisContextStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Implements the subset of the redis-py client used by RedisContextStore."""
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self, transaction)
+
+
+class FakePipeline:
+    def __init__(self, redis, transaction):
+        self.redis = redis
+        self.transaction = transaction
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append(('set', key, value, ex))
+
+    def get(self, key):
+        self.commands.append(('get', key))
+
+    def delete(self, key):
+        self.commands.append(('delete', key))
+
+    def execute(self):
+        self.redis.executed.append((self.transaction, list(self.commands)))
+        results = []
+        for command, key, *args in self.commands:
+            if command == 'set':
+                self.redis.values[key] = args[0].encode()
+                self.redis.expiry[key] = args[1]
+                results.append(True)
+            elif command == 'get':
+                results.append(self.redis.values.get(key))
+            else:
+                results.append(int(self.redis.values.pop(key, None) is not None))
+        return results
+
+
+def make_context(i):
+    return ServerContext(timestamp=i, verification_attempt_number=1, correct_answer=f'answer {i}')
+
+
+class InMemoryContextStoreTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        self.store = InMemoryContextStore(num_shards=4, max_entries=100, clock=self.clock)
+
+    def test_put_and_take(self):
+        self.store.put('a', make_context(1), ttl_sec=10)
+        self.assertEqual(self.store.take('a'), make_context(1))
+        self.assertIsNone(self.store.take('a'))  # Only once
+        self.assertIsNone(self.store.take('nosuch'))
+
+    def test_bulk(self):
+        contexts = {f'id{i}': make_context(i) for i in range(20)}
+        self.store.put_many(contexts, ttl_sec=10)
+        self.assertEqual(len(self.store), 20)
+        ids = ['id3', 'nosuch', 'id7', 'id3']
+        self.assertEqual(self.store.take_many(ids), [make_context(3), None, make_context(7), None])
+        self.assertEqual(len(self.store), 18)
+
+    def test_expiry(self):
+        self.store.put('a', make_context(1), ttl_sec=10)
+        self.store.put('b', make_context(2), ttl_sec=20)
+        self.clock.now += 15
+        self.store.evict_expired()
+        self.assertEqual(len(self.store), 1)
+        self.store.put('c', make_context(3), ttl_sec=1)
+        self.clock.now += 1
+        self.assertIsNone(self.store.take('c'))  # Expired even before eviction
+        self.assertEqual(self.store.take('b'), make_context(2))
+
+    def test_bounded_size(self):
+        for i in range(500):
+            self.store.put(f'id{i}', make_context(i), ttl_sec=i)
+        self.assertLessEqual(len(self.store), 100)
+        # The contexts closest to expiry are dropped first
+        self.assertIsNone(self.store.take('id0'))
+        self.assertEqual(self.store.take('id499'), make_context(499))
+
+    def test_take_once_concurrently(self):
+        contexts = {f'id{i}': make_context(i) for i in range(100)}
+        self.store = InMemoryContextStore(num_shards=4)
+        self.store.put_many(contexts, ttl_sec=60)
+        taken = []
+
+        def take_all():
+            taken.extend(c for c in self.store.take_many(list(contexts)) if c is not None)
+
+        threads = [threading.Thread(target=take_all) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(c.timestamp for c in taken), list(range(100)))
+
+    def test_bad_config(self):
+        with self.assertRaisesRegex(ConfigurationError, 'shard'):
+            InMemoryContextStore(num_shards=0)
+        with self.assertRaisesRegex(ConfigurationError, 'shard'):
+            InMemoryContextStore(num_shards=8, max_entries=4)
+
+
+class RedisContextStoreTest(unittest.TestCase):
+    def test_put_and_take(self):
+        redis = FakeRedis()
+        store = RedisContextStore(redis, key_prefix='test:')
+        store.put_many({'a': make_context(1), 'b': make_context(2)}, ttl_sec=180)
+        self.assertEqual(redis.expiry, {'test:a': 180, 'test:b': 180})
+        self.assertEqual(store.take_many(['b', 'nosuch', 'a']), [make_context(2), None, make_context(1)])
+        self.assertIsNone(store.take('a'))
+        self.assertEqual(store.take_many([]), [])
+        # One round trip per bulk call, takes are transactional
+        self.assertEqual([transaction for transaction, _ in redis.executed], [False, True, True])
+        self.assertEqual(len(redis.executed[1][1]), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import dataclasses
+import unittest
+
+import numpy as np
+
+from open_captcha.common_types import ConfigurationError, RenderingOptions
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.challenge_templates import render_bar_chart, seed_distortion
+from open_captcha.distortion import distort, distort_image
+from open_captcha.image_encoding import validate_options
+from open_captcha.render_cache import RenderCache
+from tests.fake_data import min_max_bar_config, report_counts
+
+
+def chart_image(channels):
+    image = np.full((60, 80, channels), 255, dtype=np.uint8)
+    image[20:50, 10:30, :3] = (31, 119, 180)
+    image[50:52, 5:75, :3] = 0
+    return image
+
+
+class DistortTest(unittest.TestCase):
+    def test_shape_and_alpha(self):
+        for channels in (3, 4):
+            image = chart_image(channels)
+            original = image.copy()
+            distorted = distort(image, 1, np.random.RandomState(0))
+            self.assertEqual(image.shape, distorted.shape)
+            self.assertEqual(np.uint8, distorted.dtype)
+            np.testing.assert_array_equal(original, image)  # Input left as is
+            if channels == 4:
+                self.assertTrue((distorted[:, :, 3] == 255).all())
+
+    def test_strength(self):
+        image = chart_image(3)
+
+        def difference(strength):
+            distorted = distort(image, strength, np.random.RandomState(0))
+            return np.abs(distorted.astype(int) - image).mean()
+
+        self.assertLess(difference(0.2), difference(1))
+        self.assertEqual(0, difference(0))
+
+    def test_seeds(self):
+        image = chart_image(4)
+        options = RenderingOptions(figure_size=(1, 1), distortion=0.5, distortion_seed=1)
+        np.testing.assert_array_equal(distort_image(image, options), distort_image(image, options))
+        other_seed = dataclasses.replace(options, distortion_seed=2)
+        self.assertFalse(np.array_equal(distort_image(image, options),
+                                        distort_image(image, other_seed)))
+        self.assertIs(image, distort_image(image, RenderingOptions(figure_size=(1, 1))))
+
+    def test_validation(self):
+        for distortion in (-0.1, 1.5):
+            with self.assertRaisesRegex(ConfigurationError, 'distortion'):
+                validate_options(RenderingOptions(figure_size=(1, 1), distortion=distortion))
+
+
+class DistortedRenderingTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.label_value_pairs = [('USA', 325), ('China', 1435), ('Italy', 60)]
+        self.data = {'report_counts': report_counts(num_rows=3)}
+        self.template_configs = [min_max_bar_config()]
+
+    def test_backends(self):
+        for backend in ('matplotlib', 'raster'):
+            clean = RenderingOptions(figure_size=(3, 2), backend=backend)
+            distorted = dataclasses.replace(clean, distortion=1, distortion_seed=0)
+            chart = render_bar_chart(self.label_value_pairs, distorted)
+            self.assertTrue(chart.startswith(b'\x89PNG'))
+            self.assertNotEqual(render_bar_chart(self.label_value_pairs, clean), chart)
+            self.assertEqual(chart, render_bar_chart(self.label_value_pairs, distorted))
+            self.assertNotEqual(chart, render_bar_chart(
+                self.label_value_pairs, dataclasses.replace(distorted, distortion_seed=1)))
+
+    def test_pooled_figure_is_not_modified(self):
+        clean = RenderingOptions(figure_size=(3, 2), image_format='png-palette')
+        before = render_bar_chart(self.label_value_pairs, clean)
+        render_bar_chart(self.label_value_pairs, dataclasses.replace(clean, distortion=1))
+        self.assertEqual(before, render_bar_chart(self.label_value_pairs, clean))
+
+    def test_seed_distortion(self):
+        rng = np.random.RandomState(0)
+        clean = RenderingOptions(figure_size=(3, 2))
+        self.assertIs(clean, seed_distortion(clean, rng))
+        self.assertIsNone(seed_distortion(None, rng))
+        seeded = seed_distortion(dataclasses.replace(clean, distortion=0.5), rng)
+        self.assertEqual(np.random.RandomState(0).randint(2 ** 31), seeded.distortion_seed)
+
+    def test_generator(self):
+        options = RenderingOptions(figure_size=(3, 2), backend='raster', distortion=0.5)
+        charts = []
+        for _ in range(2):
+            cache = RenderCache()
+            captcha = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180,
+                                       rng_seed=0, render_cache=cache)
+            charts.append([captcha.generate_challenge(rendering_options=options)[1].chart
+                           for _ in range(10)])
+            self.assertEqual(0, cache.stats.entries)  # Distorted charts aren't cached
+        self.assertEqual(charts[0], charts[1])  # Reproducible with rng_seed
+        self.assertEqual(10, len(set(charts[0])))  # Even for the same bar order
+
+
+if __name__ == '__main__':
+    unittest.main()
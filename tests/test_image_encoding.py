@@ -0,0 +1,101 @@
+import io
+import unittest
+import unittest.mock
+import numpy as np
+from PIL import Image
+from open_captcha.common_types import Challenge, ConfigurationError, RenderingOptions
+from open_captcha.challenge_templates import render_bar_chart
+from open_captcha.image_encoding import (
+    encode_image, encode_png, encode_png_palette, image_format_of, quantize, webp_supported,
+)
+
+
+def open_image(image_bytes):
+    return Image.open(io.BytesIO(image_bytes))
+
+
+class EncodingTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rng = np.random.RandomState(0)
+
+    def test_encode_png(self):
+        for channels in (3, 4):
+            image = self.rng.randint(0, 256, size=(7, 5, channels)).astype(np.uint8)
+            np.testing.assert_array_equal(np.asarray(open_image(encode_png(image))), image)
+            np.testing.assert_array_equal(np.asarray(open_image(encode_png(image, compress_level=1))), image)
+
+    def test_encode_png_palette(self):
+        palette = np.array([[255, 255, 255], [31, 119, 180], [0, 0, 0]], dtype=np.uint8)
+        indices = self.rng.randint(0, 3, size=(6, 9)).astype(np.uint8)
+        decoded = open_image(encode_png_palette(indices, palette))
+        self.assertEqual(decoded.mode, 'P')
+        np.testing.assert_array_equal(np.asarray(decoded.convert('RGB')), palette[indices])
+
+        rgba_palette = np.array([[255, 255, 255, 0], [1, 2, 3, 255]], dtype=np.uint8)
+        indices = self.rng.randint(0, 2, size=(4, 4)).astype(np.uint8)
+        decoded = open_image(encode_png_palette(indices, rgba_palette))
+        np.testing.assert_array_equal(np.asarray(decoded.convert('RGBA')), rgba_palette[indices])
+
+    def test_quantize(self):
+        colors = np.array([[255, 255, 255], [31, 119, 180], [0, 0, 0]], dtype=np.uint8)
+        image = colors[self.rng.randint(0, 3, size=(10, 10))]
+        indices, palette = quantize(image, 16)
+        self.assertLessEqual(len(palette), 16)
+        np.testing.assert_array_equal(palette[indices], image)
+
+    def test_encode_image(self):
+        image = np.full((10, 10, 4), 255, dtype=np.uint8)
+        png = encode_image(image, RenderingOptions(figure_size=(1, 1)))
+        self.assertEqual(open_image(png).mode, 'RGB')  # Opaque alpha channel is dropped
+        png = encode_image(image, RenderingOptions(figure_size=(1, 1), image_format='png-palette'))
+        self.assertEqual(open_image(png).mode, 'P')
+        webp = encode_image(image, RenderingOptions(figure_size=(1, 1), image_format='webp'))
+        self.assertEqual(image_format_of(webp), 'webp' if webp_supported() else 'png')
+        with unittest.mock.patch('open_captcha.image_encoding.webp_supported', return_value=False):
+            webp = encode_image(image, RenderingOptions(figure_size=(1, 1), image_format='webp'))
+            self.assertEqual(image_format_of(webp), 'png')
+
+    def test_bad_options(self):
+        image = np.zeros((2, 2, 3), dtype=np.uint8)
+        with self.assertRaisesRegex(ConfigurationError, 'image_format'):
+            encode_image(image, RenderingOptions(figure_size=(1, 1), image_format='gif'))
+        with self.assertRaisesRegex(ConfigurationError, 'palette_colors'):
+            encode_image(image, RenderingOptions(figure_size=(1, 1), palette_colors=1000))
+
+    def test_image_format_of(self):
+        self.assertEqual(image_format_of(encode_png(np.zeros((1, 1, 3), dtype=np.uint8))), 'png')
+        self.assertEqual(image_format_of(b'RIFF\x00\x00\x00\x00WEBPVP8L'), 'webp')
+        self.assertIsNone(image_format_of(b'blerg'))
+        self.assertIsNone(Challenge('q', b'blerg', []).image_format)
+
+
+class ChartFormatsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.label_value_pairs = [('USA', 325), ('China', 1435), ('Italy', 60)]
+
+    def test_formats(self):
+        for backend in ('matplotlib', 'raster'):
+            default = render_bar_chart(
+                self.label_value_pairs, RenderingOptions(figure_size=(6, 4), backend=backend))
+            palette = render_bar_chart(
+                self.label_value_pairs, RenderingOptions(figure_size=(6, 4), backend=backend,
+                                                         image_format='png-palette', compress_level=9))
+            self.assertEqual(open_image(palette).mode, 'P')
+            self.assertEqual(open_image(palette).size, (600, 400))
+            self.assertLess(len(palette) * 3, len(default))
+
+            small = render_bar_chart(
+                self.label_value_pairs, RenderingOptions(figure_size=(6, 4), backend=backend, dpi=50))
+            self.assertEqual(open_image(small).size, (300, 200))
+
+    def test_matplotlib_compress_level(self):
+        options = RenderingOptions(figure_size=(6, 4), compress_level=9)
+        chart = render_bar_chart(self.label_value_pairs, options)
+        self.assertEqual(open_image(chart).size, (600, 400))
+        self.assertEqual(image_format_of(chart), 'png')
+
+
+if __name__ == '__main__':
+    unittest.main()
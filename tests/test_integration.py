@@ -5,6 +5,9 @@ import textwrap
 from open_captcha.common_types import ServerContext, RenderingOptions
 from open_captcha.captcha_generator import CaptchaGenerator
 from open_captcha.challenge_templates import render_bar_chart
+from open_captcha.render_cache import RenderCache
+from open_captcha.tokens import TokenSigner
+from open_captcha.verification import normalize_answer
 
 
 class IntegrationTest(unittest.TestCase):
@@ -74,6 +77,40 @@ class IntegrationTest(unittest.TestCase):
         self.assertEqual(len(all_challenge_ids), 10)
         self.assertEqual(all_variants, {'symptoms', 'deaths'})
 
+    def test_generate_challenges_in_parallel(self):
+        results = list(self.captcha.generate_challenges(12, workers=2))
+        self.assertEqual(len(results), 12)
+        self.assertEqual(len({challenge_id for challenge_id, _, _ in results}), 12)
+        for _, challenge, context in results:
+            self.assertIn(context.correct_answer, map(normalize_answer, challenge.possible_answers))
+            self.assertTrue(challenge.chart.startswith(b'\x89PNG'))
+            self.assertTrue(self.captcha.verify_response(context.correct_answer, context))
+
+    def test_generate_challenges_with_shared_executor(self):
+        with self.captcha.create_process_pool(workers=2) as executor:
+            for _ in range(2):
+                results = list(self.captcha.generate_challenges(3, executor=executor))
+                self.assertEqual(len(results), 3)
+        self.assertEqual(list(self.captcha.generate_challenges(0, workers=1)), [])
+
+    def test_generate_challenges_reproducible(self):
+        def render(workers):
+            captcha = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180, rng_seed=0)
+            results = captcha.generate_challenges(8, RenderingOptions(figure_size=(3, 2), backend='raster'),
+                                                  workers=workers)
+            return sorted((challenge.chart, context.correct_answer) for _, challenge, context in results)
+
+        expected = render(workers=2)
+        self.assertEqual(expected, render(workers=2))
+        self.assertGreater(len(set(expected)), 1)
+
+    def test_answer_normalization(self):
+        _, challenge, context = self.captcha.generate_challenge()
+        correct_answer = 'New York' if 'symptoms' in challenge.question else 'Boston'
+        self.assertEqual(context.correct_answer, correct_answer.lower())
+        self.assertTrue(self.captcha.verify_response(f'  {correct_answer.upper()}\t', context))
+        self.assertFalse(self.captcha.verify_response(correct_answer * 1000, context))
+
     def test_full_flow_with_image(self):
         template_configs = self.template_configs[:1]  # Ensure we use the symptoms challenge.
         captcha = CaptchaGenerator(self.data, template_configs, response_timeout_sec=180, rng_seed=0)
@@ -81,8 +118,8 @@ class IntegrationTest(unittest.TestCase):
         _, challenge, _ = captcha.generate_challenge(rendering_options=options)
         expected_chart = render_bar_chart([
             ('Boston', 800),
-            ('New York', 9666),
-            ('Los Angeles', 5000)
+            ('Los Angeles', 5000),
+            ('New York', 9666)
         ], options=options)
         if challenge.chart != expected_chart:
             # Save expected vs actual image for manual inspection / debugging.
@@ -90,6 +127,46 @@ class IntegrationTest(unittest.TestCase):
             self._save_image(challenge.chart, 'actual-chart')
         self.assertEqual(challenge.chart, expected_chart)
 
+    def test_stateless_token_flow(self):
+        signer = TokenSigner({'2026-10': TokenSigner.generate_key()}, current_key_id='2026-10')
+        captcha = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180,
+                                   token_signer=signer)
+        for _ in range(5):
+            token, challenge = captcha.generate_challenge_token()
+            self.assertTrue(challenge.chart.startswith(b'\x89PNG'))
+            correct_answer = 'New York' if 'symptoms' in challenge.question else 'Boston'
+            self.assertTrue(captcha.verify_token(correct_answer, token))
+            self.assertFalse(captcha.verify_token(correct_answer, token))
+
+    def test_update_tables(self):
+        cache = RenderCache()
+        captcha = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180,
+                                   render_cache=cache)
+        new_rows = [dict(row, num_symptoms=row['num_deaths']) for row in self.data['report_counts']]
+        captcha.update_tables({'report_counts': new_rows})
+        self.assertEqual(cache.stats.entries, 0)
+        for _ in range(10):
+            _, challenge, context = captcha.generate_challenge()
+            self.assertEqual(context.correct_answer, 'boston')
+            if 'symptoms' in challenge.question:
+                self.assertEqual(set(challenge.possible_answers), {'New York', 'Boston', 'Los Angeles'})
+
+    def test_render_cache(self):
+        cache = RenderCache()
+        captcha = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180,
+                                   render_cache=cache)
+        options = RenderingOptions(figure_size=(4, 3))
+        for _ in range(30):
+            _, challenge, context = captcha.generate_challenge(rendering_options=options)
+        # 3! + 4! distinct charts at most
+        self.assertLessEqual(cache.stats.misses, 6 + 24)
+        self.assertGreater(cache.stats.hits, 0)
+        values = {'New York': 9666, 'Los Angeles': 5000, 'Boston': 800}
+        if len(challenge.possible_answers) == 3:
+            expected_chart = render_bar_chart(
+                [(name, values[name]) for name in challenge.possible_answers], options=options)
+            self.assertEqual(challenge.chart, expected_chart)
+
 
 if __name__ == '__main__':
     unittest.main()
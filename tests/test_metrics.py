@@ -0,0 +1,149 @@
+import unittest
+from unittest import mock
+
+from open_captcha import metrics
+from open_captcha.common_types import Challenge, RenderingOptions, ServerContext
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.metrics import CaptchaMetrics, Histogram
+from open_captcha.sampling import TemplateSampler
+from open_captcha.tokens import TokenSigner
+from open_captcha.verification import _get_timestamp
+from tests.fake_data import min_max_bar_config, report_counts
+
+
+class HistogramTest(unittest.TestCase):
+    def test_observe(self):
+        h = Histogram([1, 10])
+        for value in [0.5, 1, 5, 100]:
+            h.observe(value)
+        self.assertEqual([2, 1, 1], h.counts)
+        self.assertEqual(4, h.count)
+        self.assertEqual(106.5, h.sum)
+
+
+class PhasesTest(unittest.TestCase):
+    def test_not_measuring(self):
+        self.assertFalse(metrics.is_measuring())
+        with metrics.phase(metrics.RENDER):
+            pass
+        metrics.record_phase(metrics.RENDER, 1.0)  # Ignored
+
+    def test_measure_challenge(self):
+        collected = CaptchaMetrics()
+
+        def generate():
+            self.assertTrue(metrics.is_measuring())
+            with metrics.phase(metrics.SELECTION):
+                pass
+            metrics.record_phase(metrics.RENDER, 0.2)
+            metrics.record_phase(metrics.RENDER, 0.3)
+            return Challenge('Q', b'12345', ['a']), 'a'
+
+        collected.measure_challenge(('0', 'test'), generate)
+        self.assertFalse(metrics.is_measuring())
+        template_metrics = collected.templates()[('0', 'test')]
+        self.assertEqual(1, template_metrics.challenges.count)
+        self.assertEqual(1, template_metrics.phases[metrics.SELECTION].count)
+        self.assertEqual(0.5, template_metrics.phases[metrics.RENDER].sum)
+        self.assertEqual(0, template_metrics.phases[metrics.ENCODE].count)
+        self.assertEqual(5, template_metrics.image_bytes.sum)
+
+    def test_measure_challenge_error(self):
+        collected = CaptchaMetrics()
+        with self.assertRaises(ValueError):
+            collected.measure_challenge(('0', 'test'), mock.Mock(side_effect=ValueError))
+        self.assertFalse(metrics.is_measuring())
+        template_metrics = collected.templates()[('0', 'test')]
+        self.assertEqual(1, template_metrics.errors)
+        self.assertEqual(0, template_metrics.challenges.count)
+
+
+class GeneratorMetricsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = {'report_counts': report_counts()}
+        self.template_configs = [
+            min_max_bar_config(),
+            min_max_bar_config(question='Least deaths?', values='num_deaths', variant='min'),
+        ]
+        self.metrics = CaptchaMetrics()
+        self.captcha = CaptchaGenerator(self.data, self.template_configs, response_timeout_sec=180,
+                                        rng_seed=0, metrics=self.metrics)
+
+    def _check_phases(self, num_challenges):
+        templates = self.metrics.templates()
+        self.assertEqual({('0', 'min-max-bar'), ('1', 'min-max-bar')}, set(templates))
+        self.assertEqual(num_challenges,
+                         sum(m.challenges.count for m in templates.values()))
+        for m in templates.values():
+            for phase_name in metrics.PHASES:
+                self.assertEqual(m.challenges.count, m.phases[phase_name].count)
+                self.assertGreater(m.phases[phase_name].sum, 0)
+            # The phases are measured within the total
+            self.assertLessEqual(sum(h.sum for h in m.phases.values()), m.challenges.sum)
+            self.assertGreater(m.image_bytes.sum, 0)
+
+    def test_generation_phases(self):
+        for _ in range(10):
+            self.captcha.generate_challenge()
+        self._check_phases(10)
+
+    def test_generation_phases_raster(self):
+        options = RenderingOptions(figure_size=(4, 3), backend='raster')
+        for _ in range(10):
+            self.captcha.generate_challenge(rendering_options=options)
+        self._check_phases(10)
+
+    def test_generation_phases_palette(self):
+        options = RenderingOptions(figure_size=(4, 3), image_format='png-palette')
+        # Both templates, whatever the seeded stream picks
+        with mock.patch.object(TemplateSampler, 'sample', side_effect=[0, 1, 0, 1]):
+            for _ in range(4):
+                self.captcha.generate_challenge(rendering_options=options)
+        self._check_phases(4)
+
+    def test_verification_outcomes(self):
+        _, _, context = self.captcha.generate_challenge()
+        self.captcha.verify_response(context.correct_answer, context)
+        self.captcha.verify_response('wrong', context)
+        expired = ServerContext(_get_timestamp() - 1000, 1, context.correct_answer)
+        self.captcha.verify_response(context.correct_answer, expired)
+        self.captcha.verify_responses([(context.correct_answer, context), ('x', expired)])
+        self.assertEqual({'ok': 2, 'wrong_answer': 1, 'timeout': 2},
+                         self.metrics.verifications())
+
+    def test_token_outcomes(self):
+        self.captcha.token_signer = TokenSigner({'k': TokenSigner.generate_key()}, 'k')
+        self.captcha.replay_filter = mock.Mock(**{'check_and_add.return_value': False})
+        token, _ = self.captcha.generate_challenge_token()
+        self.captcha.verify_token('x', 'garbage')
+        self.captcha.verify_token('x', token)
+        self.assertEqual({'invalid_token': 1, 'replayed_token': 1},
+                         self.metrics.verifications())
+
+    def test_prometheus_export(self):
+        self.captcha.generate_challenge()
+        self.metrics.record_verification('ok')
+        text = self.metrics.to_prometheus()
+        self.assertIn('# TYPE open_captcha_challenge_seconds histogram\n', text)
+        self.assertIn('open_captcha_challenge_seconds_count{template=', text)
+        self.assertIn('open_captcha_challenge_phase_seconds_bucket{template=', text)
+        self.assertIn(',phase="render",le="+Inf"}', text)
+        self.assertIn('open_captcha_verifications_total{outcome="ok"} 1\n', text)
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                name_and_labels, value = line.rsplit(' ', 1)
+                float(value)
+                self.assertTrue(name_and_labels.startswith('open_captcha_'))
+
+    def test_prometheus_cumulative_buckets(self):
+        collected = CaptchaMetrics(latency_buckets=[1, 2], size_buckets=[10])
+        collected.measure_challenge(('0', 'a"b'), lambda: (Challenge('Q', b'x' * 20, []), 'a'))
+        text = collected.to_prometheus()
+        self.assertIn('open_captcha_challenge_image_bytes_bucket{template="0",type="a\\"b",le="10.0"} 0\n', text)
+        self.assertIn('open_captcha_challenge_image_bytes_bucket{template="0",type="a\\"b",le="+Inf"} 1\n', text)
+        self.assertIn('open_captcha_challenge_image_bytes_count{template="0",type="a\\"b"} 1\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
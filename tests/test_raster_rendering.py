@@ -0,0 +1,79 @@
+import io
+import unittest
+import numpy as np
+from PIL import Image
+from open_captcha.common_types import ConfigurationError, RenderingOptions
+from open_captcha.challenge_templates import render_bar_chart, register_rendering_backend, _bar_chart_backends
+from open_captcha.raster_rendering import (
+    BAR_COLOR, format_tick, nice_ticks, rasterize_text, render_bar_chart_rgb,
+)
+
+
+def decode_png(png_bytes):
+    return np.asarray(Image.open(io.BytesIO(png_bytes)))
+
+
+class RasterRenderingTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rendering_options = RenderingOptions(figure_size=(6, 4), backend='raster')
+        self.label_value_pairs = [('USA', 325), ('China', 1435), ('Italy', 60)]
+
+    def test_nice_ticks(self):
+        self.assertEqual(nice_ticks(0, 1506.75), [0, 200, 400, 600, 800, 1000, 1200, 1400])
+        self.assertEqual(nice_ticks(0, 10), [0, 2, 4, 6, 8, 10])
+        self.assertEqual(nice_ticks(-1.05, 0), [-1.0, -0.8, -0.6, -0.4, -0.2, 0])
+        self.assertEqual(nice_ticks(3, 3), [3])
+
+    def test_format_tick(self):
+        self.assertEqual(format_tick(400.0, 200.0), '400')
+        self.assertEqual(format_tick(0.75, 0.25), '0.75')
+
+    def test_rasterize_text(self):
+        mask = rasterize_text('New York')
+        self.assertEqual(mask.dtype, np.uint8)
+        self.assertGreater(mask.shape[1], mask.shape[0])
+        self.assertEqual(mask.max(), 255)
+        self.assertIs(rasterize_text('New York'), mask)  # cached
+
+    def test_render_bar_chart(self):
+        chart = render_bar_chart(self.label_value_pairs, self.rendering_options)
+        image = decode_png(chart)
+        self.assertEqual(image.shape, (400, 600, 3))
+        np.testing.assert_array_equal(image, render_bar_chart_rgb(self.label_value_pairs, self.rendering_options))
+
+        # Bar heights are proportional to the values
+        is_bar = (image == BAR_COLOR).all(axis=2)
+        bar_columns = np.flatnonzero(is_bar.any(axis=0))
+        bar_starts = np.concatenate([[bar_columns[0]], bar_columns[1:][np.diff(bar_columns) > 1]])
+        self.assertEqual(len(bar_starts), 3)
+        heights = [is_bar[:, x + 5].sum() for x in bar_starts]
+        for (_, value), height in zip(self.label_value_pairs, heights):
+            self.assertAlmostEqual(height / heights[1], value / 1435, delta=0.01)
+
+        # There is some text below the bars
+        self.assertTrue((image[-40:] < 128).any())
+
+    def test_negative_and_zero_values(self):
+        image = render_bar_chart_rgb([('a', -5), ('b', 0), ('c', 3)], self.rendering_options)
+        self.assertEqual(image.shape, (400, 600, 3))
+        image = render_bar_chart_rgb([('a', 0), ('b', 0)], self.rendering_options)
+        self.assertFalse((image == BAR_COLOR).all(axis=2).any())
+
+
+class RenderingBackendsTest(unittest.TestCase):
+    def test_unknown_backend(self):
+        with self.assertRaisesRegex(ConfigurationError, 'Unknown rendering backend nosuch'):
+            render_bar_chart([('a', 1)], RenderingOptions(figure_size=(1, 1), backend='nosuch'))
+
+    def test_register_backend(self):
+        register_rendering_backend('fake', lambda pairs, options: b'fake chart')
+        try:
+            chart = render_bar_chart([('a', 1)], RenderingOptions(figure_size=(1, 1), backend='fake'))
+            self.assertEqual(chart, b'fake chart')
+        finally:
+            del _bar_chart_backends['fake']
+
+
+if __name__ == '__main__':
+    unittest.main()
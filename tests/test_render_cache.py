@@ -0,0 +1,67 @@
+import unittest
+import unittest.mock
+from open_captcha.common_types import ConfigurationError, RenderingOptions
+from open_captcha.render_cache import RenderCache, _ENTRY_OVERHEAD_BYTES
+
+
+class RenderCacheTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.pairs = [('USA', 325), ('China', 1435), ('Italy', 60)]
+        self.options = RenderingOptions(figure_size=(6, 4))
+
+    def test_make_key(self):
+        key = RenderCache.make_key('t1', self.pairs, self.options)
+        self.assertEqual(key, RenderCache.make_key('t1', list(self.pairs), RenderingOptions(figure_size=(6, 4))))
+        self.assertEqual(RenderCache.make_key('t1', self.pairs), RenderCache.make_key(
+            't1', self.pairs, RenderingOptions.default_options()))
+        self.assertNotEqual(key, RenderCache.make_key('t2', self.pairs, self.options))
+        self.assertNotEqual(key, RenderCache.make_key('t1', self.pairs[::-1], self.options))
+        self.assertNotEqual(key, RenderCache.make_key('t1', self.pairs, RenderingOptions(figure_size=(4, 3))))
+
+    def test_bad_budget(self):
+        with self.assertRaisesRegex(ConfigurationError, 'max_bytes'):
+            RenderCache(max_bytes=0)
+
+    def test_get_or_render(self):
+        cache = RenderCache()
+        render = unittest.mock.Mock(return_value=b'chart')
+        self.assertEqual(cache.get_or_render('k', render), b'chart')
+        self.assertEqual(cache.get_or_render('k', render), b'chart')
+        render.assert_called_once_with()
+        stats = cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.entries), (1, 1, 1))
+        self.assertEqual(stats.size_bytes, 5 + _ENTRY_OVERHEAD_BYTES)
+
+    def test_lru_eviction(self):
+        cache = RenderCache(max_bytes=3 * (10 + _ENTRY_OVERHEAD_BYTES))
+        for key in 'abc':
+            cache.put(key, b'x' * 10)
+        cache.get('a')  # 'b' is now the least recently used
+        cache.put('d', b'x' * 10)
+        self.assertIsNone(cache.get('b'))
+        for key in 'acd':
+            self.assertIsNotNone(cache.get(key))
+        self.assertEqual(cache.stats.evictions, 1)
+        # Entries larger than the whole budget are not cached at all.
+        cache.put('huge', b'x' * cache.max_bytes)
+        self.assertIsNone(cache.get('huge'))
+        self.assertEqual(cache.stats.entries, 3)
+
+    def test_invalidate_tables(self):
+        cache = RenderCache()
+        cache.put('a', b'1', tables=['t1'])
+        cache.put('b', b'2', tables=['t2'])
+        cache.put('c', b'3', tables=None)
+        cache.invalidate_tables(['t1'])
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), b'2')
+        self.assertIsNone(cache.get('c'))  # Unknown dependencies are always invalidated
+        self.assertEqual(cache.stats.size_bytes, 1 + _ENTRY_OVERHEAD_BYTES)
+        cache.clear()
+        self.assertEqual(cache.stats.entries, 0)
+        self.assertEqual(cache.stats.size_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
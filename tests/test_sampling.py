@@ -0,0 +1,128 @@
+import pickle
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from open_captcha.common_types import ConfigurationError
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.sampling import TemplateSampler, parse_sampling_options
+from tests.fake_data import min_max_bar_config, report_counts
+
+
+def config(values, variant, sampling_options=None):
+    result = min_max_bar_config(question='?', values=values, variant=variant)
+    if sampling_options is not None:
+        result.append(sampling_options)
+    return result
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TemplateSamplerTest(unittest.TestCase):
+    def _implied_probabilities(self, sampler):
+        n = len(sampler)
+        result = np.array(sampler._probability) / n
+        for i, alias in enumerate(sampler._alias):
+            result[alias] += (1 - sampler._probability[i]) / n
+        return result
+
+    def test_alias_table(self):
+        for weights in ([1], [1, 1], [1, 2, 3], [0, 5, 0, 1], [0.1, 100, 7, 7, 3e-6]):
+            sampler = TemplateSampler(weights)
+            np.testing.assert_allclose(self._implied_probabilities(sampler),
+                                       np.array(weights) / sum(weights), atol=1e-12)
+
+    def test_sample_distribution(self):
+        sampler = TemplateSampler([1, 0, 3])
+        rng = np.random.RandomState(0)
+        counts = np.bincount([sampler.sample(rng) for _ in range(4000)], minlength=3)
+        self.assertEqual(0, counts[1])
+        self.assertAlmostEqual(0.75, counts[2] / 4000, delta=0.03)
+
+    def test_single_template_uses_no_random_numbers(self):
+        rng = mock.Mock()
+        self.assertEqual(0, TemplateSampler([5]).sample(rng))
+        rng.random.assert_not_called()
+
+    def test_rate_caps(self):
+        clock = FakeClock()
+        # Template 0 would be picked every time, but is capped at 2 per second
+        sampler = TemplateSampler([1000, 1e-9], max_rates=[2, None], clock=clock)
+        rng = np.random.RandomState(0)
+        self.assertEqual([0, 0, 1, 1], [sampler.sample(rng) for _ in range(4)])
+        clock.now += 0.5
+        self.assertEqual([0, 1], [sampler.sample(rng) for _ in range(2)])
+
+    def test_all_capped(self):
+        clock = FakeClock()
+        sampler = TemplateSampler([1, 1], max_rates=[1, 1], clock=clock)
+        rng = np.random.RandomState(0)
+        picks = [sampler.sample(rng) for _ in range(5)]
+        self.assertEqual([0, 1], sorted(picks[:2]))  # One of each, then caps are ignored
+        self.assertEqual(5, len(picks))
+
+    def test_bad_parameters(self):
+        for weights in ([], [0, 0], [-1, 2], ['1']):
+            with self.assertRaises(ConfigurationError):
+                TemplateSampler(weights)
+        with self.assertRaises(ConfigurationError):
+            TemplateSampler([1], max_rates=[0])
+        with self.assertRaises(ConfigurationError):
+            TemplateSampler([1], max_rates=[1, 2])
+
+    def test_pickle_drops_rate_caps(self):
+        sampler = pickle.loads(pickle.dumps(TemplateSampler([1, 2], max_rates=[1, None])))
+        self.assertEqual([1.0, 2.0], sampler.weights)
+        self.assertFalse(sampler._is_rate_limited)
+
+    def test_parse_sampling_options(self):
+        configs = [config('num_symptoms', 'max'),
+                   config('num_deaths', 'max', {'weight': 3, 'max_rate': 5})]
+        self.assertEqual(([1, 3], [None, 5]), parse_sampling_options(configs))
+        with self.assertRaisesRegex(ConfigurationError, 'wieght'):
+            parse_sampling_options([config('num_deaths', 'max', {'wieght': 3})])
+
+
+class GeneratorSamplingTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = {'report_counts': report_counts(num_rows=3)}
+
+    def test_weights(self):
+        configs = [config('num_symptoms', 'max', {'weight': 0}),
+                   config('num_deaths', 'max')]
+        captcha = CaptchaGenerator(self.data, configs, response_timeout_sec=180, rng_seed=0)
+        answers = {captcha.generate_challenge()[2].correct_answer for _ in range(5)}
+        self.assertEqual({'boston'}, answers)
+
+    def test_update_templates(self):
+        captcha = CaptchaGenerator(self.data, [config('num_symptoms', 'max')],
+                                   response_timeout_sec=180, rng_seed=0)
+        self.assertEqual('new york', captcha.generate_challenge()[2].correct_answer)
+        captcha.update_templates([config('num_symptoms', 'max', {'weight': 0}),
+                                  config('num_deaths', 'min')])
+        self.assertEqual(2, len(captcha.templates))
+        self.assertEqual('los angeles', captcha.generate_challenge()[2].correct_answer)
+
+    def test_update_templates_verification_failure(self):
+        captcha = CaptchaGenerator(self.data, [config('num_symptoms', 'max')], response_timeout_sec=180)
+        old_templates = captcha.templates
+        with self.assertRaisesRegex(ConfigurationError, 'no_such_column'):
+            captcha.update_templates([config('no_such_column', 'max')])
+        self.assertIs(old_templates, captcha.templates)
+
+    def test_bad_config(self):
+        with self.assertRaises(ConfigurationError):
+            CaptchaGenerator(self.data, [config('num_symptoms', 'max', {}) + [{}]],
+                             response_timeout_sec=180)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import concurrent.futures
+import mmap
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from open_captcha.common_types import ConfigurationError
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.shared_tables import SharedTablesFile, attach_tables, publish_tables
+from tests.fake_data import min_max_bar_config
+
+def typed_tables():
+    return {
+        'report_counts': pd.DataFrame({
+            'city_name': ['New York', 'Los Angeles', 'Boston', None],
+            'num_symptoms': np.array([9666, 5000, 800, 0], dtype=np.int64),
+            'rate': [0.5, np.nan, 0.25, 1.0],
+            'flag': [True, False, True, True],
+            'day': pd.to_datetime(['2020-03-01', '2020-03-02', '2020-03-03', '2020-03-04']),
+            'small': pd.Series([1, 2, 3, 4], dtype=np.int8),
+        }),
+        'empty': pd.DataFrame({'a': np.array([], dtype=np.float64), 'b': []}),
+    }
+
+
+def mapping_of(values):
+    base = values
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = base.obj if isinstance(base, memoryview) else base.base
+    return base
+
+
+def sum_in_worker(path):
+    return int(attach_tables(path)['report_counts']['num_symptoms'].sum())
+
+
+class SharedTablesTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, 'tables')
+        self.data = typed_tables()
+
+    def test_round_trip(self):
+        publish_tables(self.path, self.data)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        tables = attach_tables(self.path)
+        self.assertEqual(set(self.data), set(tables))
+        table = tables['report_counts']
+        pd.testing.assert_frame_equal(self.data['report_counts'], table, check_dtype=False,
+                                      check_categorical=False)
+        self.assertEqual('category', table['city_name'].dtype)
+        for column in ['num_symptoms', 'rate', 'flag', 'day', 'small']:
+            self.assertEqual(self.data['report_counts'][column].dtype, table[column].dtype)
+        self.assertEqual(0, len(tables['empty']))
+        self.assertEqual(['a', 'b'], list(tables['empty'].columns))
+
+    def test_views_of_mapping(self):
+        publish_tables(self.path, self.data)
+        table = attach_tables(self.path)['report_counts']
+        values = table['num_symptoms'].to_numpy()
+        self.assertFalse(values.flags.writeable)
+        self.assertEqual(0, values.ctypes.data % 64)
+        mapping = mapping_of(values)
+        self.assertIsNotNone(mapping)
+        self.assertIs(mapping, mapping_of(table['city_name'].array._codes))
+
+    def test_from_rows(self):
+        rows = [dict(city_name='Haifa', num_symptoms=1), dict(city_name='Acre', num_symptoms=3)]
+        publish_tables(self.path, {'report_counts': rows})
+        self.assertEqual(['Haifa', 'Acre'], list(attach_tables(self.path)['report_counts']['city_name']))
+
+    def test_other_process(self):
+        publish_tables(self.path, self.data)
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            self.assertEqual(15466, executor.submit(sum_in_worker, self.path).result())
+
+    def test_bad_tables(self):
+        with self.assertRaisesRegex(ConfigurationError, 'strings'):
+            publish_tables(self.path, {'t': pd.DataFrame({1: [1]})})
+        with self.assertRaisesRegex(ConfigurationError, 'share'):
+            publish_tables(self.path, {'t': pd.DataFrame({'a': [object()]})})
+        self.assertFalse(os.path.exists(self.path))
+        for contents in [b'', b'not a tables file', b'OCTABLE1' + (100).to_bytes(8, 'little')]:
+            with open(self.path, 'wb') as f:
+                f.write(contents)
+            with self.assertRaisesRegex(ConfigurationError, 'not a shared tables file'):
+                attach_tables(self.path)
+
+
+class SharedTablesFileTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, 'tables')
+        self.data = typed_tables()
+
+    def test_switch_over(self):
+        publish_tables(self.path, self.data)
+        shared = SharedTablesFile(self.path)
+        captcha = CaptchaGenerator(shared.poll(), [min_max_bar_config()], response_timeout_sec=180,
+                                   verify_config=False)
+        self.assertEqual('new york', captcha.generate_challenge()[2].correct_answer)
+        self.assertIsNone(shared.poll())
+
+        publish_tables(self.path, {'report_counts': pd.DataFrame(
+            {'city_name': ['Haifa', 'Eilat', 'Acre'], 'num_symptoms': [1, 2, 3]})})
+        old_table = captcha.data['report_counts']
+        tables = shared.poll()
+        self.assertIsNotNone(tables)
+        captcha.update_tables(tables)
+        self.assertEqual('acre', captcha.generate_challenge()[2].correct_answer)
+        self.assertIsNone(shared.poll())
+        # The old snapshot stays valid while still in use
+        self.assertEqual(15466, old_table['num_symptoms'].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
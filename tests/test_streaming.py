@@ -0,0 +1,138 @@
+import io
+import sqlite3
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from open_captcha.common_types import ConfigurationError
+from open_captcha.captcha_generator import CaptchaGenerator
+from open_captcha.challenge_templates import MinMaxBarTemplate
+from open_captcha.streaming import TableStream, TopRows, reduce_stream, reduce_streams
+from tests.fake_data import min_max_bar_config, report_counts
+
+
+def random_rows(num_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    # Few distinct values, so there are many ties
+    return [dict(label=f'row {i}', value=int(value), other='x')
+            for i, value in enumerate(rng.randint(0, 20, num_rows))]
+
+
+class TopRowsTest(unittest.TestCase):
+    def test_same_selection_as_full_table(self):
+        rows = random_rows(300)
+        full_table = pd.DataFrame.from_records(rows)
+        for is_max in (True, False):
+            for chunk_size in (1, 7, 100, 5000):
+                template = MinMaxBarTemplate('?', 't', 'label', 'value',
+                                             'max' if is_max else 'min', n=5)
+                table = reduce_stream('t', TableStream.from_rows(rows, chunk_size),
+                                      template.row_summaries())
+                self.assertEqual(['label', 'value'], list(table.columns))
+                self.assertLessEqual(len(table), 5)
+                expected = template.select(full_table)
+                actual = template.select(table)
+                np.testing.assert_array_equal(expected.labels, actual.labels)
+                np.testing.assert_array_equal(expected.values, actual.values)
+
+    def test_bounded_rows(self):
+        summary = TopRows('t', 'value', k=3)
+        for chunk in TableStream.from_rows(random_rows(100), chunk_size=10).chunks():
+            summary.update(chunk)
+            self.assertLessEqual(len(summary.rows()), 3)
+
+    def test_rows_of_several_summaries_are_merged(self):
+        summaries = [TopRows('t', 'value', 2, largest=True, columns=['label', 'value']),
+                     TopRows('t', 'value', 2, largest=False, columns=['label', 'value']),
+                     TopRows('t', 'value', 1, largest=True, columns=['value'])]
+        rows = [dict(label=str(v), value=v, other=0) for v in [3, 1, 4, 1, 5, 9, 2, 6]]
+        table = reduce_stream('t', TableStream.from_rows(rows, chunk_size=3), summaries)
+        # In original order, without duplicates
+        self.assertEqual(['1', '1', '9', '6'], list(table['label']))
+        self.assertEqual(list(range(4)), list(table.index))
+
+    def test_empty_stream(self):
+        table = reduce_stream('t', TableStream.from_rows([]), [TopRows('t', 'value', 2)])
+        self.assertEqual(0, len(table))
+
+    def test_missing_column(self):
+        with self.assertRaisesRegex(ConfigurationError, 'value.*table t'):
+            reduce_stream('t', TableStream.from_rows([dict(label='a')]), [TopRows('t', 'value', 2)])
+
+
+class SourcesTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = report_counts(num_rows=5)
+
+    def _assert_reduced(self, stream):
+        summary = TopRows('report_counts', 'num_symptoms', 2, columns=['city_name', 'num_symptoms'])
+        table = reduce_stream('report_counts', stream, [summary])
+        self.assertEqual(['New York', 'Los Angeles'], list(table['city_name']))
+        self.assertEqual(['city_name', 'num_symptoms'], list(table.columns))
+
+    def test_cursor(self):
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE report_counts (city_name, num_symptoms, num_deaths)')
+        connection.executemany('INSERT INTO report_counts VALUES (?, ?, ?)',
+                               [tuple(row.values()) for row in self.rows])
+        cursor = connection.execute('SELECT * FROM report_counts')
+        self._assert_reduced(TableStream.from_cursor(cursor, chunk_size=2))
+
+    def test_csv(self):
+        csv = pd.DataFrame.from_records(self.rows).to_csv(index=False)
+        with mock.patch('pandas.read_csv', wraps=pd.read_csv) as read_csv:
+            self._assert_reduced(TableStream.from_csv(io.StringIO(csv), chunk_size=2))
+        usecols = read_csv.call_args.kwargs['usecols']
+        self.assertTrue(usecols('city_name'))
+        self.assertFalse(usecols('num_deaths'))
+
+    def test_custom_reader(self):
+        def read_chunks(columns):
+            df = pd.DataFrame.from_records(self.rows)
+            yield df[:2]
+            yield df[2:]
+        self._assert_reduced(TableStream(read_chunks))
+
+
+class GeneratorWithStreamsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = report_counts(num_rows=5)
+        self.template_configs = [
+            min_max_bar_config(),
+            min_max_bar_config(question='Least deaths?', values='num_deaths', variant='min', n=2),
+        ]
+
+    def test_generate(self):
+        data = {'report_counts': TableStream.from_rows(iter(self.rows), chunk_size=2)}
+        captcha = CaptchaGenerator(data, self.template_configs, response_timeout_sec=180)
+        # Top 3 symptoms and bottom 2 deaths
+        self.assertEqual(['New York', 'Los Angeles', 'Boston', 'Detroit', 'West Yellowstone'],
+                         list(captcha.data['report_counts']['city_name']))
+        answers = {captcha.generate_challenge()[2].correct_answer for _ in range(10)}
+        self.assertEqual({'new york', 'detroit'}, answers)
+
+        new_rows = [dict(row, num_symptoms=-row['num_symptoms']) for row in self.rows]
+        captcha.update_tables({'report_counts': TableStream.from_rows(new_rows)})
+        self.assertEqual(3, len(captcha.data['report_counts']))
+        answers = {captcha.generate_challenge()[2].correct_answer for _ in range(10)}
+        self.assertEqual({'detroit'}, answers)
+
+    def test_template_without_summaries(self):
+        template = mock.Mock(**{'referenced_tables.return_value': None,
+                                'row_summaries.return_value': None})
+        with self.assertRaisesRegex(ConfigurationError, 'needs the full table'):
+            reduce_streams({'t': TableStream.from_rows(self.rows)}, [template])
+
+    def test_unused_stream_is_not_read(self):
+        stream = mock.Mock()
+        template = mock.Mock(**{'referenced_tables.return_value': ['other']})
+        self.assertEqual({}, reduce_streams({'t': stream}, [template]))
+        stream.chunks.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
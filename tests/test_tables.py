@@ -0,0 +1,207 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from open_captcha.common_types import ConfigurationError
+from open_captcha.captcha_generator import CaptchaGenerator, _columns_used_by
+from open_captcha.challenge_templates import instantiate_templates
+from open_captcha.tables import compact_table, compact_tables, load_table, load_tables, memory_usage
+from tests.fake_data import min_max_bar_config, report_counts
+
+try:
+    import pyarrow
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+
+def columns_of(rows):
+    return {
+        'city_name': np.array([row['city_name'] for row in rows], dtype=object),
+        'num_symptoms': np.array([row['num_symptoms'] for row in rows]),
+    }
+
+
+class LoadTableTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = report_counts(deaths=False)
+        self.columns = columns_of(self.rows)
+
+    def _assert_expected_frame(self, df):
+        pd.testing.assert_frame_equal(pd.DataFrame.from_records(self.rows), df, check_dtype=False)
+
+    def test_rows(self):
+        self._assert_expected_frame(load_table('t', self.rows))
+
+    def test_numpy_columns_are_not_copied(self):
+        df = load_table('t', self.columns)
+        self._assert_expected_frame(df)
+        self.assertTrue(np.shares_memory(df['num_symptoms'].to_numpy(), self.columns['num_symptoms']))
+
+    def test_sequence_columns(self):
+        self._assert_expected_frame(load_table('t', {name: list(c) for name, c in self.columns.items()}))
+
+    def test_data_frame_is_used_as_is(self):
+        df = pd.DataFrame(self.columns)
+        self.assertIs(df, load_table('t', df))
+
+    def test_bad_tables(self):
+        with self.assertRaisesRegex(ConfigurationError, 'table t'):
+            load_table('t', {'a': np.arange(3), 'b': np.arange(4)})
+
+    def test_load_tables(self):
+        tables = load_tables({'a': self.rows, 'b': self.columns})
+        self.assertEqual({'a', 'b'}, set(tables))
+
+    def test_missing_pyarrow(self):
+        with mock.patch.dict('sys.modules', {'pyarrow': None, 'pyarrow.feather': None}):
+            with self.assertRaisesRegex(ConfigurationError, 'pyarrow'):
+                load_table('t', 'table.arrow')
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class ArrowTablesTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = report_counts(deaths=False)
+        self.columns = columns_of(self.rows)
+        self.arrow_table = pyarrow.table({name: list(c) for name, c in self.columns.items()})
+
+    def test_arrow_table(self):
+        df = load_table('t', self.arrow_table)
+        pd.testing.assert_frame_equal(pd.DataFrame.from_records(self.rows), df, check_dtype=False)
+        values = self.arrow_table.column('num_symptoms').chunk(0).to_numpy()
+        self.assertTrue(np.shares_memory(df['num_symptoms'].to_numpy(), values))
+
+    def test_arrow_ipc_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'report_counts.arrow')
+            pyarrow.feather.write_feather(self.arrow_table, path, compression='uncompressed')
+            df = load_table('t', path)
+            pd.testing.assert_frame_equal(pd.DataFrame.from_records(self.rows), df, check_dtype=False)
+            del df
+
+    def test_missing_file(self):
+        with self.assertRaisesRegex(ConfigurationError, 'table t'):
+            load_table('t', os.path.join(tempfile.gettempdir(), 'no-such-table.arrow'))
+
+
+class GeneratorWithColumnsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = report_counts(deaths=False)
+        self.columns = columns_of(self.rows)
+        self.template_configs = [min_max_bar_config()]
+
+    def test_generate_and_update(self):
+        captcha = CaptchaGenerator({'report_counts': self.columns}, self.template_configs,
+                                   response_timeout_sec=180)
+        _, challenge, context = captcha.generate_challenge()
+        self.assertEqual('new york', context.correct_answer)
+        captcha.update_tables({'report_counts': pd.DataFrame(
+            {'city_name': ['Haifa', 'Eilat', 'Acre'], 'num_symptoms': [1, 2, 3]})})
+        _, challenge, context = captcha.generate_challenge()
+        self.assertEqual('acre', context.correct_answer)
+
+
+class CompactTablesTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.table = pd.DataFrame({
+            'city_name': ['New York', 'Boston', 'New York', 'Boston'],
+            'small_ints': np.array([1, 2, 3, 127], dtype=np.int64),
+            'big_ints': np.array([1, 2, 3, 2 ** 40], dtype=np.int64),
+            'exact_floats': [0.5, 1.0, 2.25, np.nan],
+            'inexact_floats': [0.1, 0.2, 0.3, 0.4],
+            'flags': [True, False, True, False],
+            'unused': ['a', 'b', 'c', 'd'],
+        })
+
+    def test_compact_table(self):
+        compact = compact_table(self.table)
+        self.assertEqual('category', compact['city_name'].dtype)
+        self.assertEqual(np.int8, compact['small_ints'].dtype)
+        self.assertEqual(np.int64, compact['big_ints'].dtype)
+        self.assertEqual(np.float32, compact['exact_floats'].dtype)
+        self.assertEqual(np.float64, compact['inexact_floats'].dtype)
+        self.assertEqual(bool, compact['flags'].dtype)
+        pd.testing.assert_frame_equal(self.table, compact, check_dtype=False,
+                                      check_categorical=False)
+
+    def test_column_pruning(self):
+        compact = compact_table(self.table, {'city_name', 'small_ints', 'no_such_column'})
+        self.assertEqual(['city_name', 'small_ints'], list(compact.columns))
+
+    def test_compact_tables(self):
+        tables = {'a': self.table, 'b': self.table}
+        self.assertEqual({'a', 'b'}, set(compact_tables(tables, None)))
+        compact = compact_tables(tables, {'a': None})
+        self.assertEqual(['a'], list(compact))
+        self.assertEqual(list(self.table.columns), list(compact['a'].columns))
+
+    def test_memory_usage(self):
+        usage = memory_usage({'t': self.table})
+        self.assertLess(memory_usage({'t': compact_table(self.table, {'small_ints'})})['t'],
+                        usage['t'])
+
+
+class GeneratorCompactTablesTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = report_counts(deaths=False)
+        self.columns = columns_of(self.rows)
+        self.template_configs = [min_max_bar_config()]
+
+    def test_compact_tables(self):
+        data = {
+            'report_counts': [dict(row, unused='x' * 100) for row in self.rows],
+            'unused_table': self.rows,
+        }
+        captcha = CaptchaGenerator(data, self.template_configs, response_timeout_sec=180,
+                                   compact_tables=True)
+        self.assertEqual(['report_counts'], list(captcha.data))
+        self.assertEqual(['city_name', 'num_symptoms'], list(captcha.data['report_counts'].columns))
+        self.assertEqual(np.int16, captcha.data['report_counts']['num_symptoms'].dtype)
+        full = CaptchaGenerator(data, self.template_configs, response_timeout_sec=180)
+        self.assertLess(captcha.table_memory_usage()['report_counts'],
+                        full.table_memory_usage()['report_counts'])
+
+        _, challenge, context = captcha.generate_challenge()
+        self.assertEqual('new york', context.correct_answer)
+        self.assertEqual(['Boston', 'Los Angeles', 'New York'], sorted(challenge.possible_answers))
+        captcha.update_tables({'report_counts': self.rows})
+        self.assertEqual(['city_name', 'num_symptoms'], list(captcha.data['report_counts'].columns))
+
+    def test_same_charts(self):
+        compact = CaptchaGenerator({'report_counts': self.rows}, self.template_configs,
+                                   response_timeout_sec=180, rng_seed=0, compact_tables=True)
+        full = CaptchaGenerator({'report_counts': self.rows}, self.template_configs,
+                                response_timeout_sec=180, rng_seed=0)
+        for _ in range(3):
+            _, compact_challenge, _ = compact.generate_challenge()
+            _, full_challenge, _ = full.generate_challenge()
+            self.assertEqual(full_challenge, compact_challenge)
+
+    def test_columns_used_by(self):
+        templates = instantiate_templates(self.template_configs + [
+            ['min-max-bar', dict(question='?', table='report_counts', labels='city_name',
+                                 values='num_deaths', variant='min')],
+            ['min-max-bar', dict(question='?', table='other', labels='a', values='b',
+                                 variant='min')],
+        ])
+        self.assertEqual({'report_counts': {'city_name', 'num_symptoms', 'num_deaths'},
+                          'other': {'a', 'b'}}, _columns_used_by(templates))
+        templates.append(mock.Mock(**{'referenced_tables.return_value': ['other'],
+                                      'referenced_columns.return_value': None}))
+        self.assertIsNone(_columns_used_by(templates)['other'])
+        templates.append(mock.Mock(**{'referenced_tables.return_value': None}))
+        self.assertIsNone(_columns_used_by(templates))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import base64
+import unittest
+import unittest.mock
+from open_captcha.common_types import ConfigurationError, ServerContext
+from open_captcha.tokens import InvalidToken, ReplayFilter, TokenSigner
+from open_captcha.verification import ResponseVerifier
+
+
+class TokenSignerTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.keys = {'k1': TokenSigner.generate_key(), 'k2': TokenSigner.generate_key()}
+        self.signer = TokenSigner(self.keys, current_key_id='k1')
+        self.context = ServerContext(timestamp=1234567890, verification_attempt_number=2,
+                                     correct_answer='תל אביב and a rather long answer' * 3)
+
+    def test_roundtrip(self):
+        token = self.signer.seal(self.context)
+        self.assertIsInstance(token, str)
+        self.assertNotIn('rather', base64.urlsafe_b64decode(token + '==').decode('latin-1'))
+        nonce, context = self.signer.unseal(token)
+        self.assertEqual(context, self.context)
+        self.assertEqual(len(nonce), 16)
+        # Every token is unique
+        token2 = self.signer.seal(self.context)
+        self.assertNotEqual(token2, token)
+        self.assertNotEqual(self.signer.unseal(token2)[0], nonce)
+
+    def test_key_rotation(self):
+        old_token = self.signer.seal(self.context)
+        rotated = TokenSigner(self.keys, current_key_id='k2')
+        self.assertEqual(rotated.unseal(old_token)[1], self.context)
+        self.assertEqual(self.signer.unseal(rotated.seal(self.context))[1], self.context)
+        retired = TokenSigner({'k2': self.keys['k2']}, current_key_id='k2')
+        with self.assertRaisesRegex(InvalidToken, 'Unknown key ID'):
+            retired.unseal(old_token)
+
+    def test_tampering(self):
+        token = self.signer.seal(self.context)
+        raw = bytearray(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        for i in range(len(raw)):
+            tampered = bytearray(raw)
+            tampered[i] ^= 1
+            with self.assertRaises(InvalidToken):
+                self.signer.unseal(base64.urlsafe_b64encode(bytes(tampered)).decode())
+        other_signer = TokenSigner({'k1': TokenSigner.generate_key()}, current_key_id='k1')
+        with self.assertRaisesRegex(InvalidToken, 'signature'):
+            other_signer.unseal(token)
+        for garbage in ['', 'a', '!!!!', 'AQ', token[:20]]:
+            with self.assertRaises(InvalidToken):
+                self.signer.unseal(garbage)
+
+    def test_bad_config(self):
+        with self.assertRaisesRegex(ConfigurationError, 'not found'):
+            TokenSigner(self.keys, current_key_id='nosuch')
+        with self.assertRaisesRegex(ConfigurationError, 'at least'):
+            TokenSigner({'short': b'123'}, current_key_id='short')
+        with self.assertRaisesRegex(ConfigurationError, 'too long'):
+            TokenSigner({'k' * 256: TokenSigner.generate_key()}, current_key_id='k' * 256)
+
+
+class ReplayFilterTest(unittest.TestCase):
+    def test_check_and_add(self):
+        replay_filter = ReplayFilter(max_entries=3)
+        self.assertTrue(replay_filter.check_and_add(b'a', 110, now=100))
+        self.assertFalse(replay_filter.check_and_add(b'a', 110, now=100))
+        self.assertTrue(replay_filter.check_and_add(b'b', 120, now=100))
+        self.assertTrue(replay_filter.check_and_add(b'c', 130, now=100))
+        # Full, so the entry closest to expiry is dropped
+        self.assertTrue(replay_filter.check_and_add(b'd', 140, now=100))
+        self.assertEqual(len(replay_filter), 3)
+        self.assertFalse(replay_filter.check_and_add(b'b', 120, now=100))
+        # Expired entries are dropped
+        self.assertTrue(replay_filter.check_and_add(b'e', 150, now=135))
+        self.assertEqual(len(replay_filter), 2)
+
+
+class VerifyTokenTest(unittest.TestCase):
+    @unittest.mock.patch('open_captcha.verification._get_timestamp')
+    def test_verify_token(self, mock_get_timestamp):
+        mock_get_timestamp.return_value = 1000
+        signer = TokenSigner({'k': TokenSigner.generate_key()}, current_key_id='k')
+        verifier = ResponseVerifier(response_timeout_sec=60, token_signer=signer)
+        self.assertIsInstance(verifier.replay_filter, ReplayFilter)
+
+        def new_token():
+            return signer.seal(ServerContext(timestamp=990, verification_attempt_number=1, correct_answer='boston'))
+
+        token = new_token()
+        self.assertTrue(verifier.verify_token('Bostn', token))
+        self.assertFalse(verifier.verify_token('Boston', token))  # Single use
+        token = new_token()
+        self.assertFalse(verifier.verify_token('New York', token))
+        self.assertFalse(verifier.verify_token('Boston', token))  # Wrong answers use up the token as well
+        self.assertFalse(verifier.verify_token('Boston', 'garbage'))
+        mock_get_timestamp.return_value = 1051
+        self.assertFalse(verifier.verify_token('Boston', new_token()))
+
+    def test_verify_token_without_signer(self):
+        with self.assertRaisesRegex(ConfigurationError, 'token_signer'):
+            ResponseVerifier(response_timeout_sec=60).verify_token('Boston', 'token')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import subprocess
+import sys
+import textwrap
+import time
+import unittest
+import unittest.mock
+from open_captcha.common_types import ServerContext
+import numpy as np
+from open_captcha.verification import (
+    _get_timestamp, _verify_timeout, _verify_text_is_close, normalize_answer, ResponseVerifier,
+    TIMEOUT, WRONG_ANSWER,
+)
+
+
+class HelperFunctionsTest(unittest.TestCase):
+    def test_get_timestamp(self):
+        t = _get_timestamp()
+        self.assertIsInstance(t, int)
+        time.sleep(1.1)
+        t2 = _get_timestamp()
+        self.assertGreaterEqual(t2 - t, 1)
+        self.assertLessEqual(t2 - t, 3)
+
+    @unittest.mock.patch('open_captcha.verification._get_timestamp')
+    def test_verify_timeout(self, mock_get_timestamp):
+        t0 = 100
+        delta = 10
+        mock_get_timestamp.return_value = t0 + delta
+        self.assertEqual(_verify_timeout(t0, timeout=delta), True)
+        mock_get_timestamp.assert_called_once_with()
+        self.assertEqual(_verify_timeout(t0, timeout=delta - 1), False)
+
+    def test_normalize_answer(self):
+        self.assertEqual(normalize_answer('  New\t York  '), 'new york')
+        self.assertEqual(normalize_answer('STRAßE'), 'strasse')
+        self.assertEqual(normalize_answer('ｔｅｌ\u00a0aviv'), 'tel aviv')  # Full width and no-break space
+        self.assertEqual(normalize_answer('תֵּל אָבִיב-יָפוֹ'), 'תל אביב-יפו')
+        self.assertEqual(normalize_answer('באר־שבע'), 'באר־שבע')  # Maqaf is kept
+
+    def test_verify_text_is_close_normalizes_user_answer(self):
+        self.assertEqual(_verify_text_is_close('new york', ' NEW  YORK ', 5), True)
+        self.assertEqual(_verify_text_is_close('תל אביב', 'תֵּל אָבִיב', 5), True)
+        self.assertEqual(_verify_text_is_close('abcde', 'abcdeXX', 5), False)  # Length difference too large
+        self.assertEqual(_verify_text_is_close('abcde', 'X' * 10 ** 6, 5), False)
+
+    def test_verify_text_is_close_normalizes_correct_answer(self):
+        self.assertEqual(_verify_text_is_close('USA', 'USA', 5), True)
+        self.assertEqual(_verify_text_is_close('NYC', 'nyc', 5), True)
+        self.assertEqual(_verify_text_is_close('New  York', 'new yorx', 5), True)
+        self.assertEqual(_verify_text_is_close('USA', 'UK', 5), False)
+
+    @unittest.mock.patch('open_captcha.verification.normalize_answer')
+    @unittest.mock.patch('open_captcha.verification.Levenshtein.distance')
+    def test_verify_text_is_close_fast_paths(self, mock_distance, mock_normalize):
+        mock_normalize.side_effect = lambda text: text
+        self.assertEqual(_verify_text_is_close('abcde', 'abcde', 5), True)
+        self.assertEqual(_verify_text_is_close('abcde', 'abcdefgh', 5), False)
+        mock_distance.assert_not_called()
+        # Huge answers are rejected before even being normalized
+        self.assertEqual(_verify_text_is_close('abcde', 'a' * 1000, 5), False)
+        mock_normalize.assert_any_call('abcdefgh')
+        self.assertNotIn(unittest.mock.call('a' * 1000), mock_normalize.call_args_list)
+        mock_distance.return_value = 1
+        self.assertEqual(_verify_text_is_close('abcde', 'abcdX', 5), True)
+        mock_distance.assert_called_once_with('abcdX', 'abcde', score_cutoff=1)
+
+    def test_verify_text_is_close(self):
+        self.assertEqual(_verify_text_is_close('abcde', 'abcde', 5), True)
+        self.assertEqual(_verify_text_is_close('abcde', 'abc', 5), False)
+        self.assertEqual(_verify_text_is_close('abcde', 'XbcdX', 5), False)
+        self.assertEqual(_verify_text_is_close('abcdef', 'XbcdXf', 5), True)
+        self.assertEqual(_verify_text_is_close('abcde', 'XbcdX', 4), True)
+        self.assertEqual(_verify_text_is_close('abcd', 'XbcdX', 4), False)
+
+
+class ResponseVerifierTest(unittest.TestCase):
+    @unittest.mock.patch('open_captcha.verification._get_timestamp')
+    def test_verify_response(self, mock_get_timestamp):
+        mock_get_timestamp.return_value = 1000
+        verifier = ResponseVerifier(response_timeout_sec=60)
+        context = ServerContext(timestamp=950, verification_attempt_number=1, correct_answer='New York')
+        self.assertTrue(verifier.verify_response('New York', context))
+        self.assertTrue(verifier.verify_response('New Yorx', context))
+        self.assertTrue(verifier.verify_response('USA', ServerContext(950, 1, 'USA')))
+        self.assertFalse(verifier.verify_response('Boston', context))
+        mock_get_timestamp.return_value = 1011
+        self.assertFalse(verifier.verify_response('New York', context))
+
+    @unittest.mock.patch('open_captcha.verification._get_timestamp')
+    def test_verify_responses(self, mock_get_timestamp):
+        mock_get_timestamp.return_value = 1000
+        verifier = ResponseVerifier(response_timeout_sec=60)
+        responses = []
+        for i in range(2000):
+            context = ServerContext(timestamp=1000 - 59 - i % 3, verification_attempt_number=1,
+                                    correct_answer=f'City {i}')
+            answer = [f'City {i}', f'City {i + 1}x', f'Cty {i}', 'Nope'][i % 4]
+            responses.append((answer, context))
+        expected = [verifier.verify_response(answer, context) for answer, context in responses]
+        mock_get_timestamp.reset_mock()
+        for workers in (None, 4):
+            result = verifier.verify_responses(iter(responses), workers=workers)
+            mock_get_timestamp.assert_called_once_with()
+            mock_get_timestamp.reset_mock()
+            self.assertEqual(result.is_ok.dtype, np.bool_)
+            self.assertEqual(result.is_ok.tolist(), expected)
+            num_timeouts = sum(1 for _, context in responses if context.timestamp < 940)
+            self.assertEqual(result.failure_counts, {
+                TIMEOUT: num_timeouts,
+                WRONG_ANSWER: len(responses) - num_timeouts - sum(expected),
+            })
+
+        result = verifier.verify_responses([])
+        self.assertEqual(len(result.is_ok), 0)
+        self.assertEqual(result.failure_counts, {TIMEOUT: 0, WRONG_ANSWER: 0})
+
+    def test_verification_does_not_import_heavy_dependencies(self):
+        code = textwrap.dedent("""\
+            import sys
+            import open_captcha
+            from open_captcha import ResponseVerifier, ServerContext
+            from open_captcha.verification import ResponseVerifier
+            heavy = {'numpy', 'pandas', 'matplotlib'} & set(sys.modules)
+            assert not heavy, heavy
+            # Lazily imported names still work
+            assert open_captcha.CaptchaGenerator.__name__ == 'CaptchaGenerator'
+        """)
+        subprocess.run([sys.executable, '-c', code], check=True)
+
+
+if __name__ == '__main__':
+    unittest.main()